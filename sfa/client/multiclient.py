@@ -1,58 +1,127 @@
 import threading
 import traceback
 import time
-from Queue import Queue
+from Queue import Queue, Empty
 from sfa.util.sfalogging import logger
 
-def ThreadedMethod(callable, results, errors):
-    """
-    A function decorator that returns a running thread. The thread
-    runs the specified callable and stores the result in the specified
-    results queue
-    """
-    def wrapper(args, kwds):
-        class ThreadInstance(threading.Thread): 
-            def run(self):
-                try:
-                    results.put(callable(*args, **kwds))
-                except Exception, e:
-                    logger.log_exc('MultiClient: Error in thread: ')
-                    errors.put(traceback.format_exc())
-                    
-        thread = ThreadInstance()
-        thread.start()
-        return thread
-    return wrapper
-
- 
+##
+# All MultiClient instances in a process share one bounded pool of threads,
+# instead of starting a fresh thread per call; threads are started lazily,
+# as jobs come in, up to max_threads, and then stay around for reuse
+
+class ThreadPool:
+
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+        self.jobs = Queue()
+        self.lock = threading.Lock()
+        self.threads = 0
+        self.idle = 0
+
+    def submit(self, job):
+        with self.lock:
+            start = self.idle <= self.jobs.qsize() and self.threads < self.max_threads
+            if start:
+                self.threads += 1
+        if start:
+            thread = threading.Thread(target=self.worker)
+            thread.setDaemon(True)
+            thread.start()
+        self.jobs.put(job)
+
+    def worker(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            job = self.jobs.get()
+            with self.lock:
+                self.idle -= 1
+            try:
+                job()
+            except:
+                logger.log_exc('MultiClient: Error in pool thread: ')
+
+DEFAULT_MAX_THREADS = 32
+thread_pool = ThreadPool(DEFAULT_MAX_THREADS)
+
+##
+# Set the maximum number of threads used by all MultiClient instances
+
+def set_max_threads(max_threads):
+    thread_pool.max_threads = max_threads
 
 class MultiClient:
     """
     MultiClient allows to issue several SFA calls in parallel in different threads
     and stores the results in a thread safe queue. 
+
+    If a timeout (in seconds) is given, the results that are not in by then
+    are given up on: get_results returns what has been received, and
+    get_errors reports the calls that timed out
     """
 
-    def __init__(self):
+    def __init__(self, timeout=None):
         self.results = Queue()
         self.errors = Queue()
-        self.threads = []
+        # one item per completed call: (True, result) or (False, traceback)
+        self.completed = Queue()
+        self.submitted = 0
+        self.received = 0
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = time.time() + timeout
 
     def run (self, method, *args, **kwds):
         """
         Execute a callable in a separate thread.    
         """
-        method = ThreadedMethod(method, self.results, self.errors)
-        thread = method(args, kwds)
-        self.threads.append(thread)
+        completed = self.completed
+        def job():
+            try:
+                completed.put((True, method(*args, **kwds)))
+            except Exception, e:
+                logger.log_exc('MultiClient: Error in thread: ')
+                completed.put((False, traceback.format_exc()))
+        self.submitted += 1
+        thread_pool.submit(job)
 
     start = run
 
+    def iter_results(self):
+        """
+        Yield results as they come in, until all calls are complete
+        or the timeout expires; errors are set aside for get_errors
+        """
+        while self.received < self.submitted:
+            try:
+                if self.deadline is None:
+                    (success, value) = self.completed.get()
+                else:
+                    (success, value) = self.completed.get(timeout=max(0, self.deadline - time.time()))
+            except Empty:
+                self.time_out()
+                return
+            self.received += 1
+            if success:
+                yield value
+            else:
+                self.errors.put(value)
+
     def join(self):
         """
-        Wait for all threads to complete  
+        Wait for all threads to complete, or for the timeout to expire
         """
-        for thread in self.threads:
-            thread.join()
+        for result in self.iter_results():
+            self.results.put(result)
+
+    def time_out(self):
+        missing = self.submitted - self.received
+        logger.warning("MultiClient: giving up on %d call(s) after timeout" % missing)
+        for i in range(missing):
+            self.errors.put("MultiClient: call timed out")
+        # the late results will go to a queue that nobody reads
+        self.completed = Queue()
+        self.received = self.submitted
 
     def get_results(self, lenient=True):
         """
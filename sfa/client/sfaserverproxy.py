@@ -4,7 +4,12 @@
 import ssl
 ssl_needs_unverified_context = hasattr(ssl, '_create_unverified_context')
 
+import os
+import time
+import socket
+import threading
 import xmlrpclib
+import httplib
 from httplib import HTTPS, HTTPSConnection
 
 try:
@@ -29,6 +34,125 @@ class ExceptionUnmarshaller(xmlrpclib.Unmarshaller):
         except xmlrpclib.Fault, e:
             raise ServerException(e.faultString)
 
+##
+# ConnectionPool
+#
+# Keeps the HTTPS connections that are done with a call open, so that the
+# next call to the same server, from any SfaServerProxy in the process,
+# can be sent on the same connection instead of opening a new one and
+# going through a new TLS handshake
+#
+# Connections are pooled per (host, key_file, cert_file), and the time
+# these files were last modified, so that a new key or certificate is used
+# right away; at most max_per_host idle connections are kept for each, and
+# they are closed once they have been idle for max_idle seconds
+
+DEFAULT_POOL_MAX_IDLE = 60
+DEFAULT_POOL_MAX_PER_HOST = 4
+
+class ConnectionPool:
+
+    def __init__(self, max_idle=DEFAULT_POOL_MAX_IDLE, max_per_host=DEFAULT_POOL_MAX_PER_HOST):
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.lock = threading.Lock()
+        # key -> list of (connection, time it was released), oldest first
+        self.idle = {}
+        # files_key(key_file, cert_file) -> ssl context, so that keys are read only once
+        self.contexts = {}
+        self.created = 0
+        self.reused = 0
+
+    ##
+    # Return an idle connection for key, or None
+
+    def get(self, key):
+        with self.lock:
+            self.expire()
+            conns = self.idle.get(key)
+            if not conns:
+                return None
+            self.reused += 1
+            return conns.pop()[0]
+
+    ##
+    # Give back a connection that is done with its call
+
+    def put(self, key, conn):
+        # the server has closed the connection
+        if conn.sock is None:
+            return
+        with self.lock:
+            self.expire()
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_per_host:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def expire(self):
+        limit = time.time() - self.max_idle
+        for (key, conns) in self.idle.items():
+            while conns and conns[0][1] < limit:
+                conns.pop(0)[0].close()
+            if not conns:
+                del self.idle[key]
+
+    def clear(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for (conn, released) in conns:
+                    conn.close()
+            self.idle = {}
+
+    def get_context(self, key_file, cert_file):
+        key = files_key(key_file, cert_file)
+        with self.lock:
+            if key not in self.contexts:
+                context = ssl._create_unverified_context()
+                if key_file or cert_file:
+                    context.load_cert_chain(cert_file, key_file)
+                # forget about the previous versions of these files
+                for previous in self.contexts.keys():
+                    if previous[:2] == key[:2]:
+                        del self.contexts[previous]
+                self.contexts[key] = context
+            return self.contexts[key]
+
+    def count_created(self):
+        with self.lock:
+            self.created += 1
+
+    def stats(self):
+        with self.lock:
+            return {'idle': sum([ len(conns) for conns in self.idle.values() ]),
+                    'created': self.created, 'reused': self.reused}
+
+##
+# Identify a (key_file, cert_file) pair, as of the last time they were changed
+
+def files_key(key_file, cert_file):
+    stamps = []
+    for filename in (key_file, cert_file):
+        try:
+            stamps.append(os.path.getmtime(filename) if filename else None)
+        except OSError:
+            stamps.append(None)
+    return (key_file, cert_file) + tuple(stamps)
+
+# the process-wide pool, shared by all SfaServerProxy instances
+connection_pool = ConnectionPool()
+
+##
+# Change the limits of the process-wide connection pool; a max_per_host
+# of 0 disables pooling
+
+def set_connection_pool_limits(max_idle=None, max_per_host=None):
+    if max_idle is not None:
+        connection_pool.max_idle = max_idle
+    if max_per_host is not None:
+        connection_pool.max_per_host = max_per_host
+
 ##
 # XMLRPCTransport
 #
@@ -43,37 +167,72 @@ class XMLRPCTransport(xmlrpclib.Transport):
         self.timeout=timeout
         self.key_file = key_file
         self.cert_file = cert_file
+        # whether the current connection comes from connection_pool
+        self.reused = False
+        self.use_pool = True
         
     def make_connection(self, host):
+        if self._connection[1] and host == self._connection[0]:
+            return self._connection[1]
         # create a HTTPS connection object from a host descriptor
         # host may be a string, or a (host, x509-dict) tuple
-        host, extra_headers, x509 = self.get_host_info(host)
-        if not ssl_needs_unverified_context:
-            conn = HTTPSConnection(host, None, key_file = self.key_file,
-                                   cert_file = self.cert_file)
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        conn = None
+        if self.use_pool:
+            conn = connection_pool.get(self.pool_key(chost))
+        self.reused = conn is not None
+        if conn is not None:
+            conn.timeout = self.get_timeout()
+            conn.sock.settimeout(conn.timeout)
+        elif not ssl_needs_unverified_context:
+            conn = HTTPSConnection(chost, None, key_file = self.key_file,
+                                   cert_file = self.cert_file, timeout = self.get_timeout())
+            connection_pool.count_created()
         else:
-            conn = HTTPSConnection(host, None, key_file = self.key_file,
-                                   cert_file = self.cert_file,
-                                   context = ssl._create_unverified_context())
-
-        # Some logic to deal with timeouts. It appears that some (or all) versions
-        # of python don't set the timeout after the socket is created. We'll do it
-        # ourselves by forcing the connection to connect, finding the socket, and
-        # calling settimeout() on it. (tested with python 2.6)
+            conn = HTTPSConnection(chost, None, timeout = self.get_timeout(),
+                                   context = connection_pool.get_context(self.key_file, self.cert_file))
+            connection_pool.count_created()
+        self._connection = host, conn
+        return conn
+
+    def get_timeout(self):
         if self.timeout:
-            if hasattr(conn, 'set_timeout'):
-                conn.set_timeout(self.timeout)
-
-            if hasattr(conn, "_conn"):
-                # HTTPS is a wrapper around HTTPSConnection
-                real_conn = conn._conn
-            else:
-                real_conn = conn
-            conn.connect()
-            if hasattr(real_conn, "sock") and hasattr(real_conn.sock, "settimeout"):
-                real_conn.sock.settimeout(float(self.timeout))
+            return float(self.timeout)
+        return socket.getdefaulttimeout()
 
-        return conn
+    def pool_key(self, chost):
+        return (chost,) + files_key(self.key_file, self.cert_file)
+
+    # a pooled connection may have been closed by the server in the meantime,
+    # in which case the call is sent again, once, on a new connection
+    def request(self, host, handler, request_body, verbose=0):
+        try:
+            return self.single_request(host, handler, request_body, verbose)
+        except (socket.error, httplib.BadStatusLine), e:
+            if not self.reused or isinstance(e, socket.timeout):
+                raise
+            logger.debug("xml-rpc: pooled connection to %s was closed, retrying" % host)
+        self.use_pool = False
+        try:
+            return self.single_request(host, handler, request_body, verbose)
+        finally:
+            self.use_pool = True
+
+    def single_request(self, host, handler, request_body, verbose=0):
+        try:
+            result = xmlrpclib.Transport.single_request(self, host, handler, request_body, verbose)
+        except:
+            self.close()
+            raise
+        self.release()
+        return result
+
+    # give the connection back to the pool once the response is read
+    def release(self):
+        host, conn = self._connection
+        if conn:
+            self._connection = (None, None)
+            connection_pool.put(self.pool_key(self.get_host_info(host)[0]), conn)
 
     def getparser(self):
         unmarshaller = ExceptionUnmarshaller()
@@ -221,12 +221,9 @@ class DummyAggregate:
         for node in nodes:
             nodes_dict[node['node_id']] = node
 
-        # convert nodes to rspec nodes
-        rspec_nodes = []
-        for node in nodes:
-            rspec_node = self.node_to_rspec_node(node)
-            rspec_nodes.append(rspec_node)
-        rspec.version.add_nodes(rspec_nodes)
+        # convert nodes to rspec nodes, one at a time as the rspec gets serialized
+        rspec_nodes = ( self.node_to_rspec_node(node) for node in nodes )
+        rspec.stream_nodes(rspec_nodes)
 
         return rspec.toxml()
 
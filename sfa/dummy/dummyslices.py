@@ -97,6 +97,7 @@ class DummySlices:
         resulting_nodes = self.driver.shell.GetNodes({'node_ids': slices[0]['node_ids']})
 
         # update sliver allocations
+        records = []
         for node in resulting_nodes:
             client_id = slivers[node['hostname']]['client_id']
             component_id = slivers[node['hostname']]['component_id']
@@ -106,7 +107,8 @@ class DummySlices:
                                       component_id=component_id,
                                       slice_urn = slice_urn,
                                       allocation_state='geni_allocated')
-            record.sync(self.driver.api.dbsession())
+            records.append(record)
+        SliverAllocation.sync_allocations(records, self.driver.api.dbsession())
         return resulting_nodes
         
 
@@ -140,12 +140,9 @@ class IotLABAggregate(object):
         nodes = self.driver.shell.get_nodes()
         reserved_nodes = self.driver.shell.get_reserved_nodes()
         if not 'error' in nodes and not 'error' in reserved_nodes:
-            # convert nodes to rspec nodes
-            rspec_nodes = []
-            for node in nodes:
-                rspec_node = self.node_to_rspec_node(nodes[node])
-                rspec_nodes.append(rspec_node)
-            rspec.version.add_nodes(rspec_nodes)
+            # convert nodes to rspec nodes, one at a time as the rspec gets serialized
+            rspec_nodes = ( self.node_to_rspec_node(nodes[node]) for node in nodes )
+            rspec.stream_nodes(rspec_nodes)
 
             leases = []
             db_leases = {}
@@ -1,8 +1,10 @@
 import socket
+import threading
 from sfa.rspecs.version_manager import VersionManager
 from sfa.util.version import version_core
 from sfa.util.xrn import Xrn
 from sfa.util.callids import Callids
+from sfa.util.cache import DEFAULT_CACHE_TTL
 from sfa.util.sfalogging import logger
 from sfa.util.faults import SfaInvalidArgument, InvalidRSpecVersion
 from sfa.server.api_versions import ApiVersions
@@ -10,6 +12,11 @@ from sfa.server.api_versions import ApiVersions
 
 class AggregateManager:
 
+    # bumped each time this aggregate changes what it advertises, so that
+    # an advertisement built in the meantime does not make it to the cache
+    advertisement_generation = 0
+    advertisement_lock = threading.Lock()
+
     def __init__ (self, config): pass
     
     # essentially a union of the core version, the generic version (this code) and
@@ -29,6 +36,16 @@ class AggregateManager:
             'geni_ad_rspec_versions': ad_rspec_versions,
             }
 
+    ##
+    # Forget the cached advertisements, after resources were allocated or released
+
+    def invalidate_advertisement(self, api):
+        with AggregateManager.advertisement_lock:
+            AggregateManager.advertisement_generation += 1
+        if api.driver.cache:
+            logger.debug("%s: dropping cached advertisements" % (api.driver.__module__))
+            api.driver.cache.clear(prefix="rspec_")
+
     def get_rspec_version_string(self, rspec_version, options=None):
         if options is None: options={}
         version_string = "rspec_%s" % (rspec_version)
@@ -89,10 +106,12 @@ class AggregateManager:
                 logger.debug("%s.ListResources returning cached advertisement" % (api.driver.__module__))
                 return rspec
        
+        generation = AggregateManager.advertisement_generation
         rspec = api.driver.list_resources (rspec_version, options) 
-        if api.driver.cache:
+        if api.driver.cache and generation == AggregateManager.advertisement_generation:
             logger.debug("%s.ListResources stores advertisement in cache" % (api.driver.__module__))
-            api.driver.cache.add(version_string, rspec)    
+            ttl = getattr(api.config, 'SFA_AGGREGATE_CACHE_TTL', DEFAULT_CACHE_TTL)
+            api.driver.cache.add(version_string, rspec, ttl=ttl)
         return rspec
     
     def Describe(self, api, creds, urns, options):
@@ -117,7 +136,10 @@ class AggregateManager:
         """
         call_id = options.get('call_id')
         if Callids().already_handled(call_id): return ""
-        return api.driver.allocate(xrn, rspec_string, expiration, options)
+        try:
+            return api.driver.allocate(xrn, rspec_string, expiration, options)
+        finally:
+            self.invalidate_advertisement(api)
  
     def Provision(self, api, xrns, creds, options):
         """
@@ -137,12 +159,18 @@ class AggregateManager:
         if not rspec_version:
             raise InvalidRSpecVersion(options['geni_rspec_version'])
                        
-        return api.driver.provision(xrns, options)
+        try:
+            return api.driver.provision(xrns, options)
+        finally:
+            self.invalidate_advertisement(api)
     
     def Delete(self, api, xrns, creds, options):
         call_id = options.get('call_id')
         if Callids().already_handled(call_id): return True
-        return api.driver.delete(xrns, options)
+        try:
+            return api.driver.delete(xrns, options)
+        finally:
+            self.invalidate_advertisement(api)
 
     def Renew(self, api, xrns, creds, expiration_time, options):
         call_id = options.get('call_id')
@@ -10,6 +10,11 @@ class Driver:
         # this is the hrn attached to the running server
         self.hrn = api.config.SFA_INTERFACE_HRN
 
+    # called when the api object starts serving a new incoming request;
+    # drivers can drop whatever they keep for the duration of one request
+    def reset (self):
+        pass
+
     ########################################
     ########## registry oriented
     ########################################
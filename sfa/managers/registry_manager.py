@@ -1,4 +1,5 @@
 import types
+import time
 # for get_key_from_incoming_ip
 import tempfile
 import os
@@ -7,17 +8,19 @@ import commands
 from sfa.util.faults import RecordNotFound, AccountNotEnabled, PermissionError, MissingAuthority, \
     UnknownSfaType, ExistingRecord, NonExistingRecord
 from sfa.util.sfatime import utcparse, datetime_to_epoch
-from sfa.util.prefixTree import prefixTree
 from sfa.util.xrn import Xrn, get_authority, hrn_to_urn, urn_to_hrn
 from sfa.util.version import version_core
 from sfa.util.sfalogging import logger
 
 from sfa.util.printable import printable
 
+from sfa.client.multiclient import MultiClient
+
 from sfa.trust.gid import GID 
 from sfa.trust.credential import Credential
 from sfa.trust.certificate import Certificate, Keypair, convert_public_key
 from sfa.trust.gid import create_uuid
+from sfa.trust.issuedcredentials import issued_credentials, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
 
 from sfa.storage.model import make_record, RegRecord, RegAuthority, RegUser, RegSlice, RegKey, \
     augment_with_sfa_builtins
@@ -67,8 +70,15 @@ def normalize_input_record (record):
 
 class RegistryManager:
 
+    # how long (seconds) a peer registry gets to answer a forwarded call
+    peer_timeout = 30
+
     def __init__ (self, config): 
         logger.info("Creating RegistryManager[%s]"%id(self))
+        # 0 means no timeout
+        self.peer_timeout = getattr(config, 'SFA_REGISTRY_PEER_TIMEOUT', self.peer_timeout) or None
+        issued_credentials.configure(getattr(config, 'SFA_REGISTRY_CREDENTIAL_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                                     getattr(config, 'SFA_REGISTRY_CREDENTIAL_CACHE_TTL', DEFAULT_CACHE_TTL))
 
     # The GENI GetVersion call
     def GetVersion(self, api, options):
@@ -132,24 +142,39 @@ class RegistryManager:
             raise PermissionError("%s has no rights to %s (%s)" % \
                                   (caller_hrn, object_hrn, xrn))    
         object_gid = GID(string=record.gid)
+        expires = None
+        if hasattr(record,'expires'):
+            date = utcparse(record.expires)
+            expires = int(datetime_to_epoch(date))
+
+        # the same credential may well have been issued a moment ago
+        cache_key = None
+        if issued_credentials.is_enabled():
+            cache_key = issued_credentials.key(caller_gid, object_gid, auth_info.get_gid_object(),
+                                               rights, expires)
+            cached = issued_credentials.lookup(cache_key)
+            if cached is not None:
+                return cached
+
         new_cred = Credential(subject = object_gid.get_subject())
         new_cred.set_gid_caller(caller_gid)
         new_cred.set_gid_object(object_gid)
-        new_cred.set_issuer_keys(auth_info.get_privkey_filename(), auth_info.get_gid_filename())
+        new_cred.set_issuer_keys(auth_info.get_pkey_object(), auth_info.get_gid_object())
         #new_cred.set_pubkey(object_gid.get_pubkey())
         new_cred.set_privileges(rights)
         new_cred.get_privileges().delegate_all_privileges(True)
-        if hasattr(record,'expires'):
-            date = utcparse(record.expires)
-            expires = datetime_to_epoch(date)
-            new_cred.set_expiration(int(expires))
+        if expires is not None:
+            new_cred.set_expiration(expires)
         auth_kind = "authority,ma,sa"
         # Parent not necessary, verify with certs
         #new_cred.set_parent(api.auth.hierarchy.get_auth_cred(auth_hrn, kind=auth_kind))
         new_cred.encode()
         new_cred.sign()
     
-        return new_cred.save_to_string(save_parents=True)
+        credential = new_cred.save_to_string(save_parents=True)
+        if cache_key is not None:
+            issued_credentials.store(cache_key, credential, [caller_hrn, hrn], expires)
+        return credential
     
     
     # the default for full, which means 'dig into the testbed as well', should be false
@@ -163,51 +188,74 @@ class RegistryManager:
             xrns = [xrns]
         hrns = [urn_to_hrn(xrn)[0] for xrn in xrns] 
 
-        # load all known registry names into a prefix tree and attempt to find
-        # the longest matching prefix
+        # find the registry with the longest matching hrn
         # create a dict where key is a registry hrn and its value is a list
-        # of hrns at that registry (determined by the known prefix tree).  
+        # of hrns at that registry (determined by the registries routing table).  
         xrn_dict = {}
         registries = api.registries
-        tree = prefixTree()
-        registry_hrns = registries.keys()
-        tree.load(registry_hrns)
         for xrn in xrns:
-            registry_hrn = tree.best_match(urn_to_hrn(xrn)[0])
+            registry_hrn = registries.best_match(urn_to_hrn(xrn)[0])
             if registry_hrn not in xrn_dict:
                 xrn_dict[registry_hrn] = []
             xrn_dict[registry_hrn].append(xrn)
-            
-        records = [] 
-        for registry_hrn in xrn_dict:
-            # skip the hrn without a registry hrn
-            # XX should we let the user know the authority is unknown?       
-            if not registry_hrn:
-                continue
-    
-            # if the best match (longest matching hrn) is not the local registry,
-            # forward the request
-            xrns = xrn_dict[registry_hrn]
-            if registry_hrn != api.hrn:
-                credential = api.getCredential()
-                interface = api.registries[registry_hrn]
-                server_proxy = api.server_proxy(interface, credential)
+
+        def _Resolve(registry_hrn, server_proxy, xrns, credential):
+            tStart = time.time()
+            try:
                 # should propagate the details flag but that's not supported in the xmlrpc interface yet
                 #peer_records = server_proxy.Resolve(xrns, credential,type, details=details)
                 peer_records = server_proxy.Resolve(xrns, credential)
+                return {"registry": registry_hrn, "records": peer_records,
+                        "elapsed": time.time()-tStart, "status": "success"}
+            except Exception, e:
+                logger.log_exc("Resolve failed at %s" % registry_hrn)
+                return {"registry": registry_hrn, "elapsed": time.time()-tStart,
+                        "status": "exception", "error": str(e)}
+
+        # if the best match (longest matching hrn) is not the local registry,
+        # forward the request; all peers are asked at once, with one credential
+        # skip the hrn without a registry hrn
+        # XX should we let the user know the authority is unknown?       
+        peer_hrns = [ peer_hrn for peer_hrn in xrn_dict
+                      if peer_hrn and peer_hrn != api.hrn ]
+        multiclient = MultiClient(timeout=self.peer_timeout)
+        if peer_hrns:
+            credential = api.getCredential()
+            for registry_hrn in peer_hrns:
+                interface = api.registries[registry_hrn]
+                server_proxy = api.server_proxy(interface, credential, timeout=self.peer_timeout)
+                multiclient.run(_Resolve, registry_hrn, server_proxy, xrn_dict[registry_hrn], credential)
+
+        # meanwhile, look for all the hrns at the local registry
+        local_records = dbsession.query(RegRecord).filter(RegRecord.hrn.in_(hrns))
+        if type:
+            local_records = local_records.filter_by(type=type)
+        local_records=local_records.all()
+
+        records = [] 
+        peer_errors = {}
+        answered = []
+        for result in multiclient.iter_results():
+            answered.append(result["registry"])
+            if result["status"] == "success":
                 # pass foreign records as-is
                 # previous code used to read
                 # records.extend([SfaRecord(dict=record).as_dict() for record in peer_records])
                 # not sure why the records coming through xmlrpc had to be processed at all
-                records.extend(peer_records)
-    
-        # try resolving the remaining unfound records at the local registry
-        local_hrns = list ( set(hrns).difference([record['hrn'] for record in records]) )
-        # 
-        local_records = dbsession.query(RegRecord).filter(RegRecord.hrn.in_(local_hrns))
-        if type:
-            local_records = local_records.filter_by(type=type)
-        local_records=local_records.all()
+                records.extend(result["records"])
+            else:
+                peer_errors[result["registry"]] = result["error"]
+        # a peer that fails does not prevent the others from answering
+        for registry_hrn in peer_hrns:
+            if registry_hrn not in answered:
+                peer_errors[registry_hrn] = "timed out after %s s" % self.peer_timeout
+        for (registry_hrn, error) in peer_errors.items():
+            logger.warning("Resolve: could not resolve %s at %s: %s" % \
+                           (xrn_dict[registry_hrn], registry_hrn, error))
+
+        # the local registry only answers for the records that were not found elsewhere
+        peer_found = set([record['hrn'] for record in records])
+        local_records = [ record for record in local_records if record.hrn not in peer_found ]
         
         for local_record in local_records:
             augment_with_sfa_builtins (local_record)
@@ -237,6 +285,8 @@ class RegistryManager:
         records.extend( [ record.todict(exclude_types=[InstrumentedList]) for record in local_records ] )
 
         if not records:
+            if peer_errors:
+                raise RecordNotFound("%s (%s)" % (hrns, "; ".join([ "%s: %s" % item for item in peer_errors.items() ])))
             raise RecordNotFound(str(hrns))
     
         return records
@@ -244,14 +294,10 @@ class RegistryManager:
     def List (self, api, xrn, origin_hrn=None, options=None):
         if options is None: options={}
         dbsession=api.dbsession()
-        # load all know registry names into a prefix tree and attempt to find
-        # the longest matching prefix
+        # find the registry with the longest matching hrn
         hrn, type = urn_to_hrn(xrn)
         registries = api.registries
-        registry_hrns = registries.keys()
-        tree = prefixTree()
-        tree.load(registry_hrns)
-        registry_hrn = tree.best_match(hrn)
+        registry_hrn = registries.best_match(hrn)
        
         #if there was no match then this record belongs to an unknow registry
         if not registry_hrn:
@@ -492,6 +538,7 @@ class RegistryManager:
         dbsession.commit()
         # update membership for researchers, pis, owners, operators
         self.update_driver_relations (api, record, new_record)
+        issued_credentials.invalidate(hrn)
         
         return 1 
     
@@ -535,6 +582,7 @@ class RegistryManager:
         # delete from sfa db
         dbsession.delete(record)
         dbsession.commit()
+        issued_credentials.invalidate(hrn)
     
         return 1
 
@@ -14,11 +14,12 @@ from sfa.util.version import version_core
 from sfa.util.callids import Callids
 from sfa.util.cache import Cache
 
-from sfa.client.multiclient import MultiClient
+from sfa.client.multiclient import MultiClient, set_max_threads
 
 from sfa.rspecs.rspec_converter import RSpecConverter
 from sfa.rspecs.version_manager import VersionManager
 from sfa.rspecs.rspec import RSpec 
+from sfa.rspecs.compression import plain
 
 from sfa.client.client_helper import sfa_to_pg_users_arg
 from sfa.client.return_value import ReturnValue
@@ -28,12 +29,31 @@ class SliceManager:
     # the cache instance is a class member so it survives across incoming requests
     cache = None
 
+    # defaults for the fan-out to aggregates, for when the config does not say
+    # how long (seconds) an aggregate may stay silent
+    aggregate_timeout = 30
+    # how long (seconds) we wait for all aggregates to answer one call
+    call_timeout = 120
+    # threads shared by all outgoing calls
+    max_threads = 32
+
     def __init__ (self, config):
         self.cache=None
         if config.SFA_SM_CACHING:
             if SliceManager.cache is None:
                 SliceManager.cache = Cache()
             self.cache = SliceManager.cache
+        # 0 means no timeout
+        self.aggregate_timeout = getattr(config, 'SFA_SM_AGGREGATE_TIMEOUT', self.aggregate_timeout) or None
+        self.call_timeout = getattr(config, 'SFA_SM_CALL_TIMEOUT', self.call_timeout) or None
+        set_max_threads(getattr(config, 'SFA_SM_MAX_THREADS', self.max_threads))
+
+    # a MultiClient that gives up on the aggregates that are late
+    def multiclient(self):
+        return MultiClient(timeout=self.call_timeout)
+
+    def server_proxy(self, api, aggregate, cred):
+        return api.server_proxy(api.aggregates[aggregate], cred, timeout=self.aggregate_timeout)
         
     def GetVersion(self, api, options):
         # peers explicitly in aggregates.xml
@@ -101,6 +121,13 @@ class SliceManager:
 
         except Exception, e:
             logger.warn("add_slicemgr_stat failed on  %s: %s" %(aggname, str(e)))
+
+    # record the aggregates that did not answer in time
+    def add_timeout_stats(self, rspec, callname, aggregates, results):
+        answered = [ result["aggregate"] for result in results ]
+        for aggname in aggregates:
+            if aggname not in answered:
+                self.add_slicemgr_stat(rspec, callname, aggname, self.call_timeout, "timeout")
     
     def ListResources(self, api, creds, options):
         call_id = options.get('call_id') 
@@ -115,6 +142,8 @@ class SliceManager:
                 version = api.get_cached_server_version(server)
                 # force ProtoGENI aggregates to give us a v2 RSpec
                 forward_options['geni_rspec_version'] = options.get('geni_rspec_version')
+                # less to transfer, and aggregates have it ready in compressed form
+                forward_options['geni_compressed'] = True
                 result = server.ListResources(credential, forward_options)
                 return {"aggregate": aggregate, "result": result, "elapsed": time.time()-tStart, "status": "success"}
             except Exception, e:
@@ -124,8 +153,6 @@ class SliceManager:
         # get slice's hrn from options
         xrn = options.get('geni_slice_urn', '')
         (hrn, type) = urn_to_hrn(xrn)
-        if 'geni_compressed' in options:
-            del(options['geni_compressed'])
     
         # get the rspec's return format from options
         rspec_version = version_manager.get_version(options.get('geni_rspec_version'))
@@ -147,7 +174,8 @@ class SliceManager:
         cred = api.getDelegatedCredential(creds)
         if not cred:
             cred = api.getCredential()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
+        aggregates = []
         for aggregate in api.aggregates:
             # prevent infinite loop. Dont send request back to caller
             # unless the caller is the aggregate's SM
@@ -155,30 +183,32 @@ class SliceManager:
                 continue
     
             # get the rspec from the aggregate
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             multiclient.run(_ListResources, aggregate, server, [cred], options)
+            aggregates.append(aggregate)
     
-    
-        results = multiclient.get_results()
         rspec_version = version_manager.get_version(options.get('geni_rspec_version'))
         if xrn:    
             result_version = version_manager._get_version(rspec_version.type, rspec_version.version, 'manifest')
         else: 
             result_version = version_manager._get_version(rspec_version.type, rspec_version.version, 'ad')
         rspec = RSpec(version=result_version)
-        for result in results:
+        # merge the rspecs as they come in
+        results = []
+        for result in multiclient.iter_results():
+            results.append(result)
             self.add_slicemgr_stat(rspec, "ListResources", result["aggregate"], result["elapsed"], 
                                    result["status"], result.get("exc_info",None))
             if result["status"]=="success":
                 res = result['result']['value']
                 try:
-                    rspec.version.merge(ReturnValue.get_value(res))
+                    rspec.version.merge(plain(ReturnValue.get_value(res)))
                 except:
                     api.logger.log_exc("SM.ListResources: Failed to merge aggregate rspec")
+        self.add_timeout_stats(rspec, "ListResources", aggregates, results)
     
-        # cache the result
-        if self.cache and not xrn:
+        # cache the result, unless some aggregates are missing
+        if self.cache and not xrn and len(results) == len(aggregates):
             api.logger.debug("SliceManager.ListResources caches advertisement")
             self.cache.add(version_string, rspec.toxml())
     
@@ -230,16 +260,17 @@ class SliceManager:
         hrn, type = urn_to_hrn(xrn)
         valid_cred = api.auth.checkCredentials(creds, 'createsliver', hrn)[0]
         caller_hrn = Credential(cred=valid_cred).get_gid_caller().get_hrn()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
+        aggregates = []
         for aggregate in api.aggregates:
             # prevent infinite loop. Dont send request back to caller
             # unless the caller is the aggregate's SM 
             if caller_hrn == aggregate and aggregate != api.hrn:
                 continue
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             # Just send entire RSpec to each aggregate
             multiclient.run(_Allocate, aggregate, server, xrn, [cred], rspec.toxml(), options)
+            aggregates.append(aggregate)
                 
         results = multiclient.get_results()
         manifest_version = version_manager._get_version(rspec.version.type, rspec.version.version, 'manifest')
@@ -258,6 +289,7 @@ class SliceManager:
                     geni_slivers.extend(res['geni_slivers'])
                 except:
                     api.logger.log_exc("SM.Allocate: Failed to merge aggregate rspec")
+        self.add_timeout_stats(result_rspec, "Allocate", aggregates, results)
         return {
             'geni_urn': geni_urn,
             'geni_rspec': result_rspec.toxml(),
@@ -290,16 +322,17 @@ class SliceManager:
         # get the callers hrn
         valid_cred = api.auth.checkCredentials(creds, 'createsliver', xrn)[0]
         caller_hrn = Credential(cred=valid_cred).get_gid_caller().get_hrn()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
+        aggregates = []
         for aggregate in api.aggregates:
             # prevent infinite loop. Dont send request back to caller
             # unless the caller is the aggregate's SM
             if caller_hrn == aggregate and aggregate != api.hrn:
                 continue
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             # Just send entire RSpec to each aggregate
             multiclient.run(_Provision, aggregate, server, xrn, [cred], options)
+            aggregates.append(aggregate)
 
         results = multiclient.get_results()
         # Set the manifest of KOREN
@@ -319,6 +352,7 @@ class SliceManager:
                     geni_slivers.extend(res['geni_slivers'])
                 except:
                     api.logger.log_exc("SM.Provision: Failed to merge aggregate rspec")
+        self.add_timeout_stats(result_rspec, "Provision", aggregates, results)
         return {
             'geni_urn': geni_urn,
             'geni_rspec': result_rspec.toxml(),
@@ -352,14 +386,13 @@ class SliceManager:
         cred = api.getDelegatedCredential(creds)
         if not cred:
             cred = api.getCredential(minimumExpiration=31*86400)
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
         for aggregate in api.aggregates:
             # prevent infinite loop. Dont send request back to caller
             # unless the caller is the aggregate's SM
             if caller_hrn == aggregate and aggregate != api.hrn:
                 continue
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             multiclient.run(_Renew, aggregate, server, xrn, [cred], expiration_time, options)
 
         results = multiclient.get_results()
@@ -392,14 +425,13 @@ class SliceManager:
         cred = api.getDelegatedCredential(creds)
         if not cred:
             cred = api.getCredential()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
         for aggregate in api.aggregates:
             # prevent infinite loop. Dont send request back to caller
             # unless the caller is the aggregate's SM
             if caller_hrn == aggregate and aggregate != api.hrn:
                 continue
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             multiclient.run(_Delete, server, xrn, [cred], options)
         
         results = []
@@ -419,10 +451,9 @@ class SliceManager:
         cred = api.getDelegatedCredential(creds)
         if not cred:
             cred = api.getCredential()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
         for aggregate in api.aggregates:
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             multiclient.run (_Status, server, slice_xrn, [cred], options)
         results = [ReturnValue.get_value(result) for result in multiclient.get_results()]
     
@@ -457,10 +488,9 @@ class SliceManager:
         cred = api.getDelegatedCredential(creds)
         if not cred:
             cred = api.getCredential()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
         for aggregate in api.aggregates:
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             multiclient.run (_Describe, server, xrns, [cred], options)
         results = [ReturnValue.get_value(result) for result in multiclient.get_results()]
 
@@ -479,7 +509,7 @@ class SliceManager:
         for result in results:
             try:
                 geni_urn = result['geni_urn']
-                result_rspec.version.merge(ReturnValue.get_value(result['geni_rspec']))
+                result_rspec.version.merge(plain(ReturnValue.get_value(result['geni_rspec'])))
                 geni_slivers.extend(result['geni_slivers'])
             except:
                 api.logger.log_exc("SM.Provision: Failed to merge aggregate rspec")
@@ -498,14 +528,13 @@ class SliceManager:
         cred = api.getDelegatedCredential(creds)
         if not cred:
             cred = api.getCredential()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
         for aggregate in api.aggregates:
             # prevent infinite loop. Dont send request back to caller
             # unless the caller is the aggregate's SM
             if caller_hrn == aggregate and aggregate != api.hrn:
                 continue
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)    
+            server = self.server_proxy(api, aggregate, cred)    
             multiclient.run(server.PerformOperationalAction, xrn, [cred], action, options)
         multiclient.get_results()    
         return 1
@@ -521,14 +550,13 @@ class SliceManager:
         cred = api.getDelegatedCredential(creds)
         if not cred:
             cred = api.getCredential()
-        multiclient = MultiClient()
+        multiclient = self.multiclient()
         for aggregate in api.aggregates:
             # prevent infinite loop. Dont send request back to caller
             # unless the caller is the aggregate's SM
             if caller_hrn == aggregate and aggregate != api.hrn:
                 continue
-            interface = api.aggregates[aggregate]
-            server = api.server_proxy(interface, cred)
+            server = self.server_proxy(api, aggregate, cred)
             multiclient.run(server.Shutdown, xrn.urn, cred)
         multiclient.get_results()    
         return 1
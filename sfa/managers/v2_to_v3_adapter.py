@@ -90,6 +90,7 @@ class V2ToV3Adapter:
                 slivers = rspec.version.get_nodes_with_slivers()
                 
                 ##SliverAllocation
+                records = []
                 for sliver in slivers:
                      client_id = sliver['client_id']
                      component_id = sliver['component_id']
@@ -104,8 +105,8 @@ class V2ToV3Adapter:
                                       component_id=component_id,
                                       slice_urn = slice_urn,
                                       allocation_state='geni_allocated')    
-     
-                     record.sync(self.driver.api.dbsession())
+                     records.append(record)
+                SliverAllocation.sync_allocations(records, self.driver.api.dbsession())
 
                
                 # return manifest
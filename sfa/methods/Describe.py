@@ -1,5 +1,3 @@
-import zlib
-
 from sfa.util.xrn import urn_to_hrn
 from sfa.util.method import Method
 from sfa.util.sfatablesRuntime import run_sfatables
@@ -7,6 +5,7 @@ from sfa.util.faults import SfaInvalidArgument
 from sfa.trust.credential import Credential
 
 from sfa.storage.parameter import Parameter, Mixed
+from sfa.rspecs.compression import compress, compression_level
 
 class Describe(Method):
     """
@@ -55,7 +54,7 @@ class Describe(Method):
         desc['geni_rspec'] = run_sfatables(chain_name, '', origin_hrn, desc['geni_rspec']) 
  
         if options.has_key('geni_compressed') and options['geni_compressed'] == True:
-            desc['geni_rspec'] = zlib.compress(desc['geni_rspec']).encode('base64')
+            desc['geni_rspec'] = compress(desc['geni_rspec'], compression_level(self.api.config))
 
         return desc  
     
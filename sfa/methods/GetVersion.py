@@ -18,4 +18,9 @@ class GetVersion(Method):
     def call(self, options=None):
         if options is None: options={}
         self.api.logger.info("interface: %s\tmethod-name: %s" % (self.api.interface, self.name))
-        return self.api.manager.GetVersion(self.api, options)
+        version = self.api.manager.GetVersion(self.api, options)
+        # how busy this server is, for monitoring
+        server_stats = getattr(self.api, 'server_stats', None)
+        if server_stats is not None and isinstance(version, dict):
+            version['sfa_server_stats'] = server_stats()
+        return version
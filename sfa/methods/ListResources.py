@@ -1,5 +1,3 @@
-import zlib
-
 from sfa.util.xrn import urn_to_hrn
 from sfa.util.method import Method
 from sfa.util.sfatablesRuntime import run_sfatables
@@ -7,6 +5,7 @@ from sfa.util.faults import SfaInvalidArgument
 from sfa.trust.credential import Credential
 
 from sfa.storage.parameter import Parameter, Mixed
+from sfa.rspecs.compression import compression_cache, compression_level
 
 class ListResources(Method):
     """
@@ -51,7 +50,7 @@ class ListResources(Method):
         filtered_rspec = run_sfatables(chain_name, '', origin_hrn, rspec) 
  
         if options.has_key('geni_compressed') and options['geni_compressed'] == True:
-            filtered_rspec = zlib.compress(filtered_rspec).encode('base64')
+            filtered_rspec = compression_cache.compress(filtered_rspec, compression_level(self.api.config))
 
         return filtered_rspec  
     
@@ -628,13 +628,15 @@ class OpenstackDriver(Driver):
 
         slivers = aggregate.run_instances(tenant_name, user_name, rspec_string, key_name, pubkeys)
         # Update sliver allocations
+        records = []
         for sliver in slivers:
             component_id = sliver.metadata.get('component_id')
             sliver_id = OSXrn(name=('koren'+'.'+ sliver.name), id=sliver.id, type='node+openstack').get_urn()
             record = SliverAllocation( sliver_id=sliver_id,
                                        component_id=component_id,
                                        allocation_state='geni_allocated')
-            record.sync(self.api.dbsession())
+            records.append(record)
+        SliverAllocation.sync_allocations(records, self.api.dbsession())
         return aggregate.describe(urns=[urn], version=rspec.version)
 
     def provision(self, urns, options=None):
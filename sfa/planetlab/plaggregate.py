@@ -7,7 +7,6 @@ from sfa.util.faults import SliverDoesNotExist
 from sfa.rspecs.rspec import RSpec
 from sfa.rspecs.elements.hardware_type import HardwareType
 from sfa.rspecs.elements.node import NodeElement
-from sfa.rspecs.elements.link import Link
 from sfa.rspecs.elements.sliver import Sliver
 from sfa.rspecs.elements.login import Login
 from sfa.rspecs.elements.location import Location
@@ -20,7 +19,7 @@ from sfa.rspecs.version_manager import VersionManager
 
 from sfa.planetlab.plxrn import PlXrn, hostname_to_urn
 from sfa.planetlab.vlink import get_tc_rate
-from sfa.planetlab.topology import Topology
+from sfa.planetlab.topology import get_topology, link_index
 from sfa.storage.model import SliverAllocation
 
 
@@ -43,79 +42,77 @@ class PlAggregate:
  
     def get_sites(self, filter=None):
         if filter is None: filter={}
+        return self.sites_dict(self.driver.shell.GetSites(filter))
+
+    def sites_dict(self, site_list):
         sites = {}
-        for site in self.driver.shell.GetSites(filter):
+        for site in site_list:
             sites[site['site_id']] = site
         return sites
 
     def get_interfaces(self, filter=None):
         if filter is None: filter={}
+        return self.interfaces_dict(self.driver.shell.GetInterfaces(filter))
+
+    def interfaces_dict(self, interface_list):
         interfaces = {}
-        for interface in self.driver.shell.GetInterfaces(filter):
-            iface = Interface()
+        for interface in interface_list:
             if interface['bwlimit']:
                 interface['bwlimit'] = str(int(interface['bwlimit'])/1000)
             interfaces[interface['interface_id']] = interface
         return interfaces
 
     def get_links(self, sites, nodes, interfaces):
-        
-        topology = Topology() 
-        links = []
-        for (site_id1, site_id2) in topology:
-            site_id1 = int(site_id1)
-            site_id2 = int(site_id2)
-            link = Link()
-            if not site_id1 in sites or site_id2 not in sites:
-                continue
-            site1 = sites[site_id1]
-            site2 = sites[site_id2]
-            # get hrns
-            site1_hrn = self.driver.hrn + '.' + site1['login_base']
-            site2_hrn = self.driver.hrn + '.' + site2['login_base']
-
-            for s1_node_id in site1['node_ids']:
-                for s2_node_id in site2['node_ids']:
-                    if s1_node_id not in nodes or s2_node_id not in nodes:
-                        continue
-                    node1 = nodes[s1_node_id]
-                    node2 = nodes[s2_node_id]
-                    # set interfaces
-                    # just get first interface of the first node
-                    if1_xrn = PlXrn(auth=self.driver.hrn, interface='node%s:eth0' % (node1['node_id']))
-                    if1_ipv4 = interfaces[node1['interface_ids'][0]]['ip']
-                    if2_xrn = PlXrn(auth=self.driver.hrn, interface='node%s:eth0' % (node2['node_id']))
-                    if2_ipv4 = interfaces[node2['interface_ids'][0]]['ip']
-
-                    if1 = Interface({'component_id': if1_xrn.urn, 'ipv4': if1_ipv4} )
-                    if2 = Interface({'component_id': if2_xrn.urn, 'ipv4': if2_ipv4} )
-
-                    # set link
-                    link = Link({'capacity': '1000000', 'latency': '0', 'packet_loss': '0', 'type': 'ipv4'})
-                    link['interface1'] = if1
-                    link['interface2'] = if2
-                    link['component_name'] = "%s:%s" % (site1['login_base'], site2['login_base'])
-                    link['component_id'] = PlXrn(auth=self.driver.hrn, interface=link['component_name']).get_urn()
-                    link['component_manager_id'] =  hrn_to_urn(self.driver.hrn, 'authority+am')
-                    links.append(link)
-
-        return links
+        return link_index.get_links(self.driver.hrn, get_topology(), sites, nodes, interfaces)
 
     def get_node_tags(self, filter=None):
         if filter is None: filter={}
+        return self.node_tags_dict(self.driver.shell.GetNodeTags(filter))
+
+    def node_tags_dict(self, node_tag_list):
         node_tags = {}
-        for node_tag in self.driver.shell.GetNodeTags(filter):
+        for node_tag in node_tag_list:
             node_tags[node_tag['node_tag_id']] = node_tag
         return node_tags
 
     def get_pl_initscripts(self, filter=None):
         if filter is None: filter={}
-        pl_initscripts = {}
         filter.update({'enabled': True})
-        for initscript in self.driver.shell.GetInitScripts(filter):
+        return self.pl_initscripts_dict(self.driver.shell.GetInitScripts(filter))
+
+    def pl_initscripts_dict(self, initscript_list):
+        pl_initscripts = {}
+        for initscript in initscript_list:
             pl_initscripts[initscript['initscript_id']] = initscript
         return pl_initscripts
 
+    ##
+    # Fetch the sites, interfaces, tags and initscripts that the nodes refer to,
+    # and the lease granularity, in a single round trip to PLCAPI
+    #
+    # @return a tuple (sites, interfaces, node_tags, pl_initscripts, grain)
+
+    def get_nodes_context(self, nodes):
+        site_ids = []
+        interface_ids = []
+        tag_ids = []
+        for node in nodes:
+            site_ids.append(node['site_id'])
+            interface_ids.extend(node['interface_ids'])
+            tag_ids.extend(node['node_tag_ids'])
+        batch = self.driver.shell.batch()
+        sites = batch.GetSites({'site_id': site_ids})
+        interfaces = batch.GetInterfaces({'interface_id': interface_ids})
+        node_tags = batch.GetNodeTags({'node_tag_id': tag_ids})
+        pl_initscripts = batch.GetInitScripts({'enabled': True})
+        grain = batch.GetLeaseGranularity()
+        batch.run()
+        return (self.sites_dict(sites.result()),
+                self.interfaces_dict(interfaces.result()),
+                self.node_tags_dict(node_tags.result()),
+                self.pl_initscripts_dict(pl_initscripts.result()),
+                grain.result())
+
     def get_slivers(self, urns, options=None):
         if options is None: options={}
         names = set()
@@ -166,21 +163,27 @@ class PlAggregate:
         if person_ids:
             persons = self.driver.shell.GetPersons(person_ids)
                  
-        # get user keys
+        # get user keys and hrns
         keys = {}
         key_ids = []
         for person in persons:
             key_ids.extend(person['key_ids'])
         
+        batch = self.driver.shell.batch()
         if key_ids:
-            key_list = self.driver.shell.GetKeys(key_ids)
-            for key in key_list:
+            key_list = batch.GetKeys(key_ids)
+        person_hrns = {}
+        for person in persons:
+            person_hrns[person['person_id']] = batch.GetPersonHrn(int(person['person_id']))
+        batch.run()
+        if key_ids:
+            for key in key_list.result():
                 keys[key['key_id']] = key  
 
         # construct user key info
         users = []
         for person in persons:
-            person_urn = hrn_to_urn(self.driver.shell.GetPersonHrn(int(person['person_id'])), 'user')
+            person_urn = hrn_to_urn(person_hrns[person['person_id']].result(), 'user')
             user = {
                 'login': slice['name'], 
                 'user_urn': person_urn,
@@ -259,9 +262,10 @@ class PlAggregate:
         return rspec_node
 
     def sliver_to_rspec_node(self, sliver, sites, interfaces, node_tags, \
-                             pl_initscripts, sliver_allocations):
+                             pl_initscripts, sliver_allocations, grain=None):
         # get the granularity in second for the reservation system
-        grain = self.driver.shell.GetLeaseGranularity()
+        if grain is None:
+            grain = self.driver.shell.GetLeaseGranularity()
         rspec_node = self.node_to_rspec_node(sliver, sites, interfaces, node_tags, pl_initscripts, grain)
         # xxx how to retrieve site['login_base']
         rspec_node['expires'] = datetime_to_string(utcparse(sliver['expires']))
@@ -359,15 +363,27 @@ class PlAggregate:
         if slice:
            filter.update({'name':slice['name']})
         return_fields = ['lease_id', 'hostname', 'site_id', 'name', 't_from', 't_until']
-        leases = self.driver.shell.GetLeases(filter)
-        grain = self.driver.shell.GetLeaseGranularity()
-
+        batch = self.driver.shell.batch()
+        leases = batch.GetLeases(filter)
+        grain = batch.GetLeaseGranularity()
+        batch.run()
+        leases = leases.result()
+        grain = grain.result()
+
+        # get sites, and the hrns of the nodes and slices involved
         site_ids = []
+        node_hrns = {}
+        slice_hrns = {}
+        batch = self.driver.shell.batch()
         for lease in leases:
             site_ids.append(lease['site_id'])
-
-        # get sites
-        sites_dict  = self.get_sites({'site_id': site_ids}) 
+            if lease['hostname'] not in node_hrns:
+                node_hrns[lease['hostname']] = batch.GetNodeHrn(lease['hostname'])
+            if lease['slice_id'] not in slice_hrns:
+                slice_hrns[lease['slice_id']] = batch.GetSliceHrn(lease['slice_id'])
+        sites = batch.GetSites({'site_id': site_ids})
+        batch.run()
+        sites_dict = self.sites_dict(sites.result())
   
         rspec_leases = []
         for lease in leases:
@@ -378,8 +394,8 @@ class PlAggregate:
             site_id=lease['site_id']
             site=sites_dict[site_id]
 
-            rspec_lease['component_id'] = hrn_to_urn(self.driver.shell.GetNodeHrn(lease['hostname']), 'node')
-            slice_hrn = self.driver.shell.GetSliceHrn(lease['slice_id'])
+            rspec_lease['component_id'] = hrn_to_urn(node_hrns[lease['hostname']].result(), 'node')
+            slice_hrn = slice_hrns[lease['slice_id']].result()
             slice_urn = hrn_to_urn(slice_hrn, 'slice')
             rspec_lease['slice_id'] = slice_urn
             rspec_lease['start_time'] = lease['t_from']
@@ -399,25 +415,14 @@ class PlAggregate:
         if not options.get('list_leases') or options['list_leases'] != 'leases':
             # get nodes
             nodes  = self.get_nodes(options)
-            site_ids = []
-            interface_ids = []
-            tag_ids = []
             nodes_dict = {}
             for node in nodes:
-                site_ids.append(node['site_id'])
-                interface_ids.extend(node['interface_ids'])
-                tag_ids.extend(node['node_tag_ids'])
                 nodes_dict[node['node_id']] = node
-            sites = self.get_sites({'site_id': site_ids})
-            interfaces = self.get_interfaces({'interface_id':interface_ids})
-            node_tags = self.get_node_tags({'node_tag_id': tag_ids})
-            pl_initscripts = self.get_pl_initscripts()
-            # convert nodes to rspec nodes
-            rspec_nodes = []
-            for node in nodes:
-                rspec_node = self.node_to_rspec_node(node, sites, interfaces, node_tags, pl_initscripts)
-                rspec_nodes.append(rspec_node)
-            rspec.version.add_nodes(rspec_nodes)
+            (sites, interfaces, node_tags, pl_initscripts, grain) = self.get_nodes_context(nodes)
+            # convert nodes to rspec nodes, one at a time as the rspec gets serialized
+            rspec_nodes = ( self.node_to_rspec_node(node, sites, interfaces, node_tags, pl_initscripts, grain)
+                            for node in nodes )
+            rspec.stream_nodes(rspec_nodes)
 
             # add links
             links = self.get_links(sites, nodes_dict, interfaces)        
@@ -457,25 +462,16 @@ class PlAggregate:
       
         if not options.get('list_leases') or options['list_leases'] != 'leases':
             # add slivers
-            site_ids = []
-            interface_ids = []
-            tag_ids = []
             nodes_dict = {}
             for sliver in slivers:
-                site_ids.append(sliver['site_id'])
-                interface_ids.extend(sliver['interface_ids'])
-                tag_ids.extend(sliver['node_tag_ids'])
                 nodes_dict[sliver['node_id']] = sliver
-            sites = self.get_sites({'site_id': site_ids})
-            interfaces = self.get_interfaces({'interface_id':interface_ids})
-            node_tags = self.get_node_tags({'node_tag_id': tag_ids})
-            pl_initscripts = self.get_pl_initscripts()
+            (sites, interfaces, node_tags, pl_initscripts, grain) = self.get_nodes_context(slivers)
             rspec_nodes = []
             for sliver in slivers:
                 if sliver['slice_ids_whitelist'] and sliver['slice_id'] not in sliver['slice_ids_whitelist']:
                     continue
                 rspec_node = self.sliver_to_rspec_node(sliver, sites, interfaces, node_tags, 
-                                                       pl_initscripts, sliver_allocation_dict)
+                                                       pl_initscripts, sliver_allocation_dict, grain)
                 # manifest node element shouldn't contain available attribute
                 rspec_node.pop('available')
                 rspec_nodes.append(rspec_node) 
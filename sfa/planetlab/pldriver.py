@@ -10,7 +10,7 @@ from sfa.util.xrn import Xrn, hrn_to_urn, get_leaf
 from sfa.util.cache import Cache
 
 # one would think the driver should not need to mess with the SFA db, but..
-from sfa.storage.model import RegRecord, SliverAllocation
+from sfa.storage.model import RegRecord, SliverAllocation, EgreKey
 from sfa.trust.credential import Credential
 
 # used to be used in get_ticket
@@ -53,6 +53,12 @@ class PlDriver (Driver):
                 PlDriver.cache = Cache()
             self.cache = PlDriver.cache
 
+    # PLCAPI reads are cached for the duration of one request
+    def reset (self):
+        # FdDriver has a different shell
+        if isinstance(self.shell, PlShell):
+            self.shell.reset_cache()
+
     def sliver_to_slice_xrn(self, xrn):
         sliver_id_parts = Xrn(xrn).get_sliver_id_parts()
         filter = {'peer_id': None}
@@ -750,6 +756,12 @@ class PlDriver (Driver):
                 # delete sliver allocation states
                 dbsession=self.api.dbsession()
                 SliverAllocation.delete_allocations(sliver_ids,dbsession)
+                # the slice is gone as a whole, its EGRE key can be reused
+                if [ urn for urn in urns if Xrn(urn).get_type() == 'slice' ]:
+                    for tag in self.shell.GetSliceTags({'slice_id': slice_id, 'tagname': 'egre_key'},
+                                                       ['slice_tag_id']):
+                        self.shell.DeleteSliceTag(tag['slice_tag_id'])
+                    EgreKey.release(slice_name, dbsession)
             finally:
                 pass
 
@@ -1,10 +1,126 @@
 import sys
+import re
+import copy
+import time
+import threading
 import xmlrpclib
 import socket
 from urlparse import urlparse
 
 from sfa.util.sfalogging import logger
 
+# how often (in seconds) we check again whether PLC runs on this box
+DEFAULT_ENDPOINT_TTL = 5 * 60
+
+class PlEndpoint:
+    """
+    How to reach PLCAPI for a given url and account: either through a local
+    PLC.Shell, with the 'capability' auth mechanism for higher performance
+    when the PLC db is local, or over xmlrpc. This is figured out once, and
+    shared by all PlShell instances in the process (see get_plc_endpoint).
+
+    xmlrpclib proxies cannot be used by several threads at once, so each
+    thread gets its own one; it keeps its HTTP connection open across calls.
+    """
+
+    def __init__ (self, url, user, password, ttl=DEFAULT_ENDPOINT_TTL):
+        self.url = url
+        self.expires = time.time() + ttl
+        self.refreshing = False
+        self.local = threading.local()
+        self.direct = self.is_local() and self.has_direct_access()
+        # a local PLC.Shell has nothing to gain from multicalls
+        self.multicall = not self.direct
+        if self.direct:
+            logger.info('plshell access - capability')
+            self.plauth = { 'AuthMethod': 'capability',
+                            'Username':   str(user),
+                            'AuthString': str(password),
+                            }
+        else:
+            logger.info('plshell access - xmlrpc')
+            self.plauth = { 'AuthMethod': 'password',
+                            'Username':   str(user),
+                            'AuthString': str(password),
+                            }
+
+    # try to figure if the url is local
+    def is_local (self):
+        hostname=urlparse(self.url).hostname
+        if hostname == 'localhost': return True
+        # otherwise compare IP addresses; 
+        # this might fail for any number of reasons, so let's harden that
+        try:
+            url_ip=socket.gethostbyname(hostname)
+            local_ip=socket.gethostbyname(socket.gethostname())
+            if url_ip==local_ip: return True
+        except:
+            pass
+        return False
+
+    def has_direct_access (self):
+        try:
+            # too bad this is not installed properly
+            plcapi_path="/usr/share/plc_api"
+            if plcapi_path not in sys.path: sys.path.append(plcapi_path)
+            import PLC.Shell
+            return True
+        except:
+            return False
+
+    def is_expired (self):
+        return time.time() > self.expires
+
+    def get_proxy (self):
+        proxy = getattr(self.local, 'proxy', None)
+        if proxy is None:
+            if self.direct:
+                import PLC.Shell
+                proxy = PLC.Shell.Shell ()
+            else:
+                proxy = xmlrpclib.Server(self.url, verbose = False, allow_none = True)
+            self.local.proxy = proxy
+        return proxy
+
+endpoints = {}
+endpoints_lock = threading.Lock()
+
+##
+# Return the PlEndpoint for the PLC url and account in config
+#
+# Once it has expired, the endpoint is determined again in the background,
+# so that no request has to wait for DNS; a change in the config results
+# in a different endpoint right away
+
+def get_plc_endpoint (config):
+    url = config.SFA_PLC_URL
+    key = (url, str(config.SFA_PLC_USER), str(config.SFA_PLC_PASSWORD))
+    ttl = getattr(config, 'SFA_PLC_ENDPOINT_TTL', DEFAULT_ENDPOINT_TTL)
+    with endpoints_lock:
+        endpoint = endpoints.get(key)
+        if endpoint is None:
+            endpoint = endpoints[key] = PlEndpoint(url, key[1], key[2], ttl)
+        elif endpoint.is_expired() and not endpoint.refreshing:
+            endpoint.refreshing = True
+            thread = threading.Thread(target=refresh_plc_endpoint, args=(key, ttl))
+            thread.setDaemon(True)
+            thread.start()
+        return endpoint
+
+def refresh_plc_endpoint (key, ttl):
+    try:
+        endpoint = PlEndpoint(key[0], key[1], key[2], ttl)
+    except:
+        logger.log_exc("PlShell: could not refresh PLC endpoint %s" % key[0])
+        endpoint = None
+    with endpoints_lock:
+        if endpoint is not None:
+            endpoints[key] = endpoint
+        else:
+            # try again later
+            endpoints[key].expires = time.time() + ttl
+            endpoints[key].refreshing = False
+
 class PlShell:
     """
     A simple xmlrpc shell to a myplc instance
@@ -39,58 +155,215 @@ class PlShell:
                     'get_nodes':'GetNodes',
                     }
 
+    # the kinds of PLC objects, as they appear in method names
+    object_types = ['Slice', 'Site', 'Node', 'Person', 'Key', 'Lease', 'Interface', 'Peer', 'Tag']
+    # changing an object of one kind also changes the objects that refer to it
+    # (e.g. nodes have slice_ids, persons have site_ids)
+    related_types = { 'Slice': ['Node', 'Person', 'Site', 'Lease'],
+                      'Site': ['Node', 'Person', 'Slice'],
+                      'Node': ['Slice', 'Site', 'Interface', 'Lease'],
+                      'Person': ['Slice', 'Site', 'Key'],
+                      'Key': ['Person'],
+                      'Interface': ['Node'],
+                      }
+    # calls whose name does not tell what they change: binding an object
+    # to a peer changes the peer_id of slices, persons, nodes or sites
+    untyped_calls = ['BindObjectToPeer', 'UnBindObjectFromPeer']
+
 
-    # use the 'capability' auth mechanism for higher performance when the PLC db is local    
     def __init__ ( self, config ) :
-        url = config.SFA_PLC_URL
-        # try to figure if the url is local
-        hostname=urlparse(url).hostname
-        is_local=False
-        if hostname == 'localhost': is_local=True
-        # otherwise compare IP addresses; 
-        # this might fail for any number of reasons, so let's harden that
-        try:
-            # xxx todo this seems to result in a DNS request for each incoming request to the AM
-            # should be cached or improved
-            url_ip=socket.gethostbyname(hostname)
-            local_ip=socket.gethostbyname(socket.gethostname())
-            if url_ip==local_ip: is_local=True
-        except:
-            pass
+        self.config = config
+        # read-through cache, only enabled while serving a request
+        self.cache = None
 
-        if is_local:
-            try:
-                # too bad this is not installed properly
-                plcapi_path="/usr/share/plc_api"
-                if plcapi_path not in sys.path: sys.path.append(plcapi_path)
-                import PLC.Shell
-                plc_direct_access=True
-            except:
-                plc_direct_access=False
-        if is_local and plc_direct_access:
-            logger.info('plshell access - capability')
-            self.plauth = { 'AuthMethod': 'capability',
-                            'Username':   str(config.SFA_PLC_USER),
-                            'AuthString': str(config.SFA_PLC_PASSWORD),
-                            }
-            self.proxy = PLC.Shell.Shell ()
+    # shells live as long as the api objects that hold them, so the endpoint
+    # is looked up on every call, for it to be refreshed once it has expired
+    def get_endpoint (self):
+        return get_plc_endpoint (self.config)
 
-        else:
-            logger.info('plshell access - xmlrpc')
-            self.plauth = { 'AuthMethod': 'password',
-                            'Username':   str(config.SFA_PLC_USER),
-                            'AuthString': str(config.SFA_PLC_PASSWORD),
-                            }
-            self.proxy = xmlrpclib.Server(url, verbose = False, allow_none = True)
+    # the proxy for the current thread
+    def get_proxy (self):
+        return self.get_endpoint().get_proxy()
+
+    @staticmethod
+    def actual_name(name):
+        actual_name=None
+        if name in PlShell.direct_calls: actual_name=name
+        if name in PlShell.alias_calls: actual_name=PlShell.alias_calls[name]
+        if not actual_name:
+            raise Exception, "Illegal method call %s for PL driver"%(name)
+        return actual_name
 
     def __getattr__(self, name):
         def func(*args, **kwds):
-            actual_name=None
-            if name in PlShell.direct_calls: actual_name=name
-            if name in PlShell.alias_calls: actual_name=PlShell.alias_calls[name]
-            if not actual_name:
-                raise Exception, "Illegal method call %s for PL driver"%(name)
-            result=getattr(self.proxy, actual_name)(self.plauth, *args, **kwds)
+            actual_name=PlShell.actual_name(name)
+            (hit, result) = self.cache_lookup(actual_name, args, kwds)
+            if hit:
+                logger.debug('PlShell %s (%s) returned from cache'%(name,actual_name))
+                return result
+            endpoint=self.get_endpoint()
+            result=getattr(endpoint.get_proxy(), actual_name)(endpoint.plauth, *args, **kwds)
             logger.debug('PlShell %s (%s) returned ... '%(name,actual_name))
+            self.cache_store(actual_name, args, kwds, result)
             return result
         return func
+
+    ##
+    # Start caching the results of read calls (Get*), from scratch; this is
+    # meant to last for one incoming request, during which the same slices,
+    # persons or nodes are typically read several times. A write call drops
+    # the cached results that it may have changed.
+
+    def reset_cache(self):
+        self.cache = {}
+
+    def stop_cache(self):
+        self.cache = None
+
+    def cache_lookup(self, actual_name, args, kwds=None):
+        if self.cache is None:
+            return (False, None)
+        if not actual_name.startswith('Get'):
+            self.cache_invalidate(actual_name)
+            return (False, None)
+        entry = self.cache.get(PlShell.cache_key(actual_name, args, kwds))
+        if entry is None:
+            return (False, None)
+        return (True, copy.deepcopy(entry[1]))
+
+    def cache_store(self, actual_name, args, kwds, result):
+        if self.cache is None or not actual_name.startswith('Get'):
+            return
+        self.cache[PlShell.cache_key(actual_name, args, kwds)] = \
+            (PlShell.method_types(actual_name), copy.deepcopy(result))
+
+    def cache_invalidate(self, actual_name):
+        types = PlShell.method_types(actual_name)
+        if not types:
+            # no telling what this changes
+            self.cache.clear()
+            return
+        for type in list(types):
+            types.update(PlShell.related_types.get(type, []))
+        for (key, (entry_types, result)) in self.cache.items():
+            if entry_types & types:
+                del self.cache[key]
+
+    @staticmethod
+    def method_types(actual_name):
+        if actual_name in PlShell.untyped_calls:
+            return set()
+        words = [ word.rstrip('s') for word in re.findall('[A-Z][a-z]*', actual_name) ]
+        return set([ word for word in words if word in PlShell.object_types ])
+
+    @staticmethod
+    def cache_key(actual_name, args, kwds=None):
+        return repr( (actual_name, normalize(args), normalize(kwds or {})) )
+
+    def batch(self):
+        return PlBatch(self)
+
+##
+# Turn call arguments into a canonical form, where dicts (i.e. filters)
+# compare equal regardless of the order of their keys
+
+def normalize(value):
+    if isinstance(value, dict):
+        return tuple(sorted([ (key, normalize(val)) for (key, val) in value.items() ]))
+    if isinstance(value, (list, tuple)):
+        return tuple([ normalize(val) for val in value ])
+    return value
+
+class PlFuture:
+    """
+    The result of a call made through a PlBatch, available once the batch has run
+    """
+
+    def __init__(self, name, args=()):
+        self.name = name
+        self.args = args
+        self.done = False
+        self.value = None
+        self.fault = None
+
+    def set(self, value=None, fault=None):
+        self.done = True
+        self.value = value
+        self.fault = fault
+
+    def result(self):
+        if not self.done:
+            raise Exception, "PlBatch: %s has not been run yet"%(self.name)
+        if self.fault is not None:
+            raise self.fault
+        return self.value
+
+class PlBatch:
+    """
+    Collects PLCAPI calls, made like on a PlShell, and sends them all at once
+    in a single system.multicall when run() is invoked; each call returns a
+    PlFuture right away. A call that fails only affects its own future.
+
+        batch = shell.batch()
+        hrns = dict( (person_id, batch.GetPersonHrn(person_id)) for person_id in person_ids )
+        batch.run()
+        hrn = hrns[person_id].result()
+    """
+
+    # do not let a single request grow without bounds
+    max_calls = 500
+
+    def __init__(self, shell):
+        self.shell = shell
+        self.calls = []
+
+    def __getattr__(self, name):
+        def func(*args):
+            actual_name=PlShell.actual_name(name)
+            future=PlFuture(name, args)
+            self.calls.append( (actual_name, args, future) )
+            return future
+        return func
+
+    # returns the futures, in the order the calls were made
+    def run(self):
+        futures = [ future for (actual_name, args, future) in self.calls ]
+        calls = []
+        for (actual_name, args, future) in self.calls:
+            (hit, result) = self.shell.cache_lookup(actual_name, args)
+            if hit:
+                future.set(result)
+            else:
+                calls.append( (actual_name, args, future) )
+        self.calls = []
+        try:
+            self.send(calls)
+        finally:
+            # reads that were sent along with writes may be outdated already
+            if all([ actual_name.startswith('Get') for (actual_name, args, future) in calls ]):
+                for (actual_name, args, future) in calls:
+                    if future.done and future.fault is None:
+                        self.shell.cache_store(actual_name, args, None, future.value)
+        return futures
+
+    def send(self, calls):
+        endpoint = self.shell.get_endpoint()
+        if not endpoint.multicall:
+            for (actual_name, args, future) in calls:
+                try:
+                    future.set(getattr(endpoint.get_proxy(), actual_name)(endpoint.plauth, *args))
+                except Exception, e:
+                    future.set(fault=e)
+            return
+        for start in range(0, len(calls), self.max_calls):
+            chunk = calls[start:start+self.max_calls]
+            multicall = xmlrpclib.MultiCall(endpoint.get_proxy())
+            for (actual_name, args, future) in chunk:
+                getattr(multicall, actual_name)(endpoint.plauth, *args)
+            results = multicall()
+            for (index, (actual_name, args, future)) in enumerate(chunk):
+                try:
+                    future.set(results[index])
+                except xmlrpclib.Fault, fault:
+                    future.set(fault=fault)
+            logger.debug('PlShell multicall with %d calls returned ... '%(len(chunk)))
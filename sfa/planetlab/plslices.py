@@ -9,7 +9,7 @@ from sfa.rspecs.rspec import RSpec
 from sfa.planetlab.vlink import VLink
 from sfa.planetlab.topology import Topology
 from sfa.planetlab.plxrn import PlXrn, hrn_to_pl_slicename, xrn_to_hostname, top_auth, hash_loginbase
-from sfa.storage.model import SliverAllocation
+from sfa.storage.model import SliverAllocation, EgreKey
 
 MAXINT =  2L**31-1
 
@@ -140,11 +140,29 @@ class PlSlices:
 
         return sfa_peer
 
+    # the verify_* methods below compute what differs between the request and
+    # the current state of the slice, and send the resulting PLCAPI writes in
+    # a single batch; a write that fails does not prevent the other ones from
+    # going through - this one logs the failed writes and returns them
+    def apply_batch(self, batch, message):
+        failed = []
+        for future in batch.run():
+            try:
+                future.result()
+            except Exception, e:
+                logger.warn('%s: %s%r\nCause:%s' % (message, future.name, future.args, str(e)))
+                failed.append(future)
+        return failed
+
     def verify_slice_leases(self, slice, rspec_requested_leases):
 
-        leases = self.driver.shell.GetLeases({'name':slice['name'], 'clip':int(time.time())}, 
-                                             ['lease_id','name', 'hostname', 't_from', 't_until'])
-        grain = self.driver.shell.GetLeaseGranularity()
+        batch = self.driver.shell.batch()
+        leases = batch.GetLeases({'name':slice['name'], 'clip':int(time.time())},
+                                 ['lease_id','name', 'hostname', 't_from', 't_until'])
+        grain = batch.GetLeaseGranularity()
+        batch.run()
+        leases = leases.result()
+        grain = grain.result()
 
         requested_leases = []
         for lease in rspec_requested_leases:
@@ -194,12 +212,14 @@ class PlSlices:
         added_leases = requested_leases
    
 
+        batch = self.driver.shell.batch()
+        if deleted_leases_id:
+            batch.DeleteLeases(deleted_leases_id)
+        for lease in added_leases:
+            batch.AddLeases(lease['hostname'], slice['name'], lease['t_from'], lease['t_until'])
         try:
-            self.driver.shell.DeleteLeases(deleted_leases_id)
-            for lease in added_leases:
-                self.driver.shell.AddLeases(lease['hostname'], slice['name'], lease['t_from'], lease['t_until'])
-
-        except: 
+            self.apply_batch(batch, 'Failed to add/remove slice leases')
+        except:
             logger.log_exc('Failed to add/remove slice leases')
 
         return leases
@@ -219,7 +239,8 @@ class PlSlices:
             if hostname:
                 slivers[hostname] = {'client_id': client_id, 'component_id': component_id}
         
-        nodes = self.driver.shell.GetNodes(slice['node_ids'], ['node_id', 'hostname', 'interface_ids'])
+        node_fields = ['node_id', 'hostname', 'interface_ids']
+        nodes = self.driver.shell.GetNodes(slice['node_ids'], node_fields)
         current_slivers = [node['hostname'] for node in nodes]
 
         # remove nodes not in rspec
@@ -228,18 +249,33 @@ class PlSlices:
         # add nodes from rspec
         added_nodes = list(set(slivers.keys()).difference(current_slivers))        
 
+        # the nodes we add are fetched along with the writes, so that the
+        # resulting set of nodes is known without reading the slice again
+        batch = self.driver.shell.batch()
+        if added_nodes:
+            batch.AddSliceToNodes(slice['name'], added_nodes)
+            new_nodes = batch.GetNodes(added_nodes, node_fields)
+        if deleted_nodes:
+            batch.DeleteSliceFromNodes(slice['name'], deleted_nodes)
         try:
-            self.driver.shell.AddSliceToNodes(slice['name'], added_nodes)
-            self.driver.shell.DeleteSliceFromNodes(slice['name'], deleted_nodes)
-            
-        except: 
+            failed = self.apply_batch(batch, 'Failed to add/remove slice from nodes')
+        except:
             logger.log_exc('Failed to add/remove slice from nodes')
+            failed = True
 
-        slices = self.driver.shell.GetSlices(slice['name'], ['node_ids']) 
-        resulting_nodes = self.driver.shell.GetNodes(slices[0]['node_ids'])
+        if failed:
+            slices = self.driver.shell.GetSlices(slice['name'], ['node_ids'])
+            resulting_nodes = self.driver.shell.GetNodes(slices[0]['node_ids'], node_fields)
+        else:
+            resulting_nodes = [ node for node in nodes if node['hostname'] not in deleted_nodes ]
+            if added_nodes:
+                resulting_nodes += new_nodes.result()
 
         # update sliver allocations
+        records = []
         for node in resulting_nodes:
+            if node['hostname'] not in slivers:
+                continue
             client_id = slivers[node['hostname']]['client_id']
             component_id = slivers[node['hostname']]['component_id']
             sliver_hrn = '%s.%s-%s' % (self.driver.hrn, slice['slice_id'], node['node_id'])
@@ -248,23 +284,43 @@ class PlSlices:
                                       component_id=component_id,
                                       slice_urn = slice_urn, 
                                       allocation_state='geni_allocated')      
-            record.sync(self.driver.api.dbsession())
+            records.append(record)
+        SliverAllocation.sync_allocations(records, self.driver.api.dbsession())
         return resulting_nodes
 
-    def free_egre_key(self):
-        used = set()
-        for tag in self.driver.shell.GetSliceTags({'tagname': 'egre_key'}):
-                used.add(int(tag['value']))
-
-        for i in range(1, 256):
-            if i not in used:
-                key = i
-                break
-        else:
-            raise KeyError("No more EGRE keys available")
-
+    # the EGRE keys are managed in the sfa db; the keys in use in PLC
+    # only need to be looked at the first time around, and when the pool
+    # looks exhausted, in case slices have been deleted in PLC directly
+    def get_egre_key(self, slice):
+        dbsession = self.driver.api.dbsession()
+        if not EgreKey.is_populated(dbsession):
+            (used, slice_names) = self.get_plc_egre_keys()
+            EgreKey.populate(dbsession, used)
+        try:
+            key = EgreKey.allocate(slice['name'], dbsession)
+        except KeyError:
+            (used, slice_names) = self.get_plc_egre_keys()
+            EgreKey.reconcile(dbsession, used, slice_names)
+            key = EgreKey.allocate(slice['name'], dbsession)
         return str(key)
 
+    # returns a dict that maps the egre_key tags in PLC to a slice_name,
+    # and the names of all the local slices
+    def get_plc_egre_keys(self):
+        slices = dict( (slice['slice_id'], slice) for slice in
+                       self.driver.shell.GetSlices({'peer_id': None}, ['slice_id', 'name']) )
+        used = {}
+        for tag in self.driver.shell.GetSliceTags({'tagname': 'egre_key'}, ['slice_id', 'value']):
+            slice = slices.get(tag['slice_id'])
+            if slice is None:
+                continue
+            try:
+                key = int(tag['value'])
+            except ValueError:
+                continue
+            used[key] = slice['name']
+        return (used, set([ slice['name'] for slice in slices.values() ]))
+
     def verify_slice_links(self, slice, requested_links, nodes):
          
         if not requested_links:
@@ -290,7 +346,7 @@ class PlSlices:
         slice_tags = []
         
         # set egre key
-        slice_tags.append({'name': 'egre_key', 'value': self.free_egre_key()})
+        slice_tags.append({'name': 'egre_key', 'value': self.get_egre_key(slice)})
     
         # set netns
         slice_tags.append({'name': 'netns', 'value': '1'})
@@ -450,12 +506,15 @@ class PlSlices:
             person_record['email']=default_email
             logger.debug ("second chance with email=%s"%person_record['email'])
             person_id = int (self.driver.shell.AddPerson(person_record))
-        self.driver.shell.AddRoleToPerson('user', person_id)
-        self.driver.shell.AddPersonToSite(person_id, site_id)
+        batch = self.driver.shell.batch()
+        batch.AddRoleToPerson('user', person_id)
+        batch.AddPersonToSite(person_id, site_id)
         # plcapi tends to mess with the incoming hrn so let's make sure
-        self.driver.shell.SetPersonHrn (person_id, user_hrn)
+        batch.SetPersonHrn (person_id, user_hrn)
         # also 'enabled':True does not seem to pass through with AddPerson
-        self.driver.shell.UpdatePerson (person_id, {'enabled': True})
+        batch.UpdatePerson (person_id, {'enabled': True})
+        for future in batch.run():
+            future.result()
 
         return person_id
 
@@ -509,16 +568,10 @@ class PlSlices:
         keep_person_ids = set(target_existing_person_ids) & set(slice_person_ids)
         del_person_ids  = set(slice_person_ids) - set(target_existing_person_ids)
 
-        # delete 
-        for person_id in del_person_ids:
-            self.driver.shell.DeletePersonFromSlice (person_id, slice_id)
-
         # about the last 2 sets, for managing keys, we need to trace back person_id -> user
-        # and for this we need all the Person objects; we already have the target_existing ones
-        # also we avoid issuing a call if possible
-        target_created_persons = [] if not target_created_person_ids \
-                                 else self.driver.shell.GetPersons \
-                                      ({'peer_id':None, 'person_id':target_created_person_ids}, person_fields)
+        # we already have the target_existing persons, and we know the hrns we just created
+        target_created_persons = [ {'person_id': person_id, 'hrn': hrn}
+                                   for (person_id, hrn) in zip (target_created_person_ids, tocreate_hrns) ]
         persons_by_person_id = { person['person_id'] : person \
                                  for person in target_existing_persons + target_created_persons }
 
@@ -528,10 +581,16 @@ class PlSlices:
             return users_by_hrn [hrn]
         
         persons_to_verify_keys = {}
+        batch = self.driver.shell.batch()
+        # delete
+        for person_id in del_person_ids:
+            batch.DeletePersonFromSlice (person_id, slice_id)
         # add 
         for person_id in add_person_ids:
-            self.driver.shell.AddPersonToSlice(person_id, slice_id)
+            batch.AddPersonToSlice(person_id, slice_id)
             persons_to_verify_keys[person_id] = user_by_person_id(person_id)
+        for future in batch.run():
+            future.result()
         # Update kept persons
         for person_id in keep_person_ids:
             persons_to_verify_keys[person_id] = user_by_person_id(person_id)
@@ -543,17 +602,26 @@ class PlSlices:
 
     def verify_keys(self, persons_to_verify_keys, options=None):
         if options is None: options={}
+        if not persons_to_verify_keys:
+            return
         # we only add keys that comes from sfa to persons in PL
+        person_ids = [ int(person_id) for person_id in persons_to_verify_keys ]
+        pl_keys_by_person_id = defaultdict(list)
+        for key in self.driver.shell.GetKeys({'person_id': person_ids}, ['person_id', 'key']):
+            pl_keys_by_person_id[key['person_id']].append(key['key'])
+
+        batch = self.driver.shell.batch()
         for person_id in persons_to_verify_keys:
              person_sfa_keys = persons_to_verify_keys[person_id].get('keys', [])
-             person_pl_keys = self.driver.shell.GetKeys({'person_id': int(person_id)})
-             person_pl_keys_list = [key['key'] for key in person_pl_keys]
+             person_pl_keys_list = pl_keys_by_person_id[int(person_id)]
 
              keys_to_add = set(person_sfa_keys).difference(person_pl_keys_list)
 
              for key_string in keys_to_add:
                   key = {'key': key_string, 'key_type': 'ssh'}
-                  self.driver.shell.AddPersonKey(int(person_id), key)
+                  batch.AddPersonKey(int(person_id), key)
+        for future in batch.run():
+            future.result()
 
 
     def verify_slice_attributes(self, slice, requested_slice_attributes, options=None, admin=False):
@@ -563,7 +631,12 @@ class PlSlices:
         filter = {'category': '*slice*'}
         if not admin:
             filter['|roles'] = ['user']
-        slice_attributes = self.driver.shell.GetTagTypes(filter)
+        batch = self.driver.shell.batch()
+        slice_attributes = batch.GetTagTypes(filter)
+        existing_slice_attributes = batch.GetSliceTags({'slice_id': slice['slice_id']})
+        batch.run()
+        slice_attributes = slice_attributes.result()
+        existing_slice_attributes = existing_slice_attributes.result()
         valid_slice_attribute_names = [attribute['tagname'] for attribute in slice_attributes]
 
         # get sliver attributes
@@ -571,7 +644,6 @@ class PlSlices:
         removed_slice_attributes = []
         # we need to keep the slice hrn anyway
         ignored_slice_attribute_names = ['hrn']
-        existing_slice_attributes = self.driver.shell.GetSliceTags({'slice_id': slice['slice_id']})
 
         # get attributes that should be removed
         for slice_tag in existing_slice_attributes:
@@ -607,19 +679,25 @@ class PlSlices:
                     added_slice_attributes.append(requested_attribute)
 
 
+        batch = self.driver.shell.batch()
         # remove stale attributes
-        for attribute in removed_slice_attributes:
+        removed = [ (attribute, batch.DeleteSliceTag(attribute['slice_tag_id']))
+                    for attribute in removed_slice_attributes ]
+        # add requested_attributes
+        added = [ (attribute, batch.AddSliceTag(slice['name'], attribute['name'],
+                                                attribute['value'], attribute.get('node_id', None)))
+                  for attribute in added_slice_attributes ]
+        batch.run()
+
+        for (attribute, future) in removed:
             try:
-                self.driver.shell.DeleteSliceTag(attribute['slice_tag_id'])
+                future.result()
             except Exception, e:
                 logger.warn('Failed to remove sliver attribute. name: %s, value: %s, node_id: %s\nCause:%s'\
                                 % (slice['name'], attribute['value'],  attribute.get('node_id'), str(e)))
-
-        # add requested_attributes
-        for attribute in added_slice_attributes:
+        for (attribute, future) in added:
             try:
-                self.driver.shell.AddSliceTag(slice['name'], attribute['name'], 
-                                              attribute['value'], attribute.get('node_id', None))
+                future.result()
             except Exception, e:
                 logger.warn('Failed to add sliver attribute. name: %s, value: %s, node_id: %s\nCause:%s'\
                                 % (slice['name'], attribute['value'],  attribute.get('node_id'), str(e)))
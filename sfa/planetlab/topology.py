@@ -6,7 +6,13 @@
 
 import os.path
 import traceback
+import threading
+from collections import OrderedDict
 from sfa.util.sfalogging import logger
+from sfa.util.xrn import hrn_to_urn
+from sfa.rspecs.elements.link import Link
+from sfa.rspecs.elements.interface import Interface
+from sfa.planetlab.plxrn import PlXrn
 
 class Topology(set):
     """
@@ -28,3 +34,103 @@ class Topology(set):
         except Exception, e:
             logger.log_exc("Could not find or load the configuration file: %s" % config_file)
             raise
+
+##
+# Return the Topology for config_file, parsed again only when the file changes
+
+topologies = {}
+topologies_lock = threading.Lock()
+
+def get_topology(config_file = "/etc/sfa/topology"):
+    try:
+        stamp = os.path.getmtime(config_file)
+    except OSError:
+        stamp = None
+    with topologies_lock:
+        if config_file in topologies and topologies[config_file][0] == stamp:
+            return topologies[config_file][1]
+    topology = Topology(config_file)
+    topology.stamp = stamp
+    with topologies_lock:
+        topologies[config_file] = (stamp, topology)
+    return topology
+
+##
+# The links between the nodes of the sites that the topology connects
+#
+# Every node of one site is linked to every node of the other site, so
+# there are lots of them; they are computed once, and only computed again
+# when the topology, the sites, the nodes or their first interface change;
+# the links of a few sets of nodes are kept, since listing resources
+# considers all the nodes and describing a slice only the slice's ones
+
+class LinkIndex:
+
+    def __init__(self, size=8):
+        self.lock = threading.Lock()
+        # fingerprint -> links, most recently used last
+        self.entries = OrderedDict()
+        self.size = size
+
+    ##
+    # @param sites dict site_id -> site
+    # @param nodes dict node_id -> node, for the nodes to consider
+    # @param interfaces dict interface_id -> interface
+
+    def get_links(self, hrn, topology, sites, nodes, interfaces):
+        pairs = [ (int(site_id1), int(site_id2)) for (site_id1, site_id2) in topology ]
+        pairs = [ (site_id1, site_id2) for (site_id1, site_id2) in pairs
+                  if site_id1 in sites and site_id2 in sites ]
+        site_ids = set([ site_id for pair in pairs for site_id in pair ])
+        # the ip of the first interface of each node
+        ips = {}
+        for site_id in site_ids:
+            for node_id in sites[site_id]['node_ids']:
+                if node_id in nodes and nodes[node_id]['interface_ids'] \
+                        and nodes[node_id]['interface_ids'][0] in interfaces:
+                    ips[node_id] = interfaces[nodes[node_id]['interface_ids'][0]]['ip']
+        fingerprint = (hrn, getattr(topology, 'stamp', id(topology)), tuple(sorted(pairs)),
+                       tuple(sorted([ (site_id, sites[site_id]['login_base'], tuple(sites[site_id]['node_ids']))
+                                      for site_id in site_ids ])),
+                       tuple(sorted(ips.items())))
+        with self.lock:
+            links = self.entries.pop(fingerprint, None)
+            if links is not None:
+                self.entries[fingerprint] = links
+                return links
+        links = self.build_links(hrn, pairs, sites, ips)
+        with self.lock:
+            self.entries[fingerprint] = links
+            while len(self.entries) > max(self.size, 0):
+                self.entries.popitem(last=False)
+        return links
+
+    def build_links(self, hrn, pairs, sites, ips):
+        # the urn of each node's first interface
+        urns = {}
+        for node_id in ips:
+            urns[node_id] = PlXrn(auth=hrn, interface='node%s:eth0' % node_id).urn
+        component_manager_id = hrn_to_urn(hrn, 'authority+am')
+        links = []
+        for (site_id1, site_id2) in pairs:
+            site1 = sites[site_id1]
+            site2 = sites[site_id2]
+            component_name = "%s:%s" % (site1['login_base'], site2['login_base'])
+            component_id = PlXrn(auth=hrn, interface=component_name).get_urn()
+            node_ids1 = [ node_id for node_id in site1['node_ids'] if node_id in ips ]
+            node_ids2 = [ node_id for node_id in site2['node_ids'] if node_id in ips ]
+            for node_id1 in node_ids1:
+                if1 = Interface({'component_id': urns[node_id1], 'ipv4': ips[node_id1]})
+                for node_id2 in node_ids2:
+                    if2 = Interface({'component_id': urns[node_id2], 'ipv4': ips[node_id2]})
+                    link = Link({'capacity': '1000000', 'latency': '0', 'packet_loss': '0', 'type': 'ipv4'})
+                    link['interface1'] = if1
+                    link['interface2'] = if2
+                    link['component_name'] = component_name
+                    link['component_id'] = component_id
+                    link['component_manager_id'] = component_manager_id
+                    links.append(link)
+        return links
+
+# shared by all PlAggregate instances
+link_index = LinkIndex()
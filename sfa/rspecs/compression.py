@@ -0,0 +1,77 @@
+#
+# Compressed RSpecs, as exchanged when geni_compressed is set: the rspec
+# is zlib-compressed then base64-encoded
+#
+# The same advertisement is typically served many times in a row, out of
+# the advertisement cache, i.e. as the very same string object; so the
+# compressed form of the last few rspecs is remembered next to the plain
+# string they come from. Looking them up by identity costs nothing, whereas
+# even hashing the rspec would cost about as much as compressing it
+#
+from __future__ import with_statement
+import zlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_COMPRESSION_LEVEL = 6
+# number of compressed rspecs kept, along with the plain ones; roughly one
+# per rspec version and set of options that clients commonly ask for
+DEFAULT_CACHE_SIZE = 4
+
+def compression_level(config):
+    return getattr(config, 'SFA_RSPEC_COMPRESSION_LEVEL', DEFAULT_COMPRESSION_LEVEL)
+
+def compress(rspec, level=DEFAULT_COMPRESSION_LEVEL):
+    return zlib.compress(rspec, level).encode('base64')
+
+def decompress(blob):
+    return zlib.decompress(blob.decode('base64'))
+
+##
+# Tell a compressed rspec from a plain one, that always starts with a tag
+
+def is_compressed(rspec):
+    return isinstance(rspec, basestring) and not rspec.lstrip().startswith('<')
+
+##
+# Return rspec in plain text, whether it was compressed or not
+
+def plain(rspec):
+    if is_compressed(rspec):
+        return decompress(rspec)
+    return rspec
+
+class CompressionCache:
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def compress(self, rspec, level=DEFAULT_COMPRESSION_LEVEL):
+        # the entry holds on to rspec, so its id cannot be reused meanwhile
+        key = (id(rspec), level)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] is rspec:
+                # most recently used goes last
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        blob = compress(rspec, level)
+        with self.lock:
+            self.entries[key] = (rspec, blob)
+            while len(self.entries) > max(self.size, 0):
+                self.entries.popitem(last=False)
+        return blob
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'max_size': self.size,
+                    'hits': self.hits, 'misses': self.misses}
+
+# the process-wide cache
+compression_cache = CompressionCache()
@@ -1,5 +1,6 @@
 from sfa.util.xrn import Xrn, get_leaf
 from sfa.util.xml import XpathFilter
+from sfa.rspecs.node_index import lookup_nodes
 
 from sfa.rspecs.elements.node import NodeElement
 from sfa.rspecs.elements.sliver import Sliver
@@ -84,8 +85,10 @@ class PGv2Node:
     @staticmethod
     def get_nodes(xml, filter=None):
         if filter is None: filter={}
-        xpath = '//node%s | //default:node%s' % (XpathFilter.xpath(filter), XpathFilter.xpath(filter))
-        node_elems = xml.xpath(xpath)
+        node_elems = lookup_nodes(xml, filter)
+        if node_elems is None:
+            xpath = '//node%s | //default:node%s' % (XpathFilter.xpath(filter), XpathFilter.xpath(filter))
+            node_elems = xml.xpath(xpath)
         return PGv2Node.get_node_objs(node_elems)
 
     @staticmethod
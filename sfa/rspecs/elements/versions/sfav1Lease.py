@@ -2,6 +2,7 @@ from sfa.util.sfalogging import logger
 from sfa.util.xml import XpathFilter
 from sfa.util.xrn import Xrn
 from sfa.util.sfatime import utcparse, datetime_to_string, datetime_to_epoch
+from sfa.rspecs.node_index import forget_nodes
 
 from sfa.rspecs.elements.element import Element
 from sfa.rspecs.elements.node import NodeElement
@@ -22,7 +23,8 @@ class SFAv1Lease:
 
     @staticmethod
     def add_leases(xml, leases):
-        
+        # leases hold nodes too
+        forget_nodes(xml)
         network_elems = xml.xpath('//network')
         if len(network_elems) > 0:
             network_elem = network_elems[0]
@@ -1,5 +1,6 @@
 from sfa.util.sfalogging import logger
 from sfa.util.xml import XpathFilter
+from sfa.rspecs.node_index import lookup_nodes, forget_nodes
 from sfa.util.xrn import Xrn, get_leaf
 
 from sfa.rspecs.elements.element import Element
@@ -29,6 +30,7 @@ class SFAv1Node:
         else:
             network_elem = xml
 
+        forget_nodes(xml)
         node_elems = []       
         for node in nodes:
             node_fields = ['component_manager_id', 'component_id', 'boot_state']
@@ -127,8 +129,10 @@ class SFAv1Node:
     @staticmethod
     def get_nodes(xml, filter=None):
         if filter is None: filter={}
-        xpath = '//node%s | //default:node%s' % (XpathFilter.xpath(filter), XpathFilter.xpath(filter))
-        node_elems = xml.xpath(xpath)
+        node_elems = lookup_nodes(xml, filter)
+        if node_elems is None:
+            xpath = '//node%s | //default:node%s' % (XpathFilter.xpath(filter), XpathFilter.xpath(filter))
+            node_elems = xml.xpath(xpath)
         return SFAv1Node.get_node_objs(node_elems)
 
     @staticmethod
@@ -0,0 +1,96 @@
+#
+# Look up the nodes of an rspec by component_id, client_id, sliver_id or
+# hostname without scanning the whole document each time
+#
+# The maps are built lazily, one per key, on the first lookup, and are
+# attached to the sfa.util.xml.XML object. They are dropped whenever nodes
+# get added to the document (see forget_nodes), and every element found
+# is checked against the document, so that removed or changed nodes are
+# not returned; a value that is not in the maps is not in the document
+#
+from sfa.util.xml import XML, XmlElement
+from sfa.util.xrn import Xrn, get_leaf
+
+class NodeIndex:
+
+    keys = ['component_id', 'client_id', 'sliver_id', 'hostname']
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.maps = {}
+
+    @staticmethod
+    def value(element, key):
+        if key != 'hostname':
+            return element.get(key)
+        if element.get('component_name'):
+            return element.get('component_name')
+        if element.get('component_id'):
+            return Xrn.unescape(get_leaf(Xrn(element.get('component_id')).get_hrn()))
+        return None
+
+    def node_elements(self):
+        root = self.xml.root.element
+        default_namespace = self.xml.namespaces.get('default')
+        if default_namespace:
+            return root.iter('{%s}node' % default_namespace, 'node')
+        return root.iter('node')
+
+    ##
+    # Return the node elements whose key is value
+
+    def lookup(self, key, value):
+        if key not in self.maps:
+            map = {}
+            for element in self.node_elements():
+                element_value = NodeIndex.value(element, key)
+                if element_value is not None:
+                    map.setdefault(element_value, []).append(element)
+            self.maps[key] = map
+        root = self.xml.root.element
+        return [ element for element in self.maps[key].get(value, [])
+                 if NodeIndex.attached(element, root) and NodeIndex.value(element, key) == value ]
+
+    # a removed element still belongs to the lxml document, so walk up to the root
+    @staticmethod
+    def attached(element, root):
+        while element is not None:
+            if element is root:
+                return True
+            element = element.getparent()
+        return False
+
+    def forget(self, keys=None):
+        if keys is None:
+            keys = self.maps.keys()
+        for key in keys:
+            self.maps.pop(key, None)
+
+##
+# To be called when nodes are added to xml, or when the attributes they
+# are looked up by change (all of them, or the ones in keys)
+
+def forget_nodes(xml, keys=None):
+    if isinstance(xml, XML) and xml.node_index is not None:
+        xml.node_index.forget(keys)
+
+##
+# Return the nodes that match filter as XmlElements, or None if the
+# filter cannot be served from the index; component_id patterns like
+# '*urn*' or '*hostname*', as used throughout the rspec code, are looked
+# up as exact component_ids or hostnames respectively, whether the node
+# is there or not
+
+def lookup_nodes(xml, filter):
+    if not isinstance(xml, XML) or xml.root is None or not filter or len(filter) != 1:
+        return None
+    (key, value) = filter.items()[0]
+    if key not in ['component_id', 'client_id', 'sliver_id'] or not isinstance(value, str):
+        return None
+    if '*' in value:
+        value = value.replace('*', '')
+        if key == 'component_id' and not value.startswith('urn:'):
+            key = 'hostname'
+    if xml.node_index is None:
+        xml.node_index = NodeIndex(xml)
+    return [ XmlElement(element, xml.namespaces) for element in xml.node_index.lookup(key, value) ]
@@ -0,0 +1,124 @@
+#
+# Serialize the nodes of an RSpec one at a time
+#
+# An advertisement for a large testbed is mostly made of nodes; rather than
+# adding them all to the lxml tree and serializing the whole thing, the
+# nodes of a NodeStream are turned into xml one by one, each in a small
+# scratch document that has the same ancestors as the real one, and the
+# resulting text is spliced into the serialized rspec. The output is the
+# same as if the nodes had been added with version.add_nodes
+#
+import copy
+from lxml import etree
+
+from sfa.util.xml import XML, XmlElement
+
+class NodeStream:
+
+    # stands for the nodes in the serialized document
+    marker = 'sfa_node_stream_marker'
+
+    ##
+    # @param rspec the RSpec the nodes belong to
+    # @param nodes an iterable of rspec nodes, typically a generator
+
+    def __init__(self, rspec, nodes):
+        self.rspec = rspec
+        self.nodes = iter(nodes)
+        self.slot = None
+        self.first = None
+        self.streamed = False
+        for node in self.nodes:
+            self.first = node
+            break
+        if self.first is None:
+            return
+        # let the version lay out the document as needed (e.g. the network
+        # element in sfa rspecs), and remember where the nodes go
+        root = rspec.xml.root.element
+        before = set(root.iter())
+        # add_nodes may alter the node it is given
+        rspec.version.add_nodes([copy.deepcopy(self.first)])
+        for element in root.iter():
+            if element not in before and etree.QName(element).localname == 'node':
+                self.slot = element
+                break
+
+    def is_empty(self):
+        return self.slot is None
+
+    ##
+    # Split the serialization of root at the marker that stands in place
+    # of element; return the text before the marker, without the
+    # indentation of the marker line, the indentation, and the text after
+
+    def split(self, root, element):
+        parent = element.getparent()
+        marker = etree.Element(NodeStream.marker)
+        parent.replace(element, marker)
+        try:
+            text = etree.tostring(root, encoding='UTF-8', pretty_print=True)
+        finally:
+            parent.replace(marker, element)
+        start = text.index('<' + NodeStream.marker)
+        end = text.index('/>', start) + 2
+        head = text[:start]
+        indent = head[head.rfind('\n')+1:]
+        if indent.strip() or not text[end:].startswith('\n'):
+            raise ValueError("NodeStream: unexpected layout around the nodes")
+        return (head[:len(head)-len(indent)], indent, text[end+1:])
+
+    # a document with only the ancestors of the slot, and a version that writes into it
+    def scratch(self):
+        ancestors = [ element for element in self.slot.iterancestors() ]
+        ancestors.reverse()
+        parent = None
+        for element in ancestors:
+            if parent is None:
+                copied = etree.Element(element.tag, dict(element.attrib), nsmap=element.nsmap)
+                root = copied
+            else:
+                nsmap = dict( (prefix, uri) for (prefix, uri) in element.nsmap.items()
+                              if parent.nsmap.get(prefix) != uri )
+                copied = etree.SubElement(parent, element.tag, dict(element.attrib), nsmap=nsmap)
+            parent = copied
+        xml = XML()
+        xml.namespaces = self.rspec.xml.namespaces
+        xml.root = XmlElement(root, xml.namespaces)
+        version = copy.copy(self.rspec.version)
+        version.xml = xml
+        return (root, parent, version)
+
+    ##
+    # Yield the serialized rspec piece by piece
+
+    def chunks(self, header=''):
+        root = self.rspec.xml.root.element
+        (head, indent, tail) = self.split(root, self.slot)
+        (scratch_root, container, version) = self.scratch()
+        placeholder = etree.SubElement(container, NodeStream.marker)
+        (scratch_head, scratch_indent, scratch_tail) = self.split(scratch_root, placeholder)
+        container.remove(placeholder)
+        if scratch_indent != indent:
+            raise ValueError("NodeStream: scratch document does not match")
+        scratch_head += scratch_indent
+        scratch_tail = '\n' + scratch_tail
+
+        yield header + head
+        for node in self.iter_nodes():
+            version.add_nodes([node])
+            text = etree.tostring(scratch_root, encoding='UTF-8', pretty_print=True)
+            for child in list(container):
+                container.remove(child)
+            if not text.startswith(scratch_head) or not text.endswith(scratch_tail):
+                raise ValueError("NodeStream: unexpected layout for node %s" % node.get('component_id'))
+            yield indent + text[len(scratch_head):len(text)-len(scratch_tail)] + '\n'
+        yield tail
+
+    def iter_nodes(self):
+        if self.streamed:
+            raise ValueError("NodeStream: the nodes have already been serialized")
+        self.streamed = True
+        yield self.first
+        for node in self.nodes:
+            yield node
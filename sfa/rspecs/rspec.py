@@ -7,6 +7,7 @@ from sfa.util.sfatime import SFATIME_FORMAT
 
 from sfa.rspecs.rspec_elements import RSpecElement, RSpecElements 
 from sfa.rspecs.version_manager import VersionManager
+from sfa.rspecs.node_stream import NodeStream
 
 class RSpec:
  
@@ -21,6 +22,7 @@ class RSpec:
         self.ttl = ttl
         self.expires = expires
         self.elements = {}
+        self.node_stream = None
         if rspec:
             if version:
                 self.version = self.version_manager.get_version(version)
@@ -117,7 +119,26 @@ class RSpec:
                     parent.remove(node.element) 
         
 
+    def stream_nodes(self, nodes):
+        """
+        Like version.add_nodes, except that the nodes are only turned into xml
+        one at a time by toxml, so that a large advertisement never exists as
+        a whole lxml tree; nodes can be a generator, and can only be
+        serialized once. The nodes are not visible to the other methods.
+        """
+        stream = NodeStream(self, nodes)
+        if not stream.is_empty():
+            self.node_stream = stream
+        elif stream.first is not None:
+            # this version does not lay out nodes in a way we know of
+            self.version.add_nodes(list(stream.nodes))
+
     def toxml(self, header=True):
+        if self.node_stream is not None:
+            if header:
+                return ''.join(self.node_stream.chunks(self.header))
+            else:
+                return ''.join(self.node_stream.chunks())
         if header:
             return self.header + self.xml.toxml()
         else:
@@ -2,6 +2,7 @@ from copy import deepcopy
 from StringIO import StringIO
 from sfa.util.xrn import Xrn
 from sfa.rspecs.version import RSpecVersion
+from sfa.rspecs.node_index import forget_nodes
 from sfa.rspecs.elements.versions.pgv2Link import PGv2Link
 from sfa.rspecs.elements.versions.pgv2Node import PGv2Node
 from sfa.rspecs.elements.versions.pgv2SliverType import PGv2SliverType
@@ -50,6 +51,7 @@ class PGv2(RSpecVersion):
     
     def merge_node(self, source_node_tag):
         # this is untested
+        forget_nodes(self.xml)
         self.xml.root.append(deepcopy(source_node_tag))
 
     # Slivers
@@ -139,6 +141,7 @@ class PGv2(RSpecVersion):
 
             # set the client id
             node_elem.element.set('client_id', hostname)
+            forget_nodes(self.xml, ['client_id'])
             if sliver_urn:
                 pass
                 # TODO
@@ -4,6 +4,7 @@ from lxml import etree
 from sfa.util.sfalogging import logger
 from sfa.util.xrn import hrn_to_urn, urn_to_hrn
 from sfa.rspecs.version import RSpecVersion
+from sfa.rspecs.node_index import forget_nodes
 from sfa.rspecs.elements.element import Element
 from sfa.rspecs.elements.versions.pgv2Link import PGv2Link
 from sfa.rspecs.elements.versions.sfav1Node import SFAv1Node
@@ -55,6 +56,7 @@ class SFAv1(RSpecVersion):
             return
 
         network_tag = self.add_network(network)
+        forget_nodes(self.xml)
         network_tag.append(deepcopy(source_node_tag))
 
     # Slivers
@@ -1,3 +1,5 @@
+import os
+
 from sfa.client.sfaserverproxy import SfaServerProxy
 from sfa.util.xml import XML
 
@@ -30,9 +32,31 @@ class Interface:
             # xxx url and self.api are undefined
             server = GeniClientLight(url, self.api.key_file, self.api.cert_file)
         else:
-            server = SfaServerProxy(self.get_url(), key_file, cert_file, timeout) 
+            server = SfaServerProxy(self.get_url(), key_file, cert_file, timeout=timeout)
  
         return server       
+
+class RoutingTable:
+    """
+    Find the interface in charge of a hrn, i.e. the one whose hrn is the
+    longest prefix of that hrn, component by component; built once from
+    a list of hrns, it does not change afterwards
+    """
+    def __init__(self, hrns):
+        self.hrns = frozenset(hrns)
+        self.depth = max([ len(hrn.split('.')) for hrn in self.hrns ] + [0])
+
+    def best_match(self, hrn):
+        """
+        Return the longest known hrn that hrn is or is under, or None
+        """
+        parts = hrn.split('.')
+        for length in range(min(len(parts), self.depth), 0, -1):
+            prefix = '.'.join(parts[:length])
+            if prefix in self.hrns:
+                return prefix
+        return None
+
 ##
 # In is a dictionary of registry connections keyed on the registry
 # hrn
@@ -55,7 +79,10 @@ class Interfaces(dict):
 
     def __init__(self, conf_file):
         dict.__init__(self, {})
+        self.routing_table = None
         # load config file
+        self.conf_file = conf_file
+        self.conf_mtime = self.get_conf_mtime()
         required_fields = set(self.default_fields.keys())
         self.interface_info = XML(conf_file).todict()
         for value in self.interface_info.values():
@@ -73,3 +100,32 @@ class Interfaces(dict):
 
     def server_proxy(self, hrn, key_file, cert_file, timeout=30):
         return self[hrn].server_proxy(key_file, cert_file, timeout)
+
+    # the routing table is computed again when interfaces come and go
+    def __setitem__(self, hrn, interface):
+        dict.__setitem__(self, hrn, interface)
+        self.routing_table = None
+
+    def __delitem__(self, hrn):
+        dict.__delitem__(self, hrn)
+        self.routing_table = None
+
+    def best_match(self, hrn):
+        """
+        Return the hrn of the interface in charge of hrn, or None
+        """
+        if self.routing_table is None:
+            self.routing_table = RoutingTable(self.keys())
+        return self.routing_table.best_match(hrn)
+
+    def get_conf_mtime(self):
+        try:
+            return os.stat(self.conf_file).st_mtime
+        except OSError:
+            return None
+
+    def is_stale(self):
+        """
+        Tell whether the config file has changed since it was loaded
+        """
+        return self.get_conf_mtime() != self.conf_mtime
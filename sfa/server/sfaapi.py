@@ -13,6 +13,8 @@ from sfa.trust.rights import determine_rights
 from sfa.util.version import version_core
 from sfa.server.xmlrpcapi import XmlrpcApi
 from sfa.client.return_value import ReturnValue
+from sfa.client.sfaserverproxy import set_connection_pool_limits, \
+     DEFAULT_POOL_MAX_IDLE, DEFAULT_POOL_MAX_PER_HOST
 
 from sfa.storage.alchemy import alchemy
 
@@ -48,7 +50,7 @@ class SfaApi (XmlrpcApi):
         # Load configuration
         self.config = Config(config)
         self.credential = None
-        self.auth = Auth(peer_cert)
+        self.auth = Auth(peer_cert, self.config)
         self.interface = interface
         self.hrn = self.config.SFA_INTERFACE_HRN
         self.key_file = key_file
@@ -58,6 +60,10 @@ class SfaApi (XmlrpcApi):
         self.cache = cache
         if self.cache is None:
             self.cache = Cache()
+        # connections to other SFA servers are kept open between calls
+        set_connection_pool_limits(
+            getattr(self.config, 'SFA_CONNECTION_POOL_MAX_IDLE', DEFAULT_POOL_MAX_IDLE),
+            getattr(self.config, 'SFA_CONNECTION_POOL_SIZE', DEFAULT_POOL_MAX_PER_HOST))
 
         # load registries
         from sfa.server.registry import Registries
@@ -70,6 +76,28 @@ class SfaApi (XmlrpcApi):
         # filled later on by generic/Generic
         self.manager=None
         self._dbsession=None
+        # set by the ApiPool, returns the state of the server thread pool
+        self.server_stats=None
+
+    def reset (self, peer_cert = None, remote_addr = None):
+        """
+        Get ready to serve a new request; api objects are reused across
+        requests (see ApiPool), and only this part of their state is
+        specific to a request
+        """
+        self.auth.set_peer_cert(peer_cert)
+        self.remote_addr = remote_addr
+        self.close_dbsession()
+        # pick up changes in /etc/sfa/{registries,aggregates}.xml
+        if self.registries.is_stale():
+            from sfa.server.registry import Registries
+            self.registries = Registries()
+        if self.aggregates.is_stale():
+            from sfa.server.aggregate import Aggregates
+            self.aggregates = Aggregates()
+        # not all drivers derive from Driver
+        if hasattr(getattr(self, 'driver', None), 'reset'):
+            self.driver.reset()
 
     def server_proxy(self, interface, cred, timeout=30):
         """
@@ -180,7 +208,7 @@ class SfaApi (XmlrpcApi):
         new_cred = Credential(subject = object_gid.get_subject())
         new_cred.set_gid_caller(object_gid)
         new_cred.set_gid_object(object_gid)
-        new_cred.set_issuer_keys(auth_info.get_privkey_filename(), auth_info.get_gid_filename())
+        new_cred.set_issuer_keys(auth_info.get_pkey_object(), auth_info.get_gid_object())
         
         r1 = determine_rights(type, hrn)
         new_cred.set_privileges(r1)
@@ -7,10 +7,12 @@
 ##
 
 import sys
+import time
 import socket
+import select
 import traceback
 import threading
-from Queue import Queue
+from Queue import Queue, Empty, Full
 import xmlrpclib
 import SocketServer
 import BaseHTTPServer
@@ -18,6 +20,7 @@ import SimpleXMLRPCServer
 from OpenSSL import SSL
 
 from sfa.util.sfalogging import logger
+from sfa.util.faults import ServerBusy
 from sfa.util.config import Config
 from sfa.util.cache import Cache 
 from sfa.trust.certificate import Certificate
@@ -81,17 +84,177 @@ def verify_callback(conn, x509, err, depth, preverify):
 
     return 0
 
+##
+# Building an api object is expensive: it reads the config, the server key
+# and cert, registries.xml and aggregates.xml, and creates a manager and a
+# driver. An ApiPool keeps the api objects that are not in use, so that
+# each request just needs to reset the per-request state of one of them.
+# There are never more api objects than requests being served at once.
+
+class ApiPool:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = []
+        self.generic = None
+        self.created = 0
+
+    def get(self, server, cache, peer_cert, remote_addr):
+        with self.lock:
+            api = None
+            if self.idle:
+                api = self.idle.pop()
+            elif self.generic is None:
+                self.generic = Generic.the_flavour()
+        if api is None:
+            api = self.generic.make_api(peer_cert = peer_cert,
+                                        interface = server.interface,
+                                        key_file = server.key_file,
+                                        cert_file = server.cert_file,
+                                        cache = cache)
+            # lets GetVersion report how busy the server is
+            api.server_stats = getattr(server, 'get_pool_stats', None)
+            with self.lock:
+                self.created += 1
+            logger.debug("ApiPool: created api object #%d" % self.created)
+        api.reset(peer_cert, remote_addr)
+        return api
+
+    def put(self, api):
+        # drop whatever the request has left behind
+        api.close_dbsession()
+        with self.lock:
+            self.idle.append(api)
+
+##
+# A buffered reader on an SSL connection, used as the rfile of the request
+# handlers; unlike socket._fileobject it tells how many bytes it has read
+# ahead, which is how a pipelined request gets noticed
+
+class ConnectionReader:
+
+    def __init__(self, connection, bufsize=8192):
+        self.connection = connection
+        self.bufsize = bufsize
+        self.buffer = ''
+        self.closed = False
+
+    def buffered(self):
+        return len(self.buffer)
+
+    # returns what the connection has to offer, or '' once it is closed
+    def recv(self, size=0):
+        try:
+            return self.connection.recv(max(size, self.bufsize))
+        except SSL.ZeroReturnError:
+            return ''
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            data = self.recv(size - length)
+            if not data:
+                break
+            chunks.append(data)
+            length += len(data)
+        data = ''.join(chunks)
+        if size < 0 or size >= length:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        start = 0
+        while True:
+            end = self.buffer.find('\n', start) + 1
+            if end or 0 <= size <= len(self.buffer):
+                break
+            start = len(self.buffer)
+            data = self.recv()
+            if not data:
+                break
+            self.buffer += data
+        if not end:
+            end = len(self.buffer)
+        if 0 <= size < end:
+            end = size
+        line = self.buffer[:end]
+        self.buffer = self.buffer[end:]
+        return line
+
+    def close(self):
+        self.buffer = ''
+        self.closed = True
+
 ##
 # taken from the web (XXX find reference). Implements HTTPS xmlrpc request handler
+#
+# Connections are persistent (HTTP/1.1 keep-alive): once a response is sent,
+# the handler waits for the next request on the same connection, for up to
+# SFA_SERVER_KEEPALIVE_TIMEOUT seconds and for at most
+# SFA_SERVER_KEEPALIVE_MAX_REQUESTS requests. The peer certificate and the
+# api object are set up once per connection.
 class SecureXMLRpcRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
     """Secure XML-RPC request handler class.
 
     It it very similar to SimpleXMLRPCRequestHandler but it uses HTTPS for transporting XML data.
     """
+    protocol_version = "HTTP/1.1"
+    # how often an idle connection checks whether its thread is needed elsewhere
+    poll_interval = 0.5
+
     def setup(self):
         self.connection = self.request
-        self.rfile = socket._fileobject(self.request, "rb", self.rbufsize)
+        self.rfile = ConnectionReader(self.request)
         self.wfile = socket._fileobject(self.request, "wb", self.wbufsize)
+        self.api = None
+        self.peer_cert = None
+        self.requests_served = 0
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            try:
+                self.handle_one_request()
+            except (SSL.Error, socket.error):
+                # the client went away between two requests
+                self.close_connection = 1
+
+    ##
+    # Wait until the client sends its next request; returns False if the
+    # connection should be closed instead
+
+    def wait_for_request(self):
+        # a pipelined request is already there
+        if self.rfile.buffered() or self.connection.pending():
+            return True
+        deadline = time.time() + self.server.keepAliveTimeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            # this thread is worth more to the requests waiting for one
+            if self.server.waiting_requests():
+                return False
+            try:
+                readable = select.select([self.connection], [], [],
+                                         min(remaining, self.poll_interval))[0]
+            except (select.error, socket.error):
+                return False
+            if readable:
+                return True
+
+    def finish(self):
+        try:
+            SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.finish(self)
+        finally:
+            # make the api available to other connections
+            if self.api is not None:
+                self.server.api_pool.put(self.api)
+                self.api = None
 
     def do_POST(self):
         """Handles the HTTPS POST request.
@@ -99,15 +262,16 @@ class SecureXMLRpcRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
         It was copied out from SimpleXMLRPCServer.py and modified to shutdown 
         the socket cleanly.
         """
+        request = None
         try:
-            peer_cert = Certificate()
-            peer_cert.load_from_pyopenssl_x509(self.connection.get_peer_certificate())
-            generic=Generic.the_flavour()
-            self.api = generic.make_api (peer_cert = peer_cert, 
-                                         interface = self.server.interface, 
-                                         key_file = self.server.key_file, 
-                                         cert_file = self.server.cert_file,
-                                         cache = self.cache)
+            remote_addr = (remote_ip, remote_port) = self.connection.getpeername()
+            if self.peer_cert is None:
+                self.peer_cert = Certificate()
+                self.peer_cert.load_from_pyopenssl_x509(self.connection.get_peer_certificate())
+            if self.api is None:
+                self.api = self.server.api_pool.get(self.server, self.cache, self.peer_cert, remote_addr)
+            else:
+                self.api.reset(self.peer_cert, remote_addr)
             #logger.info("SecureXMLRpcRequestHandler.do_POST:")
             #logger.info("interface=%s"%self.server.interface)
             #logger.info("key_file=%s"%self.server.key_file)
@@ -116,34 +280,46 @@ class SecureXMLRpcRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
             #logger.info("handler=%s"%self)
             # get arguments
             request = self.rfile.read(int(self.headers["content-length"]))
-            remote_addr = (remote_ip, remote_port) = self.connection.getpeername()
-            self.api.remote_addr = remote_addr            
             response = self.api.handle(remote_addr, request, self.server.method_map)
         except Exception, fault:
             # This should only happen if the module is buggy
             # internal error, report as HTTP server error
             logger.log_exc("server.do_POST")
-            response = self.api.prepare_response(fault)
+            if self.api is not None:
+                response = self.api.prepare_response(fault)
+            else:
+                response = xmlrpclib.dumps(xmlrpclib.Fault(1, str(fault)), methodresponse=True)
             #self.send_response(500)
             #self.end_headers()
        
         # avoid session/connection leaks : do this no matter what 
         finally:
+            self.requests_served += 1
             self.send_response(200)
             self.send_header("Content-type", "text/xml")
             self.send_header("Content-length", str(len(response)))
+            # we are out of sync with the client if the request was not read
+            if request is None or self.server.keepAliveTimeout <= 0 or \
+                    self.requests_served >= self.server.keepAliveMaxRequests:
+                self.send_header("Connection", "close")
             self.end_headers()
             self.wfile.write(response)
             self.wfile.flush()
             # close db connection
-            self.api.close_dbsession()
+            if self.api is not None:
+                self.api.close_dbsession()
             # shut down the connection
-            self.connection.shutdown() # Modified here!
+            if self.close_connection:
+                self.connection.shutdown() # Modified here!
 
 ##
 # Taken from the web (XXX find reference). Implements an HTTPS xmlrpc server
 class SecureXMLRPCServer(BaseHTTPServer.HTTPServer,SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
 
+    # defaults, for when the config does not say
+    keepAliveTimeout = 15
+    keepAliveMaxRequests = 100
+
     def __init__(self, server_address, HandlerClass, key_file, cert_file, logRequests=True):
         """
         Secure XML-RPC server.
@@ -157,6 +333,11 @@ class SecureXMLRPCServer(BaseHTTPServer.HTTPServer,SimpleXMLRPCServer.SimpleXMLR
         self.key_file = key_file
         self.cert_file = cert_file
         self.method_map = {}
+        self.api_pool = ApiPool()
+        config = Config()
+        self.keepAliveTimeout = getattr(config, 'SFA_SERVER_KEEPALIVE_TIMEOUT', self.keepAliveTimeout)
+        self.keepAliveMaxRequests = getattr(config, 'SFA_SERVER_KEEPALIVE_MAX_REQUESTS',
+                                            self.keepAliveMaxRequests)
         # add cache to the request handler
         HandlerClass.cache = Cache()
         #for compatibility with python 2.4 (centos53)
@@ -170,7 +351,6 @@ class SecureXMLRPCServer(BaseHTTPServer.HTTPServer,SimpleXMLRPCServer.SimpleXMLR
         ctx.use_certificate_file(cert_file)
         # If you wanted to verify certs against known CAs.. this is how you would do it
         #ctx.load_verify_locations('/etc/sfa/trusted_roots/plc.gpo.gid')
-        config = Config()
         trusted_cert_files = TrustedRoots(config.get_trustedroots_dir()).get_file_list()
         for cert_file in trusted_cert_files:
             ctx.load_verify_locations(cert_file)
@@ -182,6 +362,10 @@ class SecureXMLRPCServer(BaseHTTPServer.HTTPServer,SimpleXMLRPCServer.SimpleXMLR
         self.server_bind()
         self.server_activate()
 
+    # how many requests are waiting for a thread
+    def waiting_requests(self):
+        return 0
+
     # _dispatch
     #
     # Convert an exception on the server to a full stack trace and send it to
@@ -223,31 +407,68 @@ class SecureXMLRPCServer(BaseHTTPServer.HTTPServer,SimpleXMLRPCServer.SimpleXMLR
         # ----------
         self.close_request(request)
 
+##
+# Answers the requests that ThreadPoolMixIn cannot queue, with a ServerBusy
+# fault and without building an api object
+class BusyRequestHandler(SecureXMLRpcRequestHandler):
+
+    def do_POST(self):
+        try:
+            # consume the request so the client gets to read our answer
+            self.rfile.read(int(self.headers["content-length"]))
+        except:
+            pass
+        response = xmlrpclib.dumps(ServerBusy(), methodresponse=True)
+        self.send_response(200)
+        self.send_header("Content-type", "text/xml")
+        self.send_header("Content-length", str(len(response)))
+        self.send_header("Retry-After", "1")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(response)
+        self.wfile.flush()
+        self.connection.shutdown()
+
 ## From Active State code: http://code.activestate.com/recipes/574454/
 # This is intended as a drop-in replacement for the ThreadingMixIn class in 
 # module SocketServer of the standard lib. Instead of spawning a new thread 
 # for each request, requests are processed by of pool of reusable threads.
+#
+# The pool is elastic: it starts with SFA_SERVER_MIN_THREADS workers, grows
+# up to SFA_SERVER_MAX_THREADS when all of them are busy, and shrinks back
+# when workers stay idle for SFA_SERVER_THREAD_IDLE_TIMEOUT seconds.
+# At most SFA_SERVER_QUEUE_SIZE requests wait for a worker; beyond that
+# requests get a ServerBusy fault right away, instead of piling up.
 class ThreadPoolMixIn(SocketServer.ThreadingMixIn):
     """
     use a thread pool instead of a new thread on every request
     """
-    # XX TODO: Make this configurable
-    # config = Config()
-    # numThreads = config.SFA_SERVER_NUM_THREADS
-    numThreads = 25
+    # defaults, for when the config does not say
+    minThreads = 5
+    maxThreads = 25
+    queueSize = 100
+    idleTimeout = 60
+    # how many turned down requests may wait for their answer
+    rejectQueueSize = 100
+    # how often the pool statistics get logged, in seconds
+    statsPeriod = 300
     allow_reuse_address = True  # seems to fix socket.error on server restart
 
+    def configure_pool(self, config=None):
+        if config is None:
+            config = Config()
+        self.minThreads = getattr(config, 'SFA_SERVER_MIN_THREADS', self.minThreads)
+        self.maxThreads = max(self.minThreads,
+                              getattr(config, 'SFA_SERVER_MAX_THREADS', self.maxThreads))
+        self.queueSize = getattr(config, 'SFA_SERVER_QUEUE_SIZE', self.queueSize)
+        self.idleTimeout = getattr(config, 'SFA_SERVER_THREAD_IDLE_TIMEOUT', self.idleTimeout)
+
     def serve_forever(self):
         """
         Handle one request at a time until doomsday.
         """
-        # set up the threadpool
-        self.requests = Queue()
-
-        for x in range(self.numThreads):
-            t = threading.Thread(target = self.process_request_thread)
-            t.setDaemon(1)
-            t.start()
+        self.configure_pool()
+        self.start_pool()
 
         # server main loop
         while True:
@@ -255,15 +476,62 @@ class ThreadPoolMixIn(SocketServer.ThreadingMixIn):
             
         self.server_close()
 
-    
+    def start_pool(self):
+        """
+        Set up the threadpool, and the threads that assist it
+        """
+        self.requests = Queue(self.queueSize)
+        self.pool_lock = threading.Lock()
+        self.threads = 0
+        self.busy = 0
+        self.reset_pool_stats()
+        logger.info("ThreadPoolMixIn: %d to %d threads, queue size %d" % \
+                    (self.minThreads, self.maxThreads, self.queueSize))
+
+        for x in range(self.minThreads):
+            self.start_worker()
+        # answering the requests that we turn down is left to a separate thread,
+        # so that a slow client cannot hold the main loop
+        self.rejects = Queue(self.rejectQueueSize)
+        for target in [self.reject_request_thread, self.stats_thread]:
+            t = threading.Thread(target = target)
+            t.setDaemon(1)
+            t.start()
+
+    def start_worker(self):
+        with self.pool_lock:
+            self.threads += 1
+        t = threading.Thread(target = self.process_request_thread)
+        t.setDaemon(1)
+        t.start()
+
     def process_request_thread(self):
         """
         obtain request from queue instead of directly from server socket
         """
         while True:
-            SocketServer.ThreadingMixIn.process_request_thread(self, *self.requests.get())
+            try:
+                request, client_address, queued = self.requests.get(timeout=self.idleTimeout)
+            except Empty:
+                # retire if we are not needed
+                with self.pool_lock:
+                    if self.threads > self.minThreads:
+                        self.threads -= 1
+                        return
+                continue
+            wait = time.time() - queued
+            with self.pool_lock:
+                self.busy += 1
+                self.max_busy = max(self.max_busy, self.busy)
+                self.served += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+            finally:
+                with self.pool_lock:
+                    self.busy -= 1
 
-    
     def handle_request(self):
         """
         simply collect requests and put them on the queue for the workers.
@@ -273,7 +541,76 @@ class ThreadPoolMixIn(SocketServer.ThreadingMixIn):
         except socket.error:
             return
         if self.verify_request(request, client_address):
-            self.requests.put((request, client_address))
+            # grow the pool if every worker is taken
+            with self.pool_lock:
+                grow = self.busy + self.requests.qsize() >= self.threads \
+                    and self.threads < self.maxThreads
+            if grow:
+                self.start_worker()
+            try:
+                self.requests.put_nowait((request, client_address, time.time()))
+            except Full:
+                self.reject_request(request, client_address)
+
+    def waiting_requests(self):
+        return self.requests.qsize()
+
+    def reject_request(self, request, client_address):
+        with self.pool_lock:
+            self.rejected += 1
+        logger.warning("ThreadPoolMixIn: queue full, rejecting request from %s" % (client_address,))
+        try:
+            self.rejects.put_nowait((request, client_address))
+        except Full:
+            # not even able to say no, just hang up
+            self.shutdown_request(request)
+
+    def reject_request_thread(self):
+        while True:
+            request, client_address = self.rejects.get()
+            try:
+                BusyRequestHandler(request, client_address, self)
+            except:
+                logger.log_exc("ThreadPoolMixIn: could not reject request from %s" % (client_address,))
+            self.shutdown_request(request)
+
+    def get_pool_stats(self, reset=False):
+        """
+        Return the current state of the pool, and what happened over the
+        last 'period' seconds, i.e. since the last reset
+        """
+        with self.pool_lock:
+            stats = {'threads': self.threads, 'busy': self.busy,
+                     'queued': self.requests.qsize(), 'max_busy': self.max_busy,
+                     'served': self.served, 'rejected': self.rejected,
+                     'avg_wait': self.served and self.total_wait / self.served,
+                     'max_wait': self.max_wait, 'period': time.time() - self.stats_since}
+            if reset:
+                self.reset_pool_stats()
+        return stats
+
+    def reset_pool_stats(self):
+        self.stats_since = time.time()
+        self.max_busy = 0
+        self.served = 0
+        self.rejected = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+    def log_pool_stats(self):
+        stats = self.get_pool_stats(reset=True)
+        logger.info("ThreadPoolMixIn: %(threads)d threads, %(busy)d busy (max %(max_busy)d), "
+                    "%(queued)d queued, %(served)d served, %(rejected)d rejected, "
+                    "wait %(avg_wait).3fs avg %(max_wait).3fs max, over %(period)ds" % stats)
+
+    # the statistics cover statsPeriod seconds, however busy the server is
+    def stats_thread(self):
+        while True:
+            time.sleep(self.statsPeriod)
+            try:
+                self.log_pool_stats()
+            except:
+                logger.log_exc("ThreadPoolMixIn: could not log the pool statistics")
 
 class ThreadedServer(ThreadPoolMixIn, SecureXMLRPCServer):
     pass
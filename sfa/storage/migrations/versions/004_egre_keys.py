@@ -0,0 +1,17 @@
+from sqlalchemy import Table, MetaData, Column
+from sqlalchemy import Integer, String
+
+metadata=MetaData()
+egre_key_table = \
+    Table ( 'egre_key', metadata,
+            Column('key', Integer, primary_key=True),
+            Column('slice_name', String, unique=True),
+          )
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    egre_key_table.create()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    egre_key_table.drop()
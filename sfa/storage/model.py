@@ -1,7 +1,7 @@
 from types import StringTypes
 from datetime import datetime
 
-from sqlalchemy import or_, and_ 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy import Column, Integer, String, DateTime
 from sqlalchemy import Table, Column, MetaData, join, ForeignKey
 from sqlalchemy.orm import relationship, backref
@@ -12,6 +12,7 @@ from sqlalchemy.ext.declarative import declarative_base
 
 from sfa.storage.record import Record
 from sfa.util.sfalogging import logger
+from sfa.util.faults import SfaInvalidArgument
 from sfa.util.sfatime import utcparse, datetime_to_string
 from sfa.util.xml import XML 
 
@@ -319,6 +320,8 @@ class SliverAllocation(Base,AlchemyObj):
     slice_urn           = Column(String)
     allocation_state    = Column(String)
 
+    allocation_states = ['geni_unallocated', 'geni_allocated', 'geni_provisioned']
+
     def __init__(self, **kwds):
         if 'sliver_id' in kwds:
             self.sliver_id = kwds['sliver_id']
@@ -336,62 +339,208 @@ class SliverAllocation(Base,AlchemyObj):
                   (self.sliver_id, self.allocation_state)
         return result
 
+    @staticmethod
+    def check_allocation_state(state):
+        if state not in SliverAllocation.allocation_states:
+            raise SfaInvalidArgument(state, 'allocation_state')
+
     @validates('allocation_state')
     def validate_allocation_state(self, key, state):
-        allocation_states = ['geni_unallocated', 'geni_allocated', 'geni_provisioned']
-        assert state in allocation_states
+        SliverAllocation.check_allocation_state(state)
         return state
 
     @staticmethod    
     def set_allocations(sliver_ids, state, dbsession):
         if not isinstance(sliver_ids, list):
             sliver_ids = [sliver_ids]
-        sliver_state_updated = {}
-        constraint = SliverAllocation.sliver_id.in_(sliver_ids)
-        sliver_allocations = dbsession.query (SliverAllocation).filter(constraint)
+        SliverAllocation.check_allocation_state(state)
         sliver_ids_found = []
-        for sliver_allocation in sliver_allocations:
-            sliver_allocation.allocation_state = state
-            sliver_ids_found.append(sliver_allocation.sliver_id)
+        for chunk in SliverAllocation.chunks(sliver_ids):
+            constraint = SliverAllocation.sliver_id.in_(chunk)
+            sliver_ids_found += [ sliver_id for (sliver_id,) in
+                                  dbsession.query(SliverAllocation.sliver_id).filter(constraint) ]
+            # a single UPDATE statement; the objects in the session get refreshed on commit
+            dbsession.query(SliverAllocation).filter(constraint) \
+                .update({'allocation_state': state}, synchronize_session=False)
 
         # Some states may not have been updated becuase no sliver allocation state record
         # exists for the sliver. Insert new allocation records for these slivers and set
         # it to geni_allocated.
         sliver_ids_not_found = set(sliver_ids).difference(sliver_ids_found)
-        for sliver_id in sliver_ids_not_found:
-            record = SliverAllocation(sliver_id=sliver_id, allocation_state=state)
-            dbsession.add(record)
+        dbsession.add_all([ SliverAllocation(sliver_id=sliver_id, allocation_state=state)
+                            for sliver_id in sliver_ids_not_found ])
         dbsession.commit()
 
     @staticmethod
     def delete_allocations(sliver_ids, dbsession):
         if not isinstance(sliver_ids, list):
             sliver_ids = [sliver_ids]
-        constraint = SliverAllocation.sliver_id.in_(sliver_ids)
-        sliver_allocations = dbsession.query(SliverAllocation).filter(constraint)
-        for sliver_allocation in sliver_allocations:
-            dbsession.delete(sliver_allocation)
+        for chunk in SliverAllocation.chunks(sliver_ids):
+            constraint = SliverAllocation.sliver_id.in_(chunk)
+            dbsession.query(SliverAllocation).filter(constraint).delete(synchronize_session=False)
         dbsession.commit()
-    
+
+    ##
+    # Insert or update a set of SliverAllocation objects, matched by sliver_id,
+    # with one query to find the existing rows and a single commit
+    # (unlike calling sync on each of them)
+
+    @staticmethod
+    def sync_allocations(records, dbsession):
+        records_by_sliver_id = dict( (record.sliver_id, record) for record in records )
+        for chunk in SliverAllocation.chunks(records_by_sliver_id.keys()):
+            constraint = SliverAllocation.sliver_id.in_(chunk)
+            for existing in dbsession.query(SliverAllocation).filter(constraint):
+                record = records_by_sliver_id.pop(existing.sliver_id)
+                existing.client_id = record.client_id
+                existing.component_id = record.component_id
+                existing.slice_urn = record.slice_urn
+                existing.allocation_state = record.allocation_state
+        # what is left is new
+        dbsession.add_all(records_by_sliver_id.values())
+        dbsession.commit()
+
+    # keep the IN clauses of a reasonable size
+    @staticmethod
+    def chunks(sliver_ids, size=500):
+        sliver_ids = list(sliver_ids)
+        return [ sliver_ids[i:i+size] for i in range(0, len(sliver_ids), size) ]
+
     def sync(self, dbsession):
-        constraints = [SliverAllocation.sliver_id==self.sliver_id]
-        results = dbsession.query(SliverAllocation).filter(and_(*constraints))
-        records = []
-        for result in results:
-            records.append(result) 
-        
-        if not records:
-            dbsession.add(self)
-        else:
-            record = records[0]
-            record.sliver_id = self.sliver_id
-            record.client_id  = self.client_id
-            record.component_id  = self.component_id
-            record.slice_urn  = self.slice_urn
-            record.allocation_state = self.allocation_state
-        dbsession.commit()    
+        SliverAllocation.sync_allocations([self], dbsession)
         
 
+##############################
+# the keys of the EGRE tunnels that implement links between PlanetLab nodes;
+# a slice holds at most one key, that goes back to the pool when the slice
+# is deleted, or when PLC no longer knows about it (see reconcile)
+class EgreKey(Base,AlchemyObj):
+    __tablename__       = 'egre_key'
+    key                 = Column(Integer, primary_key=True)
+    slice_name          = Column(String, unique=True)
+
+    max_key = 255
+    # once the pool is known to be there, no need to check again
+    populated = False
+
+    def __init__(self, key, slice_name=None):
+        self.key = key
+        self.slice_name = slice_name
+
+    def __repr__(self):
+        return "<egre_key key=%s slice_name=%s>" % (self.key, self.slice_name)
+
+    @staticmethod
+    def is_populated(dbsession):
+        if not EgreKey.populated:
+            EgreKey.populated = dbsession.query(EgreKey).first() is not None
+        return EgreKey.populated
+
+    ##
+    # Keep the keys that can be recorded in the pool, one per slice
+    #
+    # @param used a dict that maps the keys in use in PLC to a slice_name
+
+    @staticmethod
+    def holders(used):
+        holders = {}
+        names = set()
+        for key in sorted(used.keys()):
+            slice_name = used[key]
+            if not 1 <= key <= EgreKey.max_key:
+                continue
+            if slice_name in names:
+                logger.warning("EgreKey: slice %s holds several keys, only keeping one" % slice_name)
+                continue
+            names.add(slice_name)
+            holders[key] = slice_name
+        return holders
+
+    ##
+    # Create the pool of keys
+    #
+    # @param used a dict that maps the keys already in use to a slice_name
+
+    @staticmethod
+    def populate(dbsession, used=None):
+        if used is None: used={}
+        holders = EgreKey.holders(used)
+        dbsession.add_all([ EgreKey(key, holders.get(key))
+                            for key in range(1, EgreKey.max_key+1) ])
+        try:
+            dbsession.commit()
+        except IntegrityError:
+            # somebody else did it in the meantime
+            dbsession.rollback()
+        EgreKey.populated = True
+
+    ##
+    # Bring the pool in line with PLC, where slices may have been deleted,
+    # or have had their key changed, behind our back: a key tagged on a slice
+    # in PLC is held by that slice, and a key whose
+    # slice no longer exists in PLC is free again. A key held by a live slice
+    # that has no tag yet is left alone, as its slice may be in the making.
+    #
+    # @param used a dict that maps the keys in use in PLC to a slice_name
+    # @param slice_names the names of all the slices in PLC
+
+    @staticmethod
+    def reconcile(dbsession, used, slice_names):
+        holders = EgreKey.holders(used)
+        tagged = set(holders.values())
+        records = dbsession.query(EgreKey).order_by(EgreKey.key).with_for_update().all()
+        wanted = {}
+        for record in records:
+            if record.key in holders:
+                wanted[record.key] = holders[record.key]
+            elif record.slice_name is None or record.slice_name not in slice_names \
+                 or record.slice_name in tagged:
+                wanted[record.key] = None
+            else:
+                wanted[record.key] = record.slice_name
+        # release first, for a slice to move from one key to another
+        changed = [ record for record in records
+                    if record.slice_name != wanted[record.key] ]
+        for record in changed:
+            record.slice_name = None
+        dbsession.flush()
+        for record in changed:
+            record.slice_name = wanted[record.key]
+        dbsession.commit()
+        logger.info("EgreKey: reconciled %d keys with PLC" % len(changed))
+
+    ##
+    # Return the key held by slice_name, allocating a free one if needed;
+    # the rows involved are locked until the commit, and locked free rows
+    # are skipped, so that concurrent calls cannot hand out the same key.
+    # Raises KeyError only when no free key remains.
+
+    @staticmethod
+    def allocate(slice_name, dbsession):
+        while True:
+            try:
+                record = dbsession.query(EgreKey).filter(EgreKey.slice_name == slice_name) \
+                    .with_for_update().first()
+                if record is None:
+                    record = dbsession.query(EgreKey).filter(EgreKey.slice_name == None) \
+                        .order_by(EgreKey.key).with_for_update(skip_locked=True).first()
+                if record is None:
+                    dbsession.rollback()
+                    raise KeyError("No more EGRE keys available")
+                record.slice_name = slice_name
+                key = record.key
+                dbsession.commit()
+                return key
+            except IntegrityError:
+                # the same slice got a key in the meantime, that we find next time
+                dbsession.rollback()
+
+    @staticmethod
+    def release(slice_name, dbsession):
+        dbsession.query(EgreKey).filter(EgreKey.slice_name == slice_name) \
+            .update({'slice_name': None}, synchronize_session=False)
+        dbsession.commit()
+
 ##############################
 # although the db needs of course to be reachable for the following functions
 # the schema management functions are here and not in alchemy
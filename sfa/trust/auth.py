@@ -7,7 +7,7 @@ from types import StringTypes
 from sfa.util.faults import InsufficientRights, MissingCallerGID, \
     MissingTrustedRoots, PermissionError, BadRequestHash, \
     ConnectionKeyGIDMismatch, SfaPermissionDenied, CredentialNotVerifiable, \
-    Forbidden, BadArgs
+    Forbidden, BadArgs, SfaFault
 from sfa.util.sfalogging import logger
 from sfa.util.config import Config
 from sfa.util.xrn import Xrn, get_authority
@@ -16,7 +16,8 @@ from sfa.trust.gid import GID
 from sfa.trust.rights import Rights
 from sfa.trust.certificate import Keypair, Certificate
 from sfa.trust.credential import Credential
-from sfa.trust.trustedroots import TrustedRoots
+from sfa.trust.credentialcache import credential_cache, DEFAULT_CACHE_SIZE
+from sfa.trust.trustedroots import shared_trusted_roots
 from sfa.trust.hierarchy import Hierarchy
 from sfa.trust.sfaticket import SfaTicket
 from sfa.trust.speaksfor_util import determine_speaks_for
@@ -30,15 +31,31 @@ class Auth:
     def __init__(self, peer_cert = None, config = None ):
         self.peer_cert = peer_cert
         self.hierarchy = Hierarchy()
+        self.config = config
         if not config:
             self.config = Config()
         self.load_trusted_certs()
+        credential_cache.set_size(getattr(self.config, 'SFA_CREDENTIAL_CACHE_SIZE',
+                                          DEFAULT_CACHE_SIZE))
 
+    # start over with a new request
+    def set_peer_cert(self, peer_cert):
+        self.peer_cert = peer_cert
+        self.client_cred = None
+        self.client_gid = None
+        self.object_gid = None
+        self.load_trusted_certs()
+
+    # the trusted roots are parsed once per process, and reloaded when they change
     def load_trusted_certs(self):
-        self.trusted_cert_list = \
-            TrustedRoots(self.config.get_trustedroots_dir()).get_list()
-        self.trusted_cert_file_list = \
-            TrustedRoots(self.config.get_trustedroots_dir()).get_file_list()
+        trusted_roots = shared_trusted_roots(self.config.get_trustedroots_dir())
+        index = trusted_roots.get_index()
+        # looks the issuers up by subject in verify_chain
+        self.trusted_roots = index
+        self.trusted_cert_list = index.gid_list
+        self.trusted_cert_file_list = index.file_list
+        # identifies this set of trusted roots in the credential cache
+        self.trusted_fingerprint = index.fingerprint
 
     # this convenience methods extracts speaking_for_xrn
     # from the passed options using 'geni_speaking_for'
@@ -97,7 +114,7 @@ class Auth:
         error=[None,None]
 
         speaks_for_gid = determine_speaks_for(logger, creds, self.peer_cert,
-                                              speaking_for_xrn, self.trusted_cert_list)
+                                              speaking_for_xrn, self.trusted_roots)
 
         if self.peer_cert and \
            not self.peer_cert.is_pubkey(speaks_for_gid.get_pubkey()):
@@ -133,7 +150,12 @@ class Auth:
         trusted cert and check if the credential is allowed to perform 
         the specified operation.    
         """
-        cred = Credential(cred=credential)    
+        # a credential that we have already checked does not need to be parsed again
+        cached = credential_cache.lookup(credential, self.trusted_fingerprint)
+        if cached:
+            cred = cached.cred
+        else:
+            cred = Credential(cred=credential)
         self.client_cred = cred
         logger.debug("Auth.check: handling hrn=%s and credential=%s"%\
                          (hrn,cred.pretty_cred()))
@@ -157,8 +179,11 @@ class Auth:
                 raise InsufficientRights(operation)
 
         if self.trusted_cert_list:
-            self.client_cred.verify(self.trusted_cert_file_list,
-                                    self.config.SFA_CREDENTIAL_SCHEMA)
+            if cached:
+                if cached.error:
+                    raise cached.error
+            else:
+                self.verifyCredential(credential, cred)
         else:
            raise MissingTrustedRoots(self.config.get_trustedroots_dir())
        
@@ -172,13 +197,26 @@ class Auth:
                                        (target_hrn, hrn) )       
         return True
 
+    def verifyCredential(self, credential, cred):
+        """
+        Verify cred, the decoded form of credential, and remember the outcome
+        """
+        try:
+            cred.verify(self.trusted_cert_file_list,
+                        self.config.SFA_CREDENTIAL_SCHEMA,
+                        verifier=self.get_credential_verifier())
+        except SfaFault, fault:
+            credential_cache.store(credential, self.trusted_fingerprint, cred, fault)
+            raise
+        credential_cache.store(credential, self.trusted_fingerprint, cred)
+
     def check_ticket(self, ticket):
         """
         Check if the ticket was signed by a trusted cert
         """
         if self.trusted_cert_list:
             client_ticket = SfaTicket(string=ticket)
-            client_ticket.verify_chain(self.trusted_cert_list)
+            client_ticket.verify_chain(self.trusted_roots)
         else:
            raise MissingTrustedRoots(self.config.get_trustedroots_dir())
 
@@ -200,11 +238,16 @@ class Auth:
 
     def validateGid(self, gid):
         if self.trusted_cert_list:
-            gid.verify_chain(self.trusted_cert_list)
+            gid.verify_chain(self.trusted_roots)
 
     def validateCred(self, cred):
         if self.trusted_cert_list:
-            cred.verify(self.trusted_cert_file_list)
+            cred.verify(self.trusted_cert_file_list,
+                        verifier=self.get_credential_verifier())
+
+    # None means the default from sfa.trust.credential
+    def get_credential_verifier(self):
+        return getattr(self.config, 'SFA_CREDENTIAL_VERIFIER', None)
 
     def authenticateGid(self, gidStr, argList, requestHash=None):
         gid = GID(string = gidStr)
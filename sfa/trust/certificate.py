@@ -39,6 +39,8 @@ import functools
 import os
 import tempfile
 import base64
+import hashlib
+import threading
 from tempfile import mkstemp
 
 from OpenSSL import crypto
@@ -53,6 +55,15 @@ debug_verify_chain = False
 
 glo_passphrase_callback = None
 
+##
+# The (certificate, signer) pairs whose signature has been checked already,
+# keyed on the sha256 of both certificates; see Certificate.is_signed_by_cert
+# This is a plain dictionary that gets flushed when it grows too big
+
+verified_signatures = {}
+verified_signatures_lock = threading.Lock()
+verified_signatures_max = 10000
+
 ##
 # A global callback may be implemented for requesting passphrases from the
 # user. The function will be called with three arguments:
@@ -675,14 +686,36 @@ class Certificate:
     ##
     # Given a certificate cert, verify that this certificate was signed by the
     # public key contained in cert. Throw an exception otherwise.
+    # Successful checks are remembered in verified_signatures.
     #
     # @param cert certificate object
 
     def is_signed_by_cert(self, cert):
+        key = (self.get_fingerprint(), cert.get_fingerprint())
+        if key in verified_signatures:
+            return 1
         k = cert.get_pubkey()
         result = self.verify(k)
+        if result == 1:
+            with verified_signatures_lock:
+                if len(verified_signatures) >= verified_signatures_max:
+                    verified_signatures.clear()
+                verified_signatures[key] = True
         return result
 
+    ##
+    # Return True if cert is named as the issuer of this certificate;
+    # this is a prerequisite for cert to have signed this certificate
+
+    def is_issued_by(self, cert):
+        return self.x509.get_issuer().der() == cert.x509.get_subject().der()
+
+    ##
+    # Return the sha256 of the DER form of this certificate
+
+    def get_fingerprint(self):
+        return hashlib.sha256(crypto.dump_certificate(crypto.FILETYPE_ASN1, self.x509)).digest()
+
     ##
     # Set the parent certficiate.
     #
@@ -714,8 +747,11 @@ class Certificate:
     # the bottom of the recursion is reached and the certificate does not match
     # a trusted root, then an exception is thrown.
     # Also require that parents are CAs.
+    # Like openssl, only consider the trusted certs whose subject is the
+    # issuer of the certificate at hand.
     #
-    # @param Trusted_certs is a list of certificates that are trusted.
+    # @param Trusted_certs is a list of certificates that are trusted, or a
+    #   sfa.trust.trustedroots.TrustedRootsIndex
     #
 
     def verify_chain(self, trusted_certs = None):
@@ -730,7 +766,12 @@ class Certificate:
             raise CertExpired(self.pretty_cert(), "client cert")
 
         # if this cert is signed by a trusted_cert, then we are set
-        for trusted_cert in trusted_certs:
+        # only the trusted certs named as our issuer are worth a signature check
+        if hasattr(trusted_certs, 'get_by_subject'):
+            issuers = trusted_certs.get_by_subject(self.x509.get_issuer())
+        else:
+            issuers = [ trusted_cert for trusted_cert in trusted_certs if self.is_issued_by(trusted_cert) ]
+        for trusted_cert in issuers:
             if self.is_signed_by_cert(trusted_cert):
                 # verify expiration of trusted_cert ?
                 if not trusted_cert.x509.has_expired():
@@ -43,16 +43,29 @@ except:
 
 from xml.parsers.expat import ExpatError
 
-from sfa.util.faults import CredentialNotVerifiable, ChildRightsNotSubsetOfParent
+from sfa.util.faults import CredentialNotVerifiable, ChildRightsNotSubsetOfParent, \
+    CredentialSignatureUnsupported
 from sfa.util.sfalogging import logger
 from sfa.util.sfatime import utcparse, SFATIME_FORMAT
 from sfa.trust.rights import Right, Rights, determine_rights
 from sfa.trust.gid import GID
+from sfa.trust.certificate import Keypair
 from sfa.util.xrn import urn_to_hrn, hrn_authfor_hrn
+if HAVELXML:
+    from sfa.trust import xmldsig
 
 # 31 days, in seconds 
 DEFAULT_CREDENTIAL_LIFETIME = 86400 * 28
 
+# the engines that Credential.verify knows of for checking xml signatures
+# 'lxml' does it in-process, see sfa.trust.xmldsig
+# 'xmlsec1' forks one xmlsec1 process per signature (the historical behaviour)
+signature_verifiers = [ 'lxml', 'xmlsec1' ]
+default_signature_verifier = 'lxml' if HAVELXML else 'xmlsec1'
+# same for Credential.sign
+signature_signers = [ 'lxml', 'xmlsec1' ]
+default_signature_signer = 'lxml' if HAVELXML else 'xmlsec1'
+
 
 # TODO:
 # . make privs match between PG and PL
@@ -313,13 +326,23 @@ class Credential(object):
         
     ##
     # Need the issuer's private key and name
-    # @param key Keypair object containing the private key of the issuer
-    # @param gid GID of the issuing authority
+    # @param privkey Keypair object containing the private key of the issuer, or its filename
+    # @param gid GID of the issuing authority, or its filename
 
     def set_issuer_keys(self, privkey, gid):
         self.issuer_privkey = privkey
         self.issuer_gid = gid
 
+    def get_issuer_keypair(self):
+        if isinstance(self.issuer_privkey, Keypair):
+            return self.issuer_privkey
+        return Keypair(filename=self.issuer_privkey)
+
+    def get_issuer_gid_object(self):
+        if isinstance(self.issuer_gid, GID):
+            return self.issuer_gid
+        return GID(filename=self.issuer_gid)
+
 
     ##
     # Set this credential's parent
@@ -613,48 +636,87 @@ class Credential(object):
     # In general, a signed credential obtained externally should
     # not be changed else the signature is no longer valid.  So, once
     # you have loaded an existing signed credential, do not call encode() or sign() on it.
+    #
+    # signer: the engine used to compute the xml signature, one of
+    #         signature_signers; default is default_signature_signer
 
-    def sign(self):
+    def sign(self, signer=None):
         if not self.issuer_privkey or not self.issuer_gid:
             return
-        doc = parseString(self.get_xml())
-        sigs = doc.getElementsByTagName("signatures")[0]
+        if signer is None:
+            signer = default_signature_signer
+        if signer not in signature_signers:
+            logger.warning("Unknown credential signer %s - using %s" % \
+                           (signer, default_signature_signer))
+            signer = default_signature_signer
+        if signer == 'lxml' and not HAVELXML:
+            logger.warning("lxml not available, credential signer falls back to xmlsec1")
+            signer = 'xmlsec1'
 
         # Create the signature template to be signed
         signature = Signature()
         signature.set_refid(self.get_refid())
+        if signer == 'xmlsec1':
+            self.sign_xmlsec(signature)
+        else:
+            self.sign_lxml(signature)
+
+        # Update signatures
+        self.decode()       
+
+    ##
+    # in-process signature, see sfa.trust.xmldsig
+    def sign_lxml(self, signature):
+        root = xmldsig.parse(self.get_xml())
+        sigs = root.find("signatures")
+        sigs.append(xmldsig.parse(signature.get_xml().strip()))
+        ref = 'Sig_%s' % self.get_refid()
+        xmldsig.sign_signature(root, ref, self.get_issuer_keypair().get_openssl_pkey(),
+                               self.get_issuer_chain())
+        self.xml = etree.tostring(root.getroottree(), xml_declaration=True, encoding='UTF-8')
+
+    ##
+    # one xmlsec1 process, on temporary copies of the credential, key and GIDs
+    def sign_xmlsec(self, signature):
+        doc = parseString(self.get_xml())
+        sigs = doc.getElementsByTagName("signatures")[0]
+
         sdoc = parseString(signature.get_xml())        
         sig_ele = doc.importNode(sdoc.getElementsByTagName("Signature")[0], True)
         sigs.appendChild(sig_ele)
 
         self.xml = doc.toxml()
 
-
         # Split the issuer GID into multiple certificates if it's a chain
-        chain = GID(filename=self.issuer_gid)
-        gid_files = []
-        while chain:
-            gid_files.append(chain.save_to_random_tmp_file(False))
-            if chain.get_parent():
-                chain = chain.get_parent()
-            else:
-                chain = None
-
+        gid_files = [ gid.save_to_random_tmp_file(False) for gid in self.get_issuer_chain() ]
+        privkey_file = self.issuer_privkey
+        if isinstance(privkey_file, Keypair):
+            (fd, privkey_file) = mkstemp()
+            os.close(fd)
+            self.issuer_privkey.save_to_file(privkey_file)
 
         # Call out to xmlsec1 to sign it
         ref = 'Sig_%s' % self.get_refid()
         filename = self.save_to_random_tmp_file()
         signed = os.popen('%s --sign --node-id "%s" --privkey-pem %s,%s %s' \
-                 % (self.xmlsec_path, ref, self.issuer_privkey, ",".join(gid_files), filename)).read()
+                 % (self.xmlsec_path, ref, privkey_file, ",".join(gid_files), filename)).read()
         os.remove(filename)
 
         for gid_file in gid_files:
             os.remove(gid_file)
+        if privkey_file is not self.issuer_privkey:
+            os.remove(privkey_file)
 
         self.xml = signed
 
-        # Update signatures
-        self.decode()       
+    # the issuer GID, then its parents if it's a chain
+    def get_issuer_chain(self):
+        chain = []
+        gid = self.get_issuer_gid_object()
+        while gid:
+            chain.append(gid)
+            gid = gid.get_parent()
+        return chain
 
         
     ##
@@ -741,10 +803,13 @@ class Credential(object):
     #   trusted_certs_required: Should usually be true. Set False means an
     #                 empty list of trusted_certs would still let this method pass.
     #                 It just skips xmlsec1 verification et al. Only used by some utils
+    #
+    #   verifier: the engine used to check the xml signatures, one of
+    #                 signature_verifiers; default is default_signature_verifier
     #    
     # Verify that:
     # . All of the signatures are valid and that the issuers trace back
-    #   to trusted roots (performed by xmlsec1)
+    #   to trusted roots (performed by xmlsec1 or sfa.trust.xmldsig)
     # . The XML matches the credential schema
     # . That the issuer of the credential is the authority in the target's urn
     #    . In the case of a delegated credential, this must be true of the root
@@ -764,7 +829,7 @@ class Credential(object):
     #   must be done elsewhere
     #
     # @param trusted_certs: The certificates of trusted CA certificates
-    def verify(self, trusted_certs=None, schema=None, trusted_certs_required=True):
+    def verify(self, trusted_certs=None, schema=None, trusted_certs_required=True, verifier=None):
         if not self.xml:
             self.decode()
 
@@ -804,9 +869,6 @@ class Credential(object):
                                           (self.pretty_cred(),
                                            self.expiration.strftime(SFATIME_FORMAT)))
 
-        # Verify the signatures
-        filename = self.save_to_random_tmp_file()
-
         # If caller explicitly passed in None that means skip cert chain validation.
         # - Strange and not typical
         if trusted_certs is not None:
@@ -822,42 +884,10 @@ class Credential(object):
         for ref in parentRefs:
             refs.append("Sig_%s" % ref)
 
-        for ref in refs:
-            # If caller explicitly passed in None that means skip xmlsec1 validation.
-            # Strange and not typical
-            if trusted_certs is None:
-                break
-
-            # Thierry - jan 2015
-            # up to fedora20 we used os.popen and checked that the output begins with OK
-            # turns out, with fedora21, there is extra input before this 'OK' thing
-            # looks like we're better off just using the exit code - that's what it is made for
-            #cert_args = " ".join(['--trusted-pem %s' % x for x in trusted_certs])
-            #command = '{} --verify --node-id "{}" {} {} 2>&1'.\
-            #          format(self.xmlsec_path, ref, cert_args, filename)
-            command = [ self.xmlsec_path, '--verify', '--node-id', ref ]
-            for trusted in trusted_certs:
-                command += ["--trusted-pem", trusted ]
-            command += [ filename ]
-            logger.debug("Running " + " ".join(command))
-            try:
-                verified = subprocess.check_output(command, stderr=subprocess.STDOUT)
-                logger.debug("xmlsec command returned {}".format(verified))
-                if "OK\n" not in verified:
-                    logger.warning("WARNING: xmlsec1 seemed to return fine but without a OK in its output")
-            except subprocess.CalledProcessError as e:
-                verified = e.output
-                # xmlsec errors have a msg= which is the interesting bit.
-                mstart = verified.find("msg=")
-                msg = ""
-                if mstart > -1 and len(verified) > 4:
-                    mstart = mstart + 4
-                    mend = verified.find('\\', mstart)
-                    msg = verified[mstart:mend]
-                logger.warning("Credential.verify - failed - xmlsec1 returned {}".format(verified.strip()))
-                raise CredentialNotVerifiable("xmlsec1 error verifying cred %s using Signature ID %s: %s" % \
-                                              (self.pretty_cred(), ref, msg))
-        os.remove(filename)
+        # If caller explicitly passed in None that means skip signature validation.
+        # Strange and not typical
+        if trusted_certs is not None:
+            self.verify_signatures(refs, trusted_certs, trusted_cert_objects, verifier)
 
         # Verify the parents (delegation)
         if self.parent:
@@ -868,6 +898,80 @@ class Credential(object):
         self.verify_issuer(trusted_cert_objects)
         return True
 
+    ##
+    # Check the xml signatures refs (e.g. Sig_ref0) with the selected engine
+    # raises CredentialNotVerifiable if any of them fails
+    def verify_signatures(self, refs, trusted_certs, trusted_cert_objects, verifier=None):
+        if verifier is None:
+            verifier = default_signature_verifier
+        if verifier not in signature_verifiers:
+            logger.warning("Unknown credential verifier %s - using %s" % \
+                           (verifier, default_signature_verifier))
+            verifier = default_signature_verifier
+        if verifier == 'lxml' and not HAVELXML:
+            logger.warning("lxml not available, credential verifier falls back to xmlsec1")
+            verifier = 'xmlsec1'
+        if verifier == 'xmlsec1':
+            self.verify_signatures_xmlsec(refs, trusted_certs)
+        else:
+            self.verify_signatures_lxml(refs, trusted_certs, trusted_cert_objects)
+
+    ##
+    # in-process verification, see sfa.trust.xmldsig
+    # signatures using features that we do not support are handed over to xmlsec1
+    def verify_signatures_lxml(self, refs, trusted_certs, trusted_cert_objects):
+        root = xmldsig.parse(self.xml)
+        for ref in refs:
+            try:
+                xmldsig.verify_signature(root, ref, trusted_cert_objects)
+            except CredentialSignatureUnsupported, e:
+                if not self.xmlsec_path:
+                    raise
+                logger.debug("Credential.verify - %s, using xmlsec1 for %s" % (e, ref))
+                self.verify_signatures_xmlsec([ref], trusted_certs)
+            except CredentialNotVerifiable, e:
+                logger.warning("Credential.verify - failed - %s" % e.value)
+                raise CredentialNotVerifiable("error verifying cred %s using Signature ID %s: %s" % \
+                                              (self.pretty_cred(), ref, e.value))
+
+    ##
+    # one xmlsec1 process per signature, on a temporary copy of the credential
+    def verify_signatures_xmlsec(self, refs, trusted_certs):
+        filename = self.save_to_random_tmp_file()
+        try:
+            for ref in refs:
+                # Thierry - jan 2015
+                # up to fedora20 we used os.popen and checked that the output begins with OK
+                # turns out, with fedora21, there is extra input before this 'OK' thing
+                # looks like we're better off just using the exit code - that's what it is made for
+                #cert_args = " ".join(['--trusted-pem %s' % x for x in trusted_certs])
+                #command = '{} --verify --node-id "{}" {} {} 2>&1'.\
+                #          format(self.xmlsec_path, ref, cert_args, filename)
+                command = [ self.xmlsec_path, '--verify', '--node-id', ref ]
+                for trusted in trusted_certs:
+                    command += ["--trusted-pem", trusted ]
+                command += [ filename ]
+                logger.debug("Running " + " ".join(command))
+                try:
+                    verified = subprocess.check_output(command, stderr=subprocess.STDOUT)
+                    logger.debug("xmlsec command returned {}".format(verified))
+                    if "OK\n" not in verified:
+                        logger.warning("WARNING: xmlsec1 seemed to return fine but without a OK in its output")
+                except subprocess.CalledProcessError as e:
+                    verified = e.output
+                    # xmlsec errors have a msg= which is the interesting bit.
+                    mstart = verified.find("msg=")
+                    msg = ""
+                    if mstart > -1 and len(verified) > 4:
+                        mstart = mstart + 4
+                        mend = verified.find('\\', mstart)
+                        msg = verified[mstart:mend]
+                    logger.warning("Credential.verify - failed - xmlsec1 returned {}".format(verified.strip()))
+                    raise CredentialNotVerifiable("xmlsec1 error verifying cred %s using Signature ID %s: %s" % \
+                                                  (self.pretty_cred(), ref, msg))
+        finally:
+            os.remove(filename)
+
     ##
     # Creates a list of the credential and its parents, with the root 
     # (original delegated credential) as the last item in the list
@@ -0,0 +1,151 @@
+#
+# Cache of verified credentials
+#
+# The same credential is typically presented several times in a row
+# (e.g. ListResources, Allocate, Provision, Status), and checking its
+# signatures and certificate chains is by far the most expensive part of
+# handling a call. This cache remembers, for a given credential string
+# and a given set of trusted roots, the decoded Credential object and the
+# outcome of Credential.verify
+#
+# Entries never outlive the credential, nor any of the certificates it
+# carries, and all entries are dropped as soon as the trusted roots change
+#
+from __future__ import with_statement
+import time
+import calendar
+import hashlib
+import threading
+from collections import OrderedDict
+
+from sfa.util.sfalogging import logger
+
+# maximum number of credentials kept
+DEFAULT_CACHE_SIZE = 1000
+# even a valid credential gets verified again after that time (in seconds)
+DEFAULT_CACHE_TTL = 60 * 60
+
+class CredentialCacheEntry:
+
+    def __init__(self, cred, error, expires):
+        self.cred = cred
+        self.error = error
+        self.expires = expires
+
+    def is_expired(self):
+        return time.time() > self.expires
+
+class CredentialCache:
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.size = size
+        self.ttl = ttl
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def set_size(self, size):
+        with self.lock:
+            self.size = size
+            self.shrink()
+
+    ##
+    # Return the CredentialCacheEntry for credential, or None
+    #
+    # @param credential a credential string, or a dict with geni_type/geni_version/geni_value
+    # @param fingerprint identifies the trusted roots the credential is checked against
+
+    def lookup(self, credential, fingerprint):
+        key = self.key(credential)
+        with self.lock:
+            self.check_fingerprint(fingerprint)
+            entry = self.entries.get(key)
+            if entry is not None and entry.is_expired():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            # most recently used goes last
+            del self.entries[key]
+            self.entries[key] = entry
+            self.hits += 1
+            return entry
+
+    ##
+    # Record the outcome of verifying credential
+    #
+    # @param cred the decoded Credential object
+    # @param error the exception raised by verify, None if it succeeded
+
+    def store(self, credential, fingerprint, cred, error=None):
+        if self.size <= 0:
+            return
+        expires = time.time() + self.ttl
+        try:
+            expires = min(expires, expiration(cred))
+        except Exception, e:
+            logger.debug("CredentialCache: cannot compute expiration, not caching: %s" % e)
+            return
+        key = self.key(credential)
+        with self.lock:
+            self.check_fingerprint(fingerprint)
+            if key in self.entries:
+                del self.entries[key]
+            self.entries[key] = CredentialCacheEntry(cred, error, expires)
+            self.shrink()
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'max_size': self.size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
+
+    def key(self, credential):
+        if isinstance(credential, dict):
+            credential = "%s %s %s" % (credential['geni_type'], credential['geni_version'],
+                                       credential['geni_value'])
+        if isinstance(credential, unicode):
+            credential = credential.encode('utf-8')
+        return hashlib.sha1(credential).digest()
+
+    # the trusted roots have changed, nothing we know is reliable any longer
+    def check_fingerprint(self, fingerprint):
+        if fingerprint != self.fingerprint:
+            if self.entries:
+                logger.info("CredentialCache: trusted roots have changed, dropping %d entries" % \
+                            len(self.entries))
+                self.invalidate()
+            self.fingerprint = fingerprint
+
+    def shrink(self):
+        while len(self.entries) > max(self.size, 0):
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+##
+# Return the time (in seconds since the epoch) at which cred, one of its
+# parents, or one of the gids they carry, expires
+
+def expiration(cred):
+    times = []
+    for cur_cred in cred.get_credential_list():
+        times.append(calendar.timegm(cur_cred.get_expiration().utctimetuple()))
+        for gid in [ cur_cred.get_gid_caller(), cur_cred.get_gid_object() ]:
+            while gid is not None:
+                not_after = time.strptime(gid.x509.get_notAfter(), "%Y%m%d%H%M%SZ")
+                times.append(calendar.timegm(not_after))
+                gid = gid.get_parent()
+    return min(times)
+
+# the process-wide cache, shared by all Auth instances
+credential_cache = CredentialCache()
@@ -9,9 +9,14 @@
 # subdirectory are several files:
 #      *.GID - GID file
 #      *.PKEY - private key file
+#
+# The authorities' GIDs and keys are read once and kept in memory, in
+# auth_cache, for as long as their files do not change
 ##
 
+from __future__ import with_statement
 import os
+import threading
 
 from sfa.util.faults import MissingAuthority
 from sfa.util.sfalogging import logger
@@ -29,6 +34,7 @@ from sfa.trust.sfaticket import SfaTicket
 class AuthInfo:
     hrn = None
     gid_object = None
+    pkey_object = None
     gid_filename = None
     privkey_filename = None
     ##
@@ -71,7 +77,9 @@ class AuthInfo:
     # Get the private key in the form of a Keypair object
 
     def get_pkey_object(self):
-        return Keypair(filename = self.privkey_filename)
+        if not self.pkey_object:
+            self.pkey_object = Keypair(filename = self.privkey_filename)
+        return self.pkey_object
 
     ##
     # Replace the GID with a new one. The file specified by gid_filename is
@@ -82,6 +90,71 @@ class AuthInfo:
     def update_gid_object(self, gid):
         gid.save_to_file(self.gid_filename)
         self.gid_object = gid
+        auth_cache.invalidate(self.gid_filename)
+
+##
+# The GID and Keypair objects of the authorities, as parsed from their files
+#
+# Entries are checked against the files (mtime, size, inode) each time they
+# are used, so that an authority that gets created again or refreshed is
+# read again. The objects are shared by all threads, and must not be modified
+
+class AuthCacheEntry:
+
+    def __init__(self, gid_object, pkey_object, signature):
+        self.gid_object = gid_object
+        self.pkey_object = pkey_object
+        self.signature = signature
+
+class AuthCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    ##
+    # Return the AuthInfo for an authority, or None if its files do not exist
+    #
+    # @param load called with an AuthInfo that has no objects yet, returns the GID to use
+
+    def get(self, hrn, gid_filename, privkey_filename, load):
+        try:
+            signature = tuple([ (stat.st_mtime, stat.st_size, stat.st_ino) for stat in
+                                [ os.stat(gid_filename), os.stat(privkey_filename) ] ])
+        except OSError:
+            return None
+        auth_info = AuthInfo(hrn, gid_filename, privkey_filename)
+        with self.lock:
+            entry = self.entries.get(gid_filename)
+            if entry is not None and entry.signature == signature:
+                self.hits += 1
+                auth_info.gid_object = entry.gid_object
+                auth_info.pkey_object = entry.pkey_object
+                return auth_info
+            self.misses += 1
+        # parse the files outside the lock, at worst this happens twice
+        gid = load(auth_info)
+        entry = AuthCacheEntry(gid, auth_info.get_pkey_object(), signature)
+        with self.lock:
+            self.entries[gid_filename] = entry
+        auth_info.gid_object = gid
+        return auth_info
+
+    def invalidate(self, gid_filename=None):
+        with self.lock:
+            if gid_filename is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(gid_filename, None)
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+# the process-wide cache, shared by all Hierarchy instances
+auth_cache = AuthCache()
 
 ##
 # The Hierarchy class is responsible for managing the tree of authorities.
@@ -173,6 +246,7 @@ class Hierarchy:
 
         gid = self.create_gid(xrn, create_uuid(), pkey)
         gid.save_to_file(gid_filename, save_parents=True)
+        auth_cache.invalidate(gid_filename)
 
     def create_top_level_auth(self, hrn=None):
         """
@@ -200,22 +274,23 @@ class Hierarchy:
 
     def get_auth_info(self, xrn):
         hrn, type = urn_to_hrn(xrn)
-        if not self.auth_exists(hrn):
-            logger.warning("Hierarchy: missing authority - xrn=%s, hrn=%s"%(xrn,hrn))
-            raise MissingAuthority(hrn)
-
         (directory, gid_filename, privkey_filename, ) = \
             self.get_auth_filenames(hrn)
 
-        auth_info = AuthInfo(hrn, gid_filename, privkey_filename)
+        auth_info = auth_cache.get(hrn, gid_filename, privkey_filename, self.load_auth_info)
+        if auth_info is None:
+            logger.warning("Hierarchy: missing authority - xrn=%s, hrn=%s"%(xrn,hrn))
+            raise MissingAuthority(hrn)
+        return auth_info
 
+    # the GID of an authority that is not in auth_cache yet
+    def load_auth_info(self, auth_info):
         # check the GID and see if it needs to be refreshed
         gid = auth_info.get_gid_object()
         gid_refreshed = self.refresh_gid(gid)
         if gid != gid_refreshed:
-            auth_info.update_gid_object(gid_refreshed)
-
-        return auth_info
+            gid_refreshed.save_to_file(auth_info.get_gid_filename())
+        return gid_refreshed
 
     ##
     # Create a new GID. The GID will be signed by the authority that is it's
@@ -317,11 +392,11 @@ class Hierarchy:
         if not parent_hrn or hrn == self.config.SFA_INTERFACE_HRN:
             # if there is no parent hrn, then it must be self-signed. this
             # is where we terminate the recursion
-            cred.set_issuer_keys(auth_info.get_privkey_filename(), auth_info.get_gid_filename())
+            cred.set_issuer_keys(auth_info.get_pkey_object(), auth_info.get_gid_object())
         else:
             # we need the parent's private key in order to sign this GID
             parent_auth_info = self.get_auth_info(parent_hrn)
-            cred.set_issuer_keys(parent_auth_info.get_privkey_filename(), parent_auth_info.get_gid_filename())
+            cred.set_issuer_keys(parent_auth_info.get_pkey_object(), parent_auth_info.get_gid_object())
 
             
             cred.set_parent(self.get_auth_cred(parent_hrn, kind))
@@ -0,0 +1,128 @@
+#
+# Cache of the credentials issued by the registry
+#
+# Portals call GetCredential over and over for the same users and slices,
+# and signing a credential is by far the most expensive part of that
+# call. This cache remembers the signed credentials, keyed on everything
+# that goes into them: the caller and object gids, the issuer, the rights
+# and the expiration. Credentials with the default lifetime are reused for
+# at most ttl seconds, so the lifetime a client gets is never shortened by
+# more than that
+#
+# The rights are computed again on each call and are part of the key, so
+# a change in the researchers or pis of a record cannot hand out stale
+# rights; the registry still drops the entries of a record that gets
+# updated or removed
+#
+from __future__ import with_statement
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# maximum number of credentials kept
+DEFAULT_CACHE_SIZE = 1000
+# how long a credential with the default lifetime gets reused (in seconds)
+DEFAULT_CACHE_TTL = 60 * 60
+
+class IssuedCredentialCacheEntry:
+
+    def __init__(self, credential, hrns, expires):
+        self.credential = credential
+        self.hrns = hrns
+        self.expires = expires
+
+    def is_expired(self):
+        return time.time() > self.expires
+
+class IssuedCredentialCache:
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def configure(self, size, ttl):
+        with self.lock:
+            self.size = size
+            self.ttl = ttl
+            self.shrink()
+
+    def is_enabled(self):
+        return self.size > 0 and self.ttl > 0
+
+    ##
+    # Compute the key of a credential
+    #
+    # @param caller_gid, object_gid, issuer_gid the GID objects that go in the credential
+    # @param rights the Rights granted to the caller
+    # @param expiration the expiration set on the credential, in seconds since the
+    #   epoch, or None if it gets the default lifetime
+
+    def key(self, caller_gid, object_gid, issuer_gid, rights, expiration=None):
+        gids = [ gid.save_to_string(save_parents=True) for gid in [caller_gid, object_gid, issuer_gid] ]
+        if expiration is None:
+            # all the credentials issued within the same period are the same
+            bucket = 'ttl:%d' % (time.time() // self.ttl)
+        else:
+            bucket = 'at:%d' % expiration
+        return hashlib.sha1("\n".join(gids + [rights.save_to_string(), bucket])).digest()
+
+    ##
+    # Return the signed credential string for key, or None
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry.is_expired():
+                self.misses += 1
+                return None
+            # most recently used goes last
+            self.entries[key] = entry
+            self.hits += 1
+            return entry.credential
+
+    ##
+    # Remember a signed credential
+    #
+    # @param hrns the hrns of the caller and the object, for invalidate
+
+    def store(self, key, credential, hrns, expiration=None):
+        if not self.is_enabled():
+            return
+        expires = time.time() + self.ttl
+        if expiration is not None:
+            expires = min(expires, expiration)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = IssuedCredentialCacheEntry(credential, hrns, expires)
+            self.shrink()
+
+    ##
+    # Forget the credentials issued to or for hrn, or all of them
+
+    def invalidate(self, hrn=None):
+        with self.lock:
+            if hrn is None:
+                self.entries.clear()
+            else:
+                for key in [ key for (key, entry) in self.entries.items() if hrn in entry.hrns ]:
+                    del self.entries[key]
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'max_size': self.size, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations}
+
+    def shrink(self):
+        while len(self.entries) > max(self.size, 0):
+            self.entries.popitem(last=False)
+
+# the process-wide cache
+issued_credentials = IssuedCredentialCache()
@@ -33,11 +33,13 @@ from StringIO import StringIO
 
 from sfa.util.sfatime import SFATIME_FORMAT
 
-from sfa.trust.certificate import Certificate
+from sfa.trust.certificate import Certificate, Keypair
 from sfa.trust.credential import Credential, signature_template, HAVELXML
 from sfa.trust.abac_credential import ABACCredential, ABACElement
 from sfa.trust.credential_factory import CredentialFactory
 from sfa.trust.gid import GID
+if HAVELXML:
+    from sfa.trust import xmldsig
 
 # Routine to validate that a speaks-for credential 
 # says what it claims to say:
@@ -46,7 +48,7 @@ from sfa.trust.gid import GID
 # S.speaks_for(S)<-T Or "S says that T speaks for S"
 
 # Requires that openssl be installed and in the path
-# create_speaks_for requires that xmlsec1 be on the path
+# create_speaks_for requires lxml, or else that xmlsec1 be on the path
 
 # Simple XML helper functions
 
@@ -306,7 +308,6 @@ def create_sign_abaccred(tool_gid, user_gid, ma_gid, user_key_file, cred_filenam
     print "Created ABAC credential: '%s' in file %s" % \
             (cred.pretty_cred(), cred_filename)
 
-# FIXME: Assumes xmlsec1 is on path
 # FIXME: Assumes signer is itself signed by an 'ma_gid' that can be trusted
 def create_speaks_for(tool_gid, user_gid, ma_gid, \
                           user_key_file, cred_filename, dur_days=365):
@@ -359,6 +360,17 @@ def create_speaks_for(tool_gid, user_gid, ma_gid, \
     unsigned_cred = template % (reference, expiration_str, version, \
                                     user_keyid, user_urn, user_keyid, tool_keyid, tool_urn, \
                                     reference, reference)
+
+    if HAVELXML:
+        signed_cred = xmldsig.sign(unsigned_cred, 'Sig_%s' % reference,
+                                   Keypair(filename=user_key_file), [user_gid, ma_gid])
+        cred_file = open(cred_filename, 'w')
+        cred_file.write(signed_cred)
+        cred_file.close()
+        print "Created ABAC credential: '%s speaks_for %s' in file %s" % \
+            (tool_urn, user_urn, cred_filename)
+        return
+
     unsigned_cred_filename = write_to_tempfile(unsigned_cred)
 
     # Now sign the file with xmlsec1
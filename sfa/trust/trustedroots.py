@@ -1,37 +1,113 @@
+from __future__ import with_statement
 import os.path
 import glob
+import time
+import hashlib
+import threading
 
 from sfa.trust.gid import GID
 from sfa.util.sfalogging import logger
 
+##
+# The trusted roots found in a directory, parsed once and indexed by
+# subject; see shared_trusted_roots for the process-wide instance that
+# reloads itself when the directory changes
+#
+# An index can be passed to Certificate.verify_chain instead of a list of
+# trusted certs, so that the issuer of each certificate is looked up
+# rather than searched for
+
+class TrustedRootsIndex:
+
+    def __init__(self, file_list=None, gid_list=None):
+        self.file_list = file_list or []
+        self.gid_list = gid_list or []
+        self.by_subject = {}
+        for gid in self.gid_list:
+            self.by_subject.setdefault(gid.x509.get_subject().der(), []).append(gid)
+        self.fingerprint = hashlib.sha1("".join(sorted(
+            [gid.save_to_string() for gid in self.gid_list]))).hexdigest()
+
+    # the trusted roots whose subject is subject, an X509Name
+    def get_by_subject(self, subject):
+        return self.by_subject.get(subject.der(), [])
+
+    # behave as the list of trusted roots otherwise
+    def __iter__(self):
+        return iter(self.gid_list)
+
+    def __len__(self):
+        return len(self.gid_list)
+
 class TrustedRoots:
-    
+
     # we want to avoid reading all files in the directory
     # this is because it's common to have backups of all kinds
     # e.g. *~, *.hide, *-00, *.bak and the like
     supported_extensions= [ 'gid', 'cert', 'pem' ]
 
+    # how often (in seconds) a shared instance looks for changes on disk
+    check_interval = 1
+
     def __init__(self, dir):
         self.basedir = dir
         # create the directory to hold the files, if not existing
         if not os.path.isdir (self.basedir):
             os.makedirs(self.basedir)
+        self.lock = threading.RLock()
+        self.index = None
+        self.state = None
+        self.checked = 0
 
     def add_gid(self, gid):
         fn = os.path.join(self.basedir, gid.get_hrn() + ".gid")
         gid.save_to_file(fn)
+        with self.lock:
+            self.checked = 0
 
     def get_list(self):
-        gid_list = [GID(filename=cert_file) for cert_file in self.get_file_list()]
-        return gid_list
+        return list(self.get_index().gid_list)
 
     def get_file_list(self):
+        return list(self.get_index().file_list)
+
+    def get_fingerprint(self):
+        return self.get_index().fingerprint
+
+    ##
+    # Return the current TrustedRootsIndex, and (re)load the files if they
+    # have changed since the last call - this is checked every check_interval
+
+    def get_index(self):
+        with self.lock:
+            now = time.time()
+            if self.index is None or now - self.checked >= self.check_interval:
+                self.checked = now
+                file_list = self.scan()
+                state = [ self.file_state(f) for f in file_list ]
+                if state != self.state:
+                    if self.index is not None:
+                        logger.info("TrustedRoots: reloading %s" % self.basedir)
+                    self.index = TrustedRootsIndex(file_list, self.load(file_list))
+                    self.state = state
+            return self.index
+
+    def file_state(self, path):
+        try:
+            return (path, os.path.getmtime(path), os.path.getsize(path))
+        except OSError:
+            return (path, None, None)
+
+    def load(self, file_list):
+        return [GID(filename=cert_file) for cert_file in file_list]
+
+    def scan(self):
         file_list  = []
         pattern=os.path.join(self.basedir,"*")
-        for cert_file in glob.glob(pattern):
+        for cert_file in sorted(glob.glob(pattern)):
             if os.path.isfile(cert_file):
                 if self.has_supported_extension(cert_file):
-                    file_list.append(cert_file) 
+                    file_list.append(cert_file)
                 else:
                     logger.warning("File %s ignored - supported extensions are %r"%\
                                        (cert_file,TrustedRoots.supported_extensions))
@@ -41,3 +117,17 @@ class TrustedRoots:
         (_,ext)=os.path.splitext(path)
         ext=ext.replace('.','').lower()
         return ext in TrustedRoots.supported_extensions
+
+##
+# Return the TrustedRoots instance for dir that is shared by the whole
+# process, so that the directory is not read again for every request
+
+shared_roots = {}
+shared_roots_lock = threading.Lock()
+
+def shared_trusted_roots(dir):
+    dir = os.path.realpath(dir)
+    with shared_roots_lock:
+        if dir not in shared_roots:
+            shared_roots[dir] = TrustedRoots(dir)
+        return shared_roots[dir]
@@ -0,0 +1,386 @@
+##
+# In-process XML digital signatures (XML-DSig) for SFA credentials
+#
+# Historically every signature carried by a credential was checked by
+# forking one xmlsec1 process, on a temporary copy of the credential.
+# This module implements the subset of XML-DSig that SFA (and ProtoGENI)
+# credentials actually use, on top of lxml for canonicalization and
+# pyOpenSSL for the public-key operations, so that the whole job can be
+# performed in-process.
+#
+# Supported:
+#  . same-document references (URI="#xml:id" or URI="")
+#  . enveloped-signature transform
+#  . inclusive and exclusive canonicalization, with or without comments
+#  . sha1 and sha256 digests, rsa-sha1 and rsa-sha256 signatures
+#  . the signer key is taken from the X509Data certificates
+#
+# Anything else raises CredentialSignatureUnsupported, so that callers
+# can fall back on xmlsec1.
+#
+# The same code fills in signature templates, the way
+# 'xmlsec1 --sign' does, for the credentials that we issue.
+##
+
+import base64
+import hashlib
+import copy
+
+from lxml import etree
+from OpenSSL import crypto
+
+from sfa.util.faults import CredentialNotVerifiable, CredentialSignatureUnsupported
+from sfa.util.sfalogging import logger
+from sfa.trust.certificate import Certificate
+
+DSIG_NS = "http://www.w3.org/2000/09/xmldsig#"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+XML_ATTRIBUTE = "{%s}" % XML_NS
+XML_ID = XML_ATTRIBUTE + "id"
+
+C14N = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+C14N_COMMENTS = C14N + "#WithComments"
+EXC_C14N = "http://www.w3.org/2001/10/xml-exc-c14n#"
+EXC_C14N_COMMENTS = EXC_C14N + "WithComments"
+ENVELOPED_SIGNATURE = DSIG_NS + "enveloped-signature"
+
+# algorithm -> (exclusive, with_comments)
+c14n_algorithms = {
+    C14N :              (False, False),
+    C14N_COMMENTS :     (False, True),
+    EXC_C14N :          (True, False),
+    EXC_C14N_COMMENTS : (True, True),
+}
+
+digest_algorithms = {
+    DSIG_NS + "sha1" :                          hashlib.sha1,
+    "http://www.w3.org/2001/04/xmlenc#sha256" : hashlib.sha256,
+}
+
+# algorithm -> digest name as understood by pyOpenSSL
+signature_algorithms = {
+    DSIG_NS + "rsa-sha1" :                              'sha1',
+    "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256" : 'sha256',
+}
+
+# do not let incoming credentials reach the network or expand entities
+parser = etree.XMLParser(resolve_entities=False, no_network=True)
+
+def ds(tag):
+    return "{%s}%s" % (DSIG_NS, tag)
+
+def parse(xml):
+    """
+    Parse a credential into an lxml tree; lxml refuses unicode input
+    that carries an encoding declaration, so we always feed it bytes
+    """
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+    try:
+        return etree.fromstring(xml, parser)
+    except etree.XMLSyntaxError, e:
+        raise CredentialNotVerifiable("Malformed credential: %s" % e)
+
+def find_child(node, tag, what):
+    # malformed signatures must fail like they do with xmlsec1
+    child = node.find(ds(tag))
+    if child is None:
+        raise CredentialNotVerifiable("%s has no %s" % (what, tag))
+    return child
+
+def find_algorithm(node, tag, what):
+    algorithm = find_child(node, tag, what).get('Algorithm')
+    if not algorithm:
+        raise CredentialNotVerifiable("%s has no %s Algorithm" % (what, tag))
+    return algorithm
+
+def find_by_id(root, xml_id):
+    nodes = root.xpath('//*[@xml:id=$id]', id=xml_id)
+    if len(nodes) != 1:
+        raise CredentialNotVerifiable("Found %d nodes with xml:id %s" % (len(nodes), xml_id))
+    return nodes[0]
+
+def standalone(node, exclusive=False):
+    """
+    Return a copy of node, as the root of its own document, that keeps
+    everything canonicalization needs to know about the context of node:
+    all the namespaces in scope, and the xml:* attributes inherited from
+    the ancestors (inclusive c14n only, exclusive c14n ignores those)
+
+    This is needed because lxml canonicalizes a subtree incorrectly
+    when default namespaces get redeclared down that subtree
+    """
+    top = etree.Element(node.tag, nsmap=node.nsmap)
+    for name, value in node.attrib.items():
+        top.set(name, value)
+    if not exclusive:
+        for ancestor in node.iterancestors():
+            for name, value in ancestor.attrib.items():
+                if name.startswith(XML_ATTRIBUTE) and top.get(name) is None:
+                    top.set(name, value)
+    top.text = node.text
+    for child in node:
+        top.append(copy.deepcopy(child))
+    return top
+
+def canonicalize(node, algorithm=C14N, exclude_id=None):
+    """
+    Canonicalize the subtree rooted at node
+    exclude_id optionally names a descendant to leave out, for the enveloped-signature transform
+    """
+    if algorithm not in c14n_algorithms:
+        raise CredentialSignatureUnsupported("canonicalization %s" % algorithm)
+    exclusive, with_comments = c14n_algorithms[algorithm]
+    top = standalone(node, exclusive)
+    if exclude_id:
+        for excluded in top.xpath('.//*[@xml:id=$id]', id=exclude_id):
+            remove_keeping_tail(excluded)
+    return etree.tostring(top, method='c14n', exclusive=exclusive,
+                          with_comments=with_comments)
+
+def remove_keeping_tail(node):
+    # the text that follows node is not part of it in the XPath data model
+    parent = node.getparent()
+    previous = node.getprevious()
+    if node.tail:
+        if previous is not None:
+            previous.tail = (previous.tail or '') + node.tail
+        else:
+            parent.text = (parent.text or '') + node.tail
+    parent.remove(node)
+
+def reference_octets(root, signature, reference):
+    """
+    Apply the transforms of a <Reference> and return the octets to digest
+    """
+    uri = reference.get('URI')
+    if uri == '':
+        target = root
+    elif uri and uri.startswith('#'):
+        target = find_by_id(root, uri[1:])
+    else:
+        raise CredentialSignatureUnsupported("reference URI %r" % uri)
+
+    enveloped = False
+    algorithm = C14N
+    for transform in reference.findall("%s/%s" % (ds('Transforms'), ds('Transform'))):
+        name = transform.get('Algorithm')
+        if name == ENVELOPED_SIGNATURE:
+            enveloped = True
+        elif name in c14n_algorithms:
+            algorithm = name
+        else:
+            raise CredentialSignatureUnsupported("transform %s" % name)
+
+    # the enveloped transform only matters if the signature is inside the target
+    exclude_id = None
+    if enveloped and target in signature.iterancestors():
+        exclude_id = signature.get(XML_ID)
+    return canonicalize(target, algorithm, exclude_id)
+
+def pem_certificate(text):
+    # xmlsec1 may or may not add line breaks around the base64 content
+    return "-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----" % text.strip()
+
+def signer_certificate(signature):
+    """
+    Return the certificate of the signer, as found in the first <X509Certificate>
+    (this is what xmlsec1 writes and what Signature.decode assumes)
+    with its parent chain rebuilt from the other <X509Certificate> elements
+    """
+    texts = [ x.text for x in signature.iter(ds('X509Certificate')) if x.text ]
+    if not texts:
+        raise CredentialSignatureUnsupported("signature without X509Certificate")
+    try:
+        certs = [ Certificate(string=pem_certificate(text)) for text in texts ]
+    except Exception, e:
+        raise CredentialNotVerifiable("Malformed X509Certificate: %s" % e)
+    for cert in certs:
+        issuer = cert.x509.get_issuer()
+        if issuer == cert.x509.get_subject():
+            continue
+        for candidate in certs:
+            if candidate is not cert and candidate.x509.get_subject() == issuer \
+               and not is_ancestor(cert, candidate):
+                cert.set_parent(candidate)
+                break
+    return certs[0]
+
+# is cert already an ancestor of candidate ? (a chain must not loop)
+def is_ancestor(cert, candidate):
+    while candidate is not None:
+        if candidate is cert:
+            return True
+        candidate = candidate.get_parent()
+    return False
+
+def verify_signature(root, signature_id, trusted_certs):
+    """
+    Verify the signature with xml:id signature_id in the tree root, in the
+    same terms as 'xmlsec1 --verify --node-id signature_id':
+     . the digest of every reference matches
+     . SignedInfo is signed by the key of the signer certificate
+     . the signer certificate chains up to one of trusted_certs
+
+    Returns the signer Certificate, raises CredentialNotVerifiable otherwise
+    """
+    signature = find_by_id(root, signature_id)
+    if signature.tag != ds('Signature'):
+        raise CredentialNotVerifiable("Node %s is not a Signature" % signature_id)
+    signed_info = signature.find(ds('SignedInfo'))
+    if signed_info is None:
+        raise CredentialNotVerifiable("Signature %s has no SignedInfo" % signature_id)
+
+    references = signed_info.findall(ds('Reference'))
+    if not references:
+        raise CredentialNotVerifiable("Signature %s has no Reference" % signature_id)
+    for reference in references:
+        what = "Reference %s in %s" % (reference.get('URI'), signature_id)
+        digest_method = find_algorithm(reference, 'DigestMethod', what)
+        if digest_method not in digest_algorithms:
+            raise CredentialSignatureUnsupported("digest %s" % digest_method)
+        octets = reference_octets(root, signature, reference)
+        digest = base64.b64encode(digest_algorithms[digest_method](octets).digest())
+        expected = "".join((find_child(reference, 'DigestValue', what).text or '').split())
+        if digest != expected:
+            raise CredentialNotVerifiable("Digest mismatch on reference %s in %s" % \
+                                          (reference.get('URI'), signature_id))
+
+    what = "SignedInfo in %s" % signature_id
+    c14n_method = find_algorithm(signed_info, 'CanonicalizationMethod', what)
+    signature_method = find_algorithm(signed_info, 'SignatureMethod', what)
+    if signature_method not in signature_algorithms:
+        raise CredentialSignatureUnsupported("signature method %s" % signature_method)
+    signer = signer_certificate(signature)
+    try:
+        value = base64.b64decode(find_child(signature, 'SignatureValue', signature_id).text or '')
+    except TypeError, e:
+        raise CredentialNotVerifiable("Malformed SignatureValue in %s: %s" % (signature_id, e))
+    try:
+        crypto.verify(signer.x509, value, canonicalize(signed_info, c14n_method),
+                      signature_algorithms[signature_method])
+    except crypto.Error:
+        raise CredentialNotVerifiable("Signature %s is invalid" % signature_id)
+
+    # same as xmlsec1: x509 chain only, no hrn-based checks
+    try:
+        Certificate.verify_chain(signer, trusted_certs)
+    except Exception, e:
+        logger.debug("xmldsig: signer of %s not trusted: %s" % (signature_id, e))
+        raise CredentialNotVerifiable("Signer %s of %s is not trusted: %s" % \
+                                      (signer.pretty_cert(), signature_id, e))
+    # verify_chain does not require trusted roots to be CAs, openssl does
+    root = trusted_issuer(signer, trusted_certs)
+    if root is not None and not is_ca(root):
+        raise CredentialNotVerifiable("Signer %s of %s is issued by %s, which is not a CA" % \
+                                      (signer.pretty_cert(), signature_id, root.pretty_cert()))
+    return signer
+
+def trusted_issuer(cert, trusted_certs):
+    """
+    Walk up the chain like Certificate.verify_chain does, and return the
+    trusted certificate that issued a certificate in the chain, or None
+    when the chain ends on a trusted certificate itself
+    """
+    while cert is not None:
+        for trusted_cert in trusted_certs:
+            if cert.is_issued_by(trusted_cert) and cert.is_signed_by_cert(trusted_cert):
+                if cert.save_to_string() == trusted_cert.save_to_string():
+                    return None
+                return trusted_cert
+        cert = cert.get_parent()
+    return None
+
+def is_ca(cert):
+    if cert.isCA:
+        return True
+    try:
+        return cert.get_extension('basicConstraints') == 'CA:TRUE'
+    except LookupError:
+        return False
+
+def base64_lines(octets):
+    # as written by xmlsec1, 64 characters per line
+    text = base64.b64encode(octets)
+    return "\n".join([ text[i:i+64] for i in range(0, len(text), 64) ])
+
+def x509_name(name):
+    return ",".join([ "%s=%s" % component for component in reversed(name.get_components()) ])
+
+def sign_signature(root, signature_id, pkey, certs):
+    """
+    Fill in the signature template with xml:id signature_id in the tree root,
+    in the same terms as 'xmlsec1 --sign --node-id signature_id':
+     . compute the digest of every reference
+     . sign SignedInfo with pkey, a pyOpenSSL private key
+     . describe certs, the signer Certificate and then its chain, in X509Data
+
+    The tree is modified in place
+    """
+    signature = find_by_id(root, signature_id)
+    if signature.tag != ds('Signature'):
+        raise CredentialNotVerifiable("Node %s is not a Signature" % signature_id)
+    signed_info = signature.find(ds('SignedInfo'))
+    if signed_info is None:
+        raise CredentialNotVerifiable("Signature %s has no SignedInfo" % signature_id)
+
+    for reference in signed_info.findall(ds('Reference')):
+        what = "Reference %s in %s" % (reference.get('URI'), signature_id)
+        digest_method = find_algorithm(reference, 'DigestMethod', what)
+        if digest_method not in digest_algorithms:
+            raise CredentialSignatureUnsupported("digest %s" % digest_method)
+        octets = reference_octets(root, signature, reference)
+        find_child(reference, 'DigestValue', what).text = \
+            base64.b64encode(digest_algorithms[digest_method](octets).digest())
+
+    what = "SignedInfo in %s" % signature_id
+    c14n_method = find_algorithm(signed_info, 'CanonicalizationMethod', what)
+    signature_method = find_algorithm(signed_info, 'SignatureMethod', what)
+    if signature_method not in signature_algorithms:
+        raise CredentialSignatureUnsupported("signature method %s" % signature_method)
+    value = crypto.sign(pkey, canonicalize(signed_info, c14n_method),
+                        signature_algorithms[signature_method])
+    find_child(signature, 'SignatureValue', signature_id).text = base64_lines(value)
+
+    x509_data = signature.find("%s/%s" % (ds('KeyInfo'), ds('X509Data')))
+    if x509_data is not None:
+        fill_x509_data(x509_data, certs)
+
+def fill_x509_data(x509_data, certs):
+    """
+    Replace each empty placeholder in X509Data with one element per certificate
+    """
+    for tag in ['X509SubjectName', 'X509IssuerSerial', 'X509Certificate']:
+        placeholder = x509_data.find(ds(tag))
+        if placeholder is None or len(placeholder) or placeholder.text:
+            continue
+        previous = None
+        for cert in certs:
+            if previous is None:
+                element = placeholder
+            else:
+                element = etree.Element(ds(tag))
+                element.tail = previous.tail
+                previous.tail = "\n"
+                previous.addnext(element)
+            if tag == 'X509SubjectName':
+                element.text = x509_name(cert.x509.get_subject())
+            elif tag == 'X509IssuerSerial':
+                element.text = "\n"
+                etree.SubElement(element, ds('X509IssuerName')).text = x509_name(cert.x509.get_issuer())
+                element[-1].tail = "\n"
+                etree.SubElement(element, ds('X509SerialNumber')).text = str(cert.x509.get_serial_number())
+                element[-1].tail = "\n"
+            else:
+                element.text = base64_lines(crypto.dump_certificate(crypto.FILETYPE_ASN1, cert.x509))
+            previous = element
+
+def sign(xml, signature_id, keypair, certs):
+    """
+    Sign a credential string, whose signature template has xml:id signature_id,
+    with keypair, a Keypair; certs is the signer Certificate and then its chain;
+    return the signed string
+    """
+    root = parse(xml)
+    sign_signature(root, signature_id, keypair.get_openssl_pkey(), certs)
+    return etree.tostring(root.getroottree(), xml_declaration=True, encoding='UTF-8')
@@ -95,6 +95,15 @@ class Cache:
         if key in self.cache:
             self.cache.pop(key) 
 
+    def clear(self, prefix=None):
+        """
+        Drop the entries whose key starts with prefix, or all entries
+        """
+        with self.lock:
+            for key in self.cache.keys():
+                if prefix is None or key.startswith(prefix):
+                    self.cache.pop(key)
+
     def dump(self):
         result = {}
         for key in self.cache:
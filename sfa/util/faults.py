@@ -351,6 +351,10 @@ class CredentialNotVerifiable(SfaFault):
     def __str__(self):
         return repr(self.value)
 
+class CredentialSignatureUnsupported(CredentialNotVerifiable):
+    def __init__(self, value=None, extra = None):
+        CredentialNotVerifiable.__init__(self, "unsupported signature feature %s" % value, extra)
+
 class CertExpired(SfaFault):
     def __init__(self, value, extra=None):
         self.value = value
@@ -369,3 +373,8 @@ class UnsupportedOperation(SfaFault):
         faultString = "Unsupported operation: %s" % value
         SfaFault.__init__(self, GENICODE.UNSUPPORTED, faultString, extra) 
                  
+
+class ServerBusy(SfaFault):
+    def __init__(self, extra=None):
+        faultString = "Server busy, try again later"
+        SfaFault.__init__(self, GENICODE.BUSY, faultString, extra)
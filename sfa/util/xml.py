@@ -163,6 +163,8 @@ class XML:
         self.namespaces = namespaces
         self.default_namespace = None
         self.schema = None
+        # see sfa.rspecs.node_index
+        self.node_index = None
         if isinstance(xml, basestring):
             self.parse_xml(xml)
         if isinstance(xml, XmlElement):
@@ -175,6 +177,7 @@ class XML:
         """
         parse rspec into etree
         """
+        self.node_index = None
         parser = etree.XMLParser(remove_blank_text=True)
         try:
             tree = etree.parse(xml, parser)
@@ -275,6 +278,8 @@ class XML:
         specified parent node. Adds element to root node is parent is 
         not specified. 
         """
+        # whatever gets added may hold nodes, see sfa.rspecs.node_index
+        self.node_index = None
         return self.root.add_element(*args, **kwds)
 
     def remove_elements(self, name, element = None):
@@ -288,6 +293,7 @@ class XML:
         element.remove_elements(name)
 
     def add_instance(self, *args, **kwds):
+        self.node_index = None
         return self.root.add_instance(*args, **kwds)
 
     def get_instance(self, *args, **kwds):
@@ -315,6 +321,7 @@ class XML:
         return attrs
 
     def append(self, elem):
+        self.node_index = None
         return self.root.append(elem)
 
     def iterchildren(self):
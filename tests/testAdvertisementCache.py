@@ -0,0 +1,53 @@
+import unittest
+from sfa.util.cache import Cache
+from sfa.managers.aggregate_manager import AggregateManager
+
+class FakeConfig:
+    SFA_AGGREGATE_CACHE_TTL = 60
+
+class FakeDriver:
+    def __init__(self):
+        self.cache = Cache()
+        self.built = 0
+    def list_resources(self, version, options):
+        self.built += 1
+        return "<rspec %d/>" % self.built
+    def allocate(self, xrn, rspec_string, expiration, options):
+        return "allocated"
+    def delete(self, xrns, options):
+        raise Exception("delete failed half way")
+
+class FakeApi:
+    def __init__(self):
+        self.config = FakeConfig()
+        self.driver = FakeDriver()
+
+class TestAdvertisementCache(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeApi()
+        self.api.driver.cache.clear()
+        self.manager = AggregateManager(None)
+        self.options = {'geni_rspec_version': {'type': 'GENI', 'version': '3'}}
+
+    def tearDown(self):
+        self.api.driver.cache.clear()
+
+    def testCached(self):
+        first = self.manager.ListResources(self.api, [], self.options)
+        self.assertEqual(self.manager.ListResources(self.api, [], self.options), first)
+        self.assertEqual(self.api.driver.built, 1)
+        options = dict(self.options, geni_available=True)
+        self.manager.ListResources(self.api, [], options)
+        self.assertEqual(self.api.driver.built, 2)
+
+    def testInvalidated(self):
+        self.manager.ListResources(self.api, [], self.options)
+        self.manager.Allocate(self.api, "urn", [], "<rspec/>", None, {})
+        self.manager.ListResources(self.api, [], self.options)
+        self.assertEqual(self.api.driver.built, 2)
+        self.assertRaises(Exception, self.manager.Delete, self.api, ["urn"], [], {})
+        self.manager.ListResources(self.api, [], self.options)
+        self.assertEqual(self.api.driver.built, 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,8 +11,25 @@ from testXrn import *
 #from testCred import *
 from testKeypair import *
 # xxx broken-test
-#from testHierarchy import *
+from testHierarchy import *
 from testStorage import *
+from testCredentialCache import *
+from testTrustedRoots import *
+from testVerifyChain import *
+from testMultiClient import *
+from testConnectionPool import *
+from testAdvertisementCache import *
+from testPlShell import *
+from testLinkIndex import *
+from testPlSlices import *
+from testNodeStream import *
+from testCompression import *
+from testNodeIndex import *
+from testIssuedCredentials import *
+from testXmldsig import *
+from testRoutingTable import *
+from testResolve import *
+from testThreadedServer import *
 
 if __name__ == "__main__":
     unittest.main()
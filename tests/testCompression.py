@@ -0,0 +1,42 @@
+import unittest
+from sfa.rspecs.compression import *
+
+RSPEC = '<?xml version="1.0"?>\n<rspec>%s</rspec>\n' % ('<node component_id="x"/>' * 100)
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.cache = CompressionCache(size=2)
+
+    def testRoundTrip(self):
+        blob = compress(RSPEC, 1)
+        self.assertTrue(is_compressed(blob))
+        self.assertFalse(is_compressed(RSPEC))
+        self.assertEqual(plain(blob), RSPEC)
+        self.assertEqual(plain(RSPEC), RSPEC)
+
+    def testCache(self):
+        blob = self.cache.compress(RSPEC)
+        self.assertEqual(self.cache.compress(RSPEC), blob)
+        self.assertEqual(decompress(blob), RSPEC)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        # another level is another entry
+        self.assertEqual(decompress(self.cache.compress(RSPEC, 9)), RSPEC)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def testEviction(self):
+        rspecs = [ RSPEC + str(i) for i in range(3) ]
+        for rspec in rspecs:
+            self.cache.compress(rspec)
+        self.cache.compress(rspecs[0])
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.assertEqual(self.cache.stats()['misses'], 4)
+
+    def testSameText(self):
+        # an equal string that is not the cached one is compressed again
+        self.cache.compress(RSPEC + '0')
+        self.assertEqual(decompress(self.cache.compress(RSPEC + '0')), RSPEC + '0')
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+if __name__ == "__main__":
+    unittest.main()
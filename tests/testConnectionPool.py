@@ -0,0 +1,78 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+from OpenSSL import crypto
+from sfa.client.sfaserverproxy import ConnectionPool, ssl_needs_unverified_context
+
+class FakeConnection:
+    def __init__(self):
+        self.sock = object()
+    def close(self):
+        self.sock = None
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_idle=60, max_per_host=2)
+
+    def testReuse(self):
+        conn = FakeConnection()
+        self.assertEqual(self.pool.get("a"), None)
+        self.pool.put("a", conn)
+        self.assertEqual(self.pool.get("b"), None)
+        self.assertEqual(self.pool.get("a"), conn)
+        self.assertEqual(self.pool.get("a"), None)
+        self.assertEqual(self.pool.stats()['reused'], 1)
+
+    def testPerHostLimit(self):
+        conns = [ FakeConnection() for i in range(3) ]
+        for conn in conns:
+            self.pool.put("a", conn)
+        self.assertEqual(self.pool.stats()['idle'], 2)
+        self.assertEqual(conns[2].sock, None)
+
+    def testClosed(self):
+        conn = FakeConnection()
+        conn.close()
+        self.pool.put("a", conn)
+        self.assertEqual(self.pool.get("a"), None)
+
+    def testExpired(self):
+        conn = FakeConnection()
+        self.pool.put("a", conn)
+        self.pool.max_idle = 0
+        time.sleep(0.01)
+        self.assertEqual(self.pool.get("a"), None)
+        self.assertEqual(conn.sock, None)
+
+    def testContext(self):
+        if not ssl_needs_unverified_context:
+            return
+        directory = tempfile.mkdtemp()
+        try:
+            # recent openssl versions reject small keys
+            key = crypto.PKey()
+            key.generate_key(crypto.TYPE_RSA, 2048)
+            cert = crypto.X509()
+            cert.get_subject().CN = "client"
+            cert.set_issuer(cert.get_subject())
+            cert.gmtime_adj_notBefore(0)
+            cert.gmtime_adj_notAfter(3600)
+            cert.set_pubkey(key)
+            cert.sign(key, 'sha256')
+            key_file = os.path.join(directory, "client.pkey")
+            cert_file = os.path.join(directory, "client.cert")
+            open(key_file, 'w').write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+            open(cert_file, 'w').write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+            context = self.pool.get_context(key_file, cert_file)
+            self.assertTrue(self.pool.get_context(key_file, cert_file) is context)
+            # a new certificate is loaded right away
+            os.utime(cert_file, (time.time() + 10, time.time() + 10))
+            self.assertFalse(self.pool.get_context(key_file, cert_file) is context)
+            self.assertEqual(len(self.pool.contexts), 1)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
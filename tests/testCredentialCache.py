@@ -0,0 +1,58 @@
+import unittest
+import datetime
+from sfa.trust.credentialcache import *
+
+class FakeCred:
+    def __init__(self, seconds):
+        self.expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds)
+    def get_credential_list(self):
+        return [self]
+    def get_expiration(self):
+        return self.expiration
+    def get_gid_caller(self):
+        return None
+    def get_gid_object(self):
+        return None
+
+class TestCredentialCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = CredentialCache(size=2)
+
+    def testHitAndMiss(self):
+        cred = FakeCred(3600)
+        self.assertEqual(self.cache.lookup("cred", "roots"), None)
+        self.cache.store("cred", "roots", cred)
+        self.assertEqual(self.cache.lookup("cred", "roots").cred, cred)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def testError(self):
+        self.cache.store("cred", "roots", FakeCred(3600), ValueError("bad"))
+        self.assertTrue(isinstance(self.cache.lookup("cred", "roots").error, ValueError))
+
+    def testLRU(self):
+        self.cache.store("a", "roots", FakeCred(3600))
+        self.cache.store("b", "roots", FakeCred(3600))
+        self.cache.lookup("a", "roots")
+        self.cache.store("c", "roots", FakeCred(3600))
+        self.assertEqual(self.cache.lookup("b", "roots"), None)
+        self.assertNotEqual(self.cache.lookup("a", "roots"), None)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def testExpired(self):
+        self.cache.store("cred", "roots", FakeCred(-1))
+        self.assertEqual(self.cache.lookup("cred", "roots"), None)
+
+    def testRootsChanged(self):
+        self.cache.store("cred", "roots", FakeCred(3600))
+        self.assertEqual(self.cache.lookup("cred", "other roots"), None)
+        self.assertEqual(self.cache.lookup("cred", "roots"), None)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def testDisabled(self):
+        self.cache.set_size(0)
+        self.cache.store("cred", "roots", FakeCred(3600))
+        self.assertEqual(self.cache.lookup("cred", "roots"), None)
+
+if __name__ == "__main__":
+    unittest.main()
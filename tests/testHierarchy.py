@@ -10,7 +10,10 @@ PURGE_BASEDIR = "rm -rf test_hierarchy"
 class TestHierarchy(unittest.TestCase):
     def setUp(self):
         os.system(PURGE_BASEDIR)
-        pass
+        auth_cache.invalidate()
+
+    def tearDown(self):
+        os.system(PURGE_BASEDIR)
 
     def testInit(self):
         h = Hierarchy(BASEDIR)
@@ -46,6 +49,35 @@ class TestHierarchy(unittest.TestCase):
         pubkey = auth_info2.get_pkey_object()
         self.assert_(gid)
 
+    def testAuthCache(self):
+        h = Hierarchy(BASEDIR)
+        name = "planetlab.us.arizona"
+        h.create_auth(name, create_parents=True)
+
+        auth_info = h.get_auth_info(name)
+        auth_info2 = Hierarchy(BASEDIR).get_auth_info(name)
+        # parsed once, shared by all hierarchies
+        self.assertTrue(auth_info2 is not auth_info)
+        self.assertTrue(auth_info2.get_gid_object() is auth_info.get_gid_object())
+        self.assertTrue(auth_info2.get_pkey_object() is auth_info.get_pkey_object())
+
+        # the authority gets created again
+        (directory, gid_filename, privkey_filename) = h.get_auth_filenames(name)
+        os.remove(gid_filename)
+        os.remove(privkey_filename)
+        self.assertRaises(MissingAuthority, h.get_auth_info, name)
+        h.create_auth(name)
+        auth_info3 = h.get_auth_info(name)
+        self.assertFalse(auth_info3.get_gid_object() is auth_info.get_gid_object())
+        self.assertNotEqual(auth_info3.get_pkey_object().as_pem(), auth_info.get_pkey_object().as_pem())
+
+    def testAuthCred(self):
+        h = Hierarchy(BASEDIR)
+        name = "planetlab.us"
+        h.create_auth(name, create_parents=True)
+        cred = h.get_auth_cred(name)
+        self.assertEqual(cred.get_signature().get_issuer_gid().get_subject(), "planetlab")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import time
+from sfa.trust.rights import Rights
+from sfa.trust.issuedcredentials import *
+
+class FakeGID:
+    def __init__(self, string):
+        self.string = string
+    def save_to_string(self, save_parents=True):
+        return self.string
+
+class TestIssuedCredentials(unittest.TestCase):
+    def setUp(self):
+        self.cache = IssuedCredentialCache(size=2)
+        self.user = FakeGID("user gid")
+        self.slice = FakeGID("slice gid")
+        self.authority = FakeGID("authority gid")
+
+    def key(self, rights="refresh,info", expiration=None, caller=None):
+        return self.cache.key(caller or self.user, self.slice, self.authority,
+                              Rights(string=rights), expiration)
+
+    def testHitAndMiss(self):
+        self.assertEqual(self.cache.lookup(self.key()), None)
+        self.cache.store(self.key(), "cred", ['plc.user', 'plc.slice'])
+        self.assertEqual(self.cache.lookup(self.key()), "cred")
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def testKey(self):
+        self.assertNotEqual(self.key(), self.key(rights="refresh"))
+        self.assertNotEqual(self.key(), self.key(caller=FakeGID("new user gid")))
+        expiration = int(time.time()) + 3600
+        self.assertEqual(self.key(expiration=expiration), self.key(expiration=expiration))
+        self.assertNotEqual(self.key(expiration=expiration), self.key(expiration=expiration+1))
+
+    def testExpired(self):
+        expiration = int(time.time()) - 1
+        self.cache.store(self.key(expiration=expiration), "cred", ['plc.user', 'plc.slice'], expiration)
+        self.assertEqual(self.cache.lookup(self.key(expiration=expiration)), None)
+
+    def testInvalidate(self):
+        self.cache.store(self.key(), "cred", ['plc.user', 'plc.slice'])
+        self.cache.store(self.key(rights="refresh"), "other", ['plc.user', 'plc.other'])
+        self.cache.invalidate('plc.slice')
+        self.assertEqual(self.cache.lookup(self.key()), None)
+        self.assertEqual(self.cache.lookup(self.key(rights="refresh")), "other")
+        self.cache.invalidate('plc.user')
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def testLRU(self):
+        self.cache.store(self.key(rights="a"), "a", [])
+        self.cache.store(self.key(rights="b"), "b", [])
+        self.cache.lookup(self.key(rights="a"))
+        self.cache.store(self.key(rights="c"), "c", [])
+        self.assertEqual(self.cache.lookup(self.key(rights="b")), None)
+        self.assertEqual(self.cache.lookup(self.key(rights="a")), "a")
+
+    def testDisabled(self):
+        self.cache.configure(0, DEFAULT_CACHE_TTL)
+        self.assertFalse(self.cache.is_enabled())
+        self.cache.store(self.key(), "cred", [])
+        self.assertEqual(self.cache.lookup(self.key()), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import os
+import tempfile
+from sfa.planetlab.topology import LinkIndex, get_topology
+
+class TestLinkIndex(unittest.TestCase):
+    def setUp(self):
+        (fd, self.filename) = tempfile.mkstemp()
+        os.write(fd, "# site pairs\n1 2\n2 3 # comment\n1 9\n")
+        os.close(fd)
+        self.sites = {1: {'site_id': 1, 'login_base': 'one', 'node_ids': [10, 11]},
+                      2: {'site_id': 2, 'login_base': 'two', 'node_ids': [20]},
+                      3: {'site_id': 3, 'login_base': 'three', 'node_ids': [30, 31]}}
+        self.nodes = {10: {'node_id': 10, 'interface_ids': [100]},
+                      11: {'node_id': 11, 'interface_ids': [110]},
+                      20: {'node_id': 20, 'interface_ids': [200]},
+                      30: {'node_id': 30, 'interface_ids': [300]}}
+        self.interfaces = dict([ (if_id, {'interface_id': if_id, 'ip': '10.0.0.%d' % (if_id / 10)})
+                                 for if_id in [100, 110, 200, 300] ])
+        self.index = LinkIndex()
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def testTopology(self):
+        topology = get_topology(self.filename)
+        self.assertEqual(topology, set([('1', '2'), ('2', '3'), ('1', '9')]))
+        self.assertTrue(get_topology(self.filename) is topology)
+
+    def testLinks(self):
+        links = self.index.get_links("plc", get_topology(self.filename),
+                                     self.sites, self.nodes, self.interfaces)
+        # site 9 is unknown, node 31 is not considered
+        self.assertEqual(len(links), 3)
+        names = sorted([ (link['component_name'], link['interface1']['ipv4'], link['interface2']['ipv4'])
+                         for link in links ])
+        self.assertEqual(names, [('one:two', '10.0.0.10', '10.0.0.20'),
+                                 ('one:two', '10.0.0.11', '10.0.0.20'),
+                                 ('two:three', '10.0.0.20', '10.0.0.30')])
+        self.assertEqual(links[0]['interface1']['component_id'].split('+')[-1][:4], 'node')
+
+    def testRebuild(self):
+        topology = get_topology(self.filename)
+        links = self.index.get_links("plc", topology, self.sites, self.nodes, self.interfaces)
+        self.assertTrue(self.index.get_links("plc", topology, self.sites, self.nodes,
+                                             self.interfaces) is links)
+        self.interfaces[300]['ip'] = '10.0.1.3'
+        links = self.index.get_links("plc", topology, self.sites, self.nodes, self.interfaces)
+        self.assertTrue('10.0.1.3' in [ link['interface2']['ipv4'] for link in links ])
+        del self.nodes[11]
+        self.assertEqual(len(self.index.get_links("plc", topology, self.sites, self.nodes,
+                                                  self.interfaces)), 2)
+
+    def testSeveralNodeSets(self):
+        topology = get_topology(self.filename)
+        links = self.index.get_links("plc", topology, self.sites, self.nodes, self.interfaces)
+        slice_nodes = dict( (node_id, self.nodes[node_id]) for node_id in [10, 20] )
+        slice_links = self.index.get_links("plc", topology, self.sites, slice_nodes, self.interfaces)
+        self.assertEqual(len(slice_links), 1)
+        # alternating between both sets does not rebuild anything
+        self.assertTrue(self.index.get_links("plc", topology, self.sites, self.nodes,
+                                             self.interfaces) is links)
+        self.assertTrue(self.index.get_links("plc", topology, self.sites, slice_nodes,
+                                             self.interfaces) is slice_links)
+        # the least recently used set goes first
+        self.index.size = 2
+        other_nodes = dict( (node_id, self.nodes[node_id]) for node_id in [11, 20] )
+        self.index.get_links("plc", topology, self.sites, other_nodes, self.interfaces)
+        self.assertEqual(len(self.index.entries), 2)
+        self.assertTrue(self.index.get_links("plc", topology, self.sites, slice_nodes,
+                                             self.interfaces) is slice_links)
+        self.assertFalse(self.index.get_links("plc", topology, self.sites, self.nodes,
+                                              self.interfaces) is links)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import time
+from sfa.client.multiclient import MultiClient
+
+def echo(value, delay=0):
+    time.sleep(delay)
+    return value
+
+def fail():
+    raise ValueError("failed")
+
+class TestMultiClient(unittest.TestCase):
+
+    def testResults(self):
+        multiclient = MultiClient()
+        for i in range(5):
+            multiclient.run(echo, i)
+        self.assertEqual(sorted(multiclient.get_results()), range(5))
+        self.assertEqual(multiclient.get_errors(), [])
+
+    def testErrors(self):
+        multiclient = MultiClient()
+        multiclient.run(echo, 1)
+        multiclient.run(fail)
+        self.assertEqual(multiclient.get_results(), [1])
+        self.assertEqual(len(multiclient.get_errors()), 1)
+        multiclient = MultiClient()
+        multiclient.run(fail)
+        self.assertRaises(Exception, multiclient.get_results, lenient=False)
+
+    def testStreaming(self):
+        multiclient = MultiClient()
+        multiclient.run(echo, "slow", 0.5)
+        multiclient.run(echo, "fast")
+        self.assertEqual(list(multiclient.iter_results()), ["fast", "slow"])
+
+    def testTimeout(self):
+        multiclient = MultiClient(timeout=0.2)
+        multiclient.run(echo, "slow", 1)
+        multiclient.run(echo, "fast")
+        start = time.time()
+        self.assertEqual(multiclient.get_results(), ["fast"])
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(multiclient.get_errors(), ["MultiClient: call timed out"])
+
+if __name__ == "__main__":
+    unittest.main()
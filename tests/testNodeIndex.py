@@ -0,0 +1,109 @@
+import unittest
+from sfa.rspecs.rspec import RSpec
+from sfa.rspecs.version_manager import VersionManager
+from sfa.rspecs.elements.node import NodeElement
+from sfa.rspecs.node_index import lookup_nodes, forget_nodes
+
+def make_node(i, client_id=None):
+    node = NodeElement()
+    node['component_id'] = 'urn:publicid:IDN+plc:site+node+node%d.site.org' % i
+    node['component_name'] = 'node%d.site.org' % i
+    node['component_manager_id'] = 'urn:publicid:IDN+plc+authority+cm'
+    if client_id:
+        node['client_id'] = client_id
+    return node
+
+class TestNodeIndex(unittest.TestCase):
+
+    def make_rspec(self, version, count):
+        version_manager = VersionManager()
+        rspec = RSpec(version=version_manager._get_version(version, '1' if version == 'SFA' else '2', 'request'))
+        rspec.version.add_nodes([ make_node(i, 'client%d' % i) for i in range(count) ])
+        return rspec
+
+    def check_lookups(self, version, client_ids=True):
+        rspec = self.make_rspec(version, 10)
+        urn = 'urn:publicid:IDN+plc:site+node+node3.site.org'
+        nodes = rspec.version.get_nodes({'component_id': urn})
+        self.assertEqual([ node['component_id'] for node in nodes ], [urn])
+        nodes = rspec.version.get_nodes({'component_id': '*node4.site.org*'})
+        self.assertEqual([ node['component_name'] for node in nodes ], ['node4.site.org'])
+        if client_ids:
+            nodes = rspec.version.get_nodes({'client_id': 'client5'})
+            self.assertEqual([ node['client_id'] for node in nodes ], ['client5'])
+        self.assertEqual(rspec.version.get_nodes({'client_id': 'unknown'}), [])
+        self.assertEqual(len(rspec.version.get_nodes()), 10)
+
+    def testPGv2(self):
+        self.check_lookups('ProtoGENI')
+
+    def testSFAv1(self):
+        # sfa rspecs have no client_id
+        self.check_lookups('SFA', client_ids=False)
+
+    def testIndexed(self):
+        rspec = self.make_rspec('ProtoGENI', 3)
+        self.assertEqual(len(lookup_nodes(rspec.xml, {'client_id': 'client1'})), 1)
+        self.assertTrue('client_id' in rspec.xml.node_index.maps)
+        # not served from the index
+        self.assertEqual(lookup_nodes(rspec.xml, {'exclusive': 'true'}), None)
+        self.assertEqual(lookup_nodes(rspec.xml, {'client_id': 'client1', 'exclusive': 'true'}), None)
+
+    def testRemoved(self):
+        rspec = self.make_rspec('ProtoGENI', 3)
+        self.assertEqual(len(rspec.version.get_nodes({'client_id': 'client1'})), 1)
+        element = rspec.xml.xpath('//node[@client_id="client1"]')[0]
+        element.getparent().remove(element)
+        self.assertEqual(rspec.version.get_nodes({'client_id': 'client1'}), [])
+
+    def testAdded(self):
+        rspec = self.make_rspec('ProtoGENI', 3)
+        self.assertEqual(len(rspec.version.get_nodes({'client_id': 'client1'})), 1)
+        rspec.version.add_nodes([make_node(7, 'client7')])
+        nodes = rspec.version.get_nodes({'client_id': 'client7'})
+        self.assertEqual([ node['component_name'] for node in nodes ], ['node7.site.org'])
+        nodes = rspec.version.get_nodes({'component_id': '*node7.site.org*'})
+        self.assertEqual(len(nodes), 1)
+
+    def testChanged(self):
+        rspec = self.make_rspec('ProtoGENI', 3)
+        self.assertEqual(len(rspec.version.get_nodes({'client_id': 'client1'})), 1)
+        element = rspec.xml.xpath('//node[@client_id="client1"]')[0]
+        element.set('client_id', 'renamed')
+        self.assertEqual(rspec.version.get_nodes({'client_id': 'client1'}), [])
+        # whoever changes the attributes says so
+        forget_nodes(rspec.xml, ['client_id'])
+        nodes = rspec.version.get_nodes({'client_id': 'renamed'})
+        self.assertEqual([ node['component_name'] for node in nodes ], ['node1.site.org'])
+
+    def testMissed(self):
+        rspec = self.make_rspec('ProtoGENI', 11)
+        self.assertEqual(rspec.version.get_nodes({'client_id': 'unknown'}), [])
+        maps = rspec.xml.node_index.maps
+        self.assertEqual(rspec.version.get_nodes({'client_id': 'other'}), [])
+        self.assertTrue(rspec.xml.node_index.maps['client_id'] is maps['client_id'])
+        # hostnames match exactly, whether the node is there or not
+        nodes = rspec.version.get_nodes({'component_id': '*node1.site*'})
+        self.assertEqual(nodes, [])
+        nodes = rspec.version.get_nodes({'component_id': '*node1.site.org*'})
+        self.assertEqual([ node['component_name'] for node in nodes ], ['node1.site.org'])
+        element = rspec.xml.xpath('//node[@component_name="node1.site.org"]')[0]
+        element.getparent().remove(element)
+        self.assertEqual(rspec.version.get_nodes({'component_id': '*node1.site.org*'}), [])
+
+    def testSFAv1Added(self):
+        rspec = self.make_rspec('SFA', 3)
+        self.assertEqual(rspec.version.get_nodes({'component_id': '*node7.site.org*'}), [])
+        rspec.version.add_nodes([make_node(7)])
+        nodes = rspec.version.get_nodes({'component_id': '*node7.site.org*'})
+        self.assertEqual([ node['component_name'] for node in nodes ], ['node7.site.org'])
+
+    def testReparsed(self):
+        rspec = self.make_rspec('ProtoGENI', 3)
+        self.assertEqual(len(rspec.version.get_nodes({'client_id': 'client1'})), 1)
+        rspec.xml.parse_xml(rspec.toxml())
+        self.assertEqual(rspec.xml.node_index, None)
+        self.assertEqual(len(rspec.version.get_nodes({'client_id': 'client2'})), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from sfa.rspecs.rspec import RSpec
+from sfa.rspecs.version_manager import VersionManager
+from sfa.rspecs.elements.node import NodeElement
+from sfa.rspecs.elements.hardware_type import HardwareType
+from sfa.rspecs.elements.location import Location
+from sfa.rspecs.elements.interface import Interface
+from sfa.rspecs.elements.granularity import Granularity
+from sfa.rspecs.elements.pltag import PLTag
+
+def make_nodes(count):
+    for i in range(count):
+        node = NodeElement()
+        node['component_id'] = 'urn:publicid:IDN+plc:site+node+node%d.site.org' % i
+        node['component_name'] = 'node%d.site.org' % i
+        node['component_manager_id'] = 'urn:publicid:IDN+plc+authority+cm'
+        node['authority_id'] = 'urn:publicid:IDN+plc:site+authority+sa'
+        node['boot_state'] = 'boot'
+        node['available'] = 'true'
+        node['exclusive'] = 'false'
+        node['hardware_types'] = [HardwareType({'name': 'plab-pc'}), HardwareType({'name': 'pc'})]
+        node['pl_initscripts'] = [{'name': 'script'}]
+        node['location'] = Location({'longitude': '2.3', 'latitude': '48.8', 'country': 'unknown'})
+        node['granularity'] = Granularity({'grain': 1800})
+        node['interfaces'] = [Interface({'component_id': 'urn:publicid:IDN+plc+interface+node%d:eth0' % i,
+                                         'ipv4': '10.0.0.%d' % i})]
+        node['tags'] = [PLTag({'tagname': 'arch', 'value': 'x86_64'})]
+        yield node
+
+class TestNodeStream(unittest.TestCase):
+
+    def make_rspec(self, version):
+        version_manager = VersionManager()
+        rspec = RSpec(version=version_manager._get_version(version, '1' if version == 'SFA' else '2', 'ad'))
+        rspec.xml.set('generated', '2014-01-01T00:00:00Z')
+        rspec.xml.set('expires', '2014-01-01T01:00:00Z')
+        return rspec
+
+    def compare(self, version, count):
+        expected = self.make_rspec(version)
+        expected.version.add_nodes(list(make_nodes(count)))
+        expected.version.add_leases([])
+        streamed = self.make_rspec(version)
+        streamed.stream_nodes(make_nodes(count))
+        streamed.version.add_leases([])
+        self.assertEqual(streamed.toxml(), expected.toxml())
+
+    def testPGv2(self):
+        self.compare('ProtoGENI', 5)
+
+    def testSFAv1(self):
+        self.compare('SFA', 5)
+
+    def testEmpty(self):
+        self.compare('ProtoGENI', 0)
+
+    def testOnce(self):
+        rspec = self.make_rspec('ProtoGENI')
+        rspec.stream_nodes(make_nodes(2))
+        rspec.toxml()
+        self.assertRaises(ValueError, rspec.toxml)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+import time
+import threading
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+from sfa.planetlab.plshell import PlShell
+
+class FakeConfig:
+    SFA_PLC_USER = "root@test"
+    SFA_PLC_PASSWORD = "root"
+
+class TestPlShell(unittest.TestCase):
+    def setUp(self):
+        self.server = SimpleXMLRPCServer(("127.0.0.1", 0), logRequests=False)
+        self.server.register_multicall_functions()
+        self.calls = []
+        def GetPersonHrn(auth, person_id):
+            self.calls.append(person_id)
+            if person_id < 0:
+                raise Exception("no such person")
+            return "plc.site.person%d" % person_id
+        self.server.register_function(GetPersonHrn)
+        self.server.register_function(lambda auth: 3600, 'GetLeaseGranularity')
+        def GetSlices(auth, filter, fields=None):
+            self.calls.append('GetSlices')
+            return [ {'slice_id': 1, 'name': 'site_slice'} ]
+        self.server.register_function(GetSlices)
+        def GetKeys(auth, filter):
+            self.calls.append('GetKeys')
+            return []
+        self.server.register_function(GetKeys)
+        self.server.register_function(lambda auth, slice_id, fields: 1, 'UpdateSlice')
+        self.server.register_function(lambda auth, type, id, peer, peer_id: 1, 'BindObjectToPeer')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        config = FakeConfig()
+        config.SFA_PLC_URL = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        self.shell = PlShell(config)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testBatch(self):
+        batch = self.shell.batch()
+        hrns = [ batch.GetPersonHrn(i) for i in range(3) ]
+        grain = batch.GetLeaseGranularity()
+        self.assertRaises(Exception, grain.result)
+        self.assertEqual(self.calls, [])
+        batch.run()
+        self.assertEqual([ hrn.result() for hrn in hrns ],
+                         [ "plc.site.person%d" % i for i in range(3) ])
+        self.assertEqual(grain.result(), 3600)
+        self.assertEqual(self.shell.GetLeaseGranularity(), 3600)
+
+    def testFault(self):
+        batch = self.shell.batch()
+        bad = batch.GetPersonHrn(-1)
+        good = batch.GetPersonHrn(1)
+        batch.run()
+        self.assertRaises(Exception, bad.result)
+        self.assertEqual(good.result(), "plc.site.person1")
+
+    def testChunks(self):
+        batch = self.shell.batch()
+        batch.max_calls = 2
+        hrns = [ batch.GetPersonHrn(i) for i in range(5) ]
+        batch.run()
+        self.assertEqual(hrns[4].result(), "plc.site.person4")
+        self.assertEqual(self.calls, range(5))
+
+    def testCache(self):
+        self.shell.GetSlices({'name': 'site_slice', 'peer_id': None})
+        self.assertEqual(self.calls, ['GetSlices'])
+        self.shell.reset_cache()
+        slices = self.shell.GetSlices({'name': 'site_slice', 'peer_id': None})
+        # the cached result cannot be altered by the caller
+        slices[0]['name'] = 'changed'
+        slices = self.shell.GetSlices({'peer_id': None, 'name': 'site_slice'})
+        self.assertEqual(slices[0]['name'], 'site_slice')
+        self.shell.GetKeys({})
+        self.assertEqual(self.calls, ['GetSlices', 'GetSlices', 'GetKeys'])
+        # a write drops what it may change, and only that
+        self.shell.UpdateSlice(1, {'description': 'new'})
+        self.shell.GetSlices({'name': 'site_slice', 'peer_id': None})
+        self.shell.GetKeys({})
+        self.assertEqual(self.calls, ['GetSlices', 'GetSlices', 'GetKeys', 'GetSlices'])
+        # batches use the cache too
+        batch = self.shell.batch()
+        slices = batch.GetSlices({'name': 'site_slice', 'peer_id': None})
+        batch.run()
+        self.assertEqual(slices.result()[0]['slice_id'], 1)
+        self.assertEqual(len(self.calls), 4)
+        self.shell.stop_cache()
+
+    def testPeerBinding(self):
+        self.assertEqual(PlShell.method_types('BindObjectToPeer'), set())
+        self.assertEqual(PlShell.method_types('UnBindObjectFromPeer'), set())
+        self.shell.reset_cache()
+        self.shell.GetSlices({'name': 'site_slice', 'peer_id': None})
+        self.shell.GetKeys({})
+        # cached results carry peer_id, so they all go
+        self.shell.BindObjectToPeer('slice', 1, 'peer', 1)
+        self.shell.GetSlices({'name': 'site_slice', 'peer_id': None})
+        self.shell.GetKeys({})
+        self.assertEqual(self.calls, ['GetSlices', 'GetKeys', 'GetSlices', 'GetKeys'])
+        self.shell.stop_cache()
+
+    def testEndpoint(self):
+        config = FakeConfig()
+        config.SFA_PLC_URL = self.shell.get_endpoint().url
+        self.assertTrue(PlShell(config).get_endpoint() is self.shell.get_endpoint())
+        config.SFA_PLC_USER = "other@test"
+        self.assertFalse(PlShell(config).get_endpoint() is self.shell.get_endpoint())
+        # one proxy per thread
+        proxies = []
+        thread = threading.Thread(target=lambda: proxies.append(self.shell.get_proxy()))
+        thread.start()
+        thread.join()
+        self.assertTrue(self.shell.get_proxy() is self.shell.get_proxy())
+        self.assertFalse(proxies[0] is self.shell.get_proxy())
+
+    def testEndpointRefresh(self):
+        endpoint = self.shell.get_endpoint()
+        endpoint.expires = 0
+        # the next call finds the endpoint expired, and has it refreshed
+        self.assertEqual(self.shell.GetLeaseGranularity(), 3600)
+        for i in range(50):
+            if self.shell.get_endpoint() is not endpoint:
+                break
+            time.sleep(0.1)
+        self.assertFalse(self.shell.get_endpoint() is endpoint)
+        self.assertFalse(self.shell.get_endpoint().is_expired())
+        self.assertEqual(self.shell.GetLeaseGranularity(), 3600)
+        # a new config is used right away
+        self.shell.config.SFA_PLC_USER = "other@test"
+        self.assertEqual(self.shell.get_endpoint().plauth['Username'], "other@test")
+
+    def testIllegal(self):
+        self.assertRaises(Exception, self.shell.batch().DeleteEverything)
+
+if __name__ == "__main__":
+    unittest.main()
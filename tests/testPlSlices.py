@@ -0,0 +1,139 @@
+import unittest
+import threading
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sfa.planetlab.plshell import PlShell
+from sfa.planetlab.plslices import PlSlices
+from sfa.storage.model import SliverAllocation, EgreKey, init_tables
+
+class FakeConfig:
+    SFA_PLC_USER = "root@test"
+    SFA_PLC_PASSWORD = "root"
+
+class FakeApi:
+    def __init__(self):
+        engine = create_engine('sqlite://')
+        init_tables(engine)
+        self.session = sessionmaker(bind=engine)()
+    def dbsession(self):
+        return self.session
+
+class FakeDriver:
+    hrn = 'plc'
+    def __init__(self, shell):
+        self.shell = shell
+        self.api = FakeApi()
+
+class TestPlSlices(unittest.TestCase):
+    def setUp(self):
+        self.server = SimpleXMLRPCServer(("127.0.0.1", 0), logRequests=False)
+        self.server.register_multicall_functions()
+        self.calls = []
+        self.nodes = { 'node1.site': 1, 'node2.site': 2, 'node3.site': 3 }
+        self.slice_node_ids = [1, 2]
+        def node(hostname):
+            return {'node_id': self.nodes[hostname], 'hostname': hostname, 'interface_ids': []}
+        def GetNodes(auth, filter, fields=None):
+            self.calls.append('GetNodes')
+            return [ node(hostname) for hostname in sorted(self.nodes)
+                     if self.nodes[hostname] in filter or hostname in filter ]
+        self.server.register_function(GetNodes)
+        def AddSliceToNodes(auth, slice_name, hostnames):
+            self.calls.append('AddSliceToNodes')
+            self.slice_node_ids += [ self.nodes[hostname] for hostname in hostnames ]
+            return 1
+        self.server.register_function(AddSliceToNodes)
+        def DeleteSliceFromNodes(auth, slice_name, hostnames):
+            self.calls.append('DeleteSliceFromNodes')
+            for hostname in hostnames:
+                self.slice_node_ids.remove(self.nodes[hostname])
+            return 1
+        self.server.register_function(DeleteSliceFromNodes)
+        # the slices in PLC, and their egre_key tags
+        self.plc_slices = [ {'slice_id': 1, 'name': 'site_old'} ]
+        self.tags = [ {'slice_id': 1, 'value': '1'} ]
+        def GetSlices(auth, filter, fields=None):
+            self.calls.append('GetSlices')
+            if isinstance(filter, dict):
+                return self.plc_slices
+            return [ {'node_ids': self.slice_node_ids} ]
+        self.server.register_function(GetSlices)
+        def GetSliceTags(auth, filter, fields=None):
+            self.calls.append('GetSliceTags')
+            return self.tags
+        self.server.register_function(GetSliceTags)
+        self.keys = { 1: ['key1'] }
+        def GetKeys(auth, filter, fields=None):
+            self.calls.append('GetKeys')
+            return [ {'person_id': person_id, 'key': key}
+                     for person_id in filter['person_id'] for key in self.keys.get(person_id, []) ]
+        self.server.register_function(GetKeys)
+        def AddPersonKey(auth, person_id, key):
+            self.calls.append('AddPersonKey')
+            self.keys.setdefault(person_id, []).append(key['key'])
+            return 1
+        self.server.register_function(AddPersonKey)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        config = FakeConfig()
+        config.SFA_PLC_URL = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        self.driver = FakeDriver(PlShell(config))
+        self.slices = PlSlices(self.driver)
+        EgreKey.populated = False
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def rspec_nodes(self, hostnames):
+        return [ {'component_name': hostname, 'client_id': hostname.split('.')[0],
+                  'component_id': 'urn:publicid:IDN+plc:site+node+%s' % hostname.split('.')[0]}
+                 for hostname in hostnames ]
+
+    def testVerifySliceNodes(self):
+        slice = {'slice_id': 10, 'name': 'site_slice', 'node_ids': [1, 2]}
+        nodes = self.slices.verify_slice_nodes('urn:publicid:IDN+plc:site+slice+slice', slice,
+                                               self.rspec_nodes(['node2.site', 'node3.site']))
+        self.assertEqual(sorted([ node['node_id'] for node in nodes ]), [2, 3])
+        self.assertEqual(sorted(self.slice_node_ids), [2, 3])
+        # the resulting nodes are known without reading the slice again
+        self.assertFalse('GetSlices' in self.calls)
+        self.assertEqual(self.driver.api.session.query(SliverAllocation).count(), 2)
+
+    def testVerifySliceNodesUnchanged(self):
+        slice = {'slice_id': 10, 'name': 'site_slice', 'node_ids': [1, 2]}
+        nodes = self.slices.verify_slice_nodes('urn:publicid:IDN+plc:site+slice+slice', slice,
+                                               self.rspec_nodes(['node1.site', 'node2.site']))
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(self.calls, ['GetNodes'])
+
+    def testVerifyKeys(self):
+        self.slices.verify_keys({1: {'keys': ['key1', 'key2']}, 2: {'keys': ['key3']}})
+        self.assertEqual(self.keys, {1: ['key1', 'key2'], 2: ['key3']})
+        self.assertEqual(self.calls, ['GetKeys', 'AddPersonKey', 'AddPersonKey'])
+
+    def testEgreKey(self):
+        slice = {'slice_id': 2, 'name': 'site_slice'}
+        self.assertEqual(self.slices.get_egre_key(slice), '2')
+        # the pool is seeded from PLC
+        record = self.driver.api.session.query(EgreKey).get(1)
+        self.assertEqual(record.slice_name, 'site_old')
+        self.assertEqual(self.calls, ['GetSlices', 'GetSliceTags'])
+        self.assertEqual(self.slices.get_egre_key(slice), '2')
+        self.assertEqual(len(self.calls), 2)
+
+    def testEgreKeyExhausted(self):
+        self.plc_slices = [ {'slice_id': key, 'name': 'slice%d' % key}
+                            for key in range(1, 256) ]
+        self.tags = [ {'slice_id': key, 'value': str(key)} for key in range(1, 256) ]
+        slice = {'slice_id': 300, 'name': 'site_slice'}
+        self.assertRaises(KeyError, self.slices.get_egre_key, slice)
+        # slice7 gets deleted in PLC directly
+        self.plc_slices = [ plc_slice for plc_slice in self.plc_slices if plc_slice['slice_id'] != 7 ]
+        self.tags = [ tag for tag in self.tags if tag['slice_id'] != 7 ]
+        self.assertEqual(self.slices.get_egre_key(slice), '7')
+
+if __name__ == "__main__":
+    unittest.main()
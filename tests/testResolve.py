@@ -0,0 +1,90 @@
+import unittest
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sfa.util.faults import RecordNotFound
+from sfa.storage.model import RegAuthority, RegUser, init_tables
+from sfa.server.interface import Interface, RoutingTable
+from sfa.managers.registry_manager import RegistryManager
+
+class FakeConfig:
+    SFA_REGISTRY_PEER_TIMEOUT = 1
+
+# routes like sfa.server.interface.Interfaces, without a config file
+class FakeRegistries(dict):
+    def best_match(self, hrn):
+        return RoutingTable(self.keys()).best_match(hrn)
+
+class FakeRegistry:
+    def __init__(self, hrn, delay=0, error=None):
+        self.hrn = hrn
+        self.delay = delay
+        self.error = error
+    def Resolve(self, xrns, credential):
+        time.sleep(self.delay)
+        if self.error:
+            raise Exception(self.error)
+        return [ {'hrn': xrn, 'type': 'user', 'peer': self.hrn} for xrn in xrns ]
+
+class FakeApi:
+    def __init__(self, dbsession, peers):
+        self.hrn = 'plc'
+        self._dbsession = dbsession
+        self.peers = peers
+        self.registries = FakeRegistries()
+        for hrn in ['plc'] + peers.keys():
+            self.registries[hrn] = Interface(hrn, 'localhost', 12345)
+        self.credentials = 0
+    def dbsession(self):
+        return self._dbsession
+    def getCredential(self):
+        self.credentials += 1
+        return 'credential'
+    def server_proxy(self, interface, credential, timeout=30):
+        return self.peers[interface.hrn]
+
+class TestResolve(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        init_tables(engine)
+        self.dbsession = sessionmaker(bind=engine)()
+        self.dbsession.add(RegAuthority(hrn='plc'))
+        self.dbsession.add(RegUser(hrn='plc.user'))
+        self.dbsession.commit()
+        self.manager = RegistryManager(FakeConfig())
+
+    def hrns(self, records):
+        return sorted([ record['hrn'] for record in records ])
+
+    def testParallel(self):
+        api = FakeApi(self.dbsession, {'ple': FakeRegistry('ple', delay=0.5),
+                                       'plj': FakeRegistry('plj', delay=0.5)})
+        start = time.time()
+        records = self.manager.Resolve(api, ['plc.user', 'ple.a', 'ple.b', 'plj.c'])
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(self.hrns(records), ['plc.user', 'ple.a', 'ple.b', 'plj.c'])
+        self.assertEqual(api.credentials, 1)
+
+    def testPartial(self):
+        api = FakeApi(self.dbsession, {'ple': FakeRegistry('ple'),
+                                       'plj': FakeRegistry('plj', error='unreachable'),
+                                       'plk': FakeRegistry('plk', delay=2)})
+        records = self.manager.Resolve(api, ['plc.user', 'ple.a', 'plj.b', 'plk.c'])
+        self.assertEqual(self.hrns(records), ['plc.user', 'ple.a'])
+
+    def testNotFound(self):
+        api = FakeApi(self.dbsession, {'plj': FakeRegistry('plj', error='unreachable')})
+        try:
+            self.manager.Resolve(api, ['plj.b'])
+            self.fail("Resolve should have failed")
+        except RecordNotFound, e:
+            self.assertTrue('unreachable' in str(e))
+
+    def testLocalOnly(self):
+        api = FakeApi(self.dbsession, {})
+        records = self.manager.Resolve(api, 'plc.user')
+        self.assertEqual(self.hrns(records), ['plc.user'])
+        self.assertEqual(api.credentials, 0)
+
+if __name__ == "__main__":
+    unittest.main()
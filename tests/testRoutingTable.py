@@ -0,0 +1,49 @@
+import unittest
+import os
+import time
+import tempfile
+from sfa.server.interface import RoutingTable, Interfaces, Interface
+
+REGISTRIES = """<?xml version="1.0" encoding="UTF-8"?>
+<registries>
+  <registry hrn="%s" addr="localhost" port="12345"/>
+</registries>
+"""
+
+class TestRoutingTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = RoutingTable(['plc', 'plc.site', 'ple', 'ple.inria.lab'])
+
+    def testBestMatch(self):
+        self.assertEqual(self.table.best_match('plc'), 'plc')
+        self.assertEqual(self.table.best_match('plc.other.user'), 'plc')
+        self.assertEqual(self.table.best_match('plc.site.slice'), 'plc.site')
+        self.assertEqual(self.table.best_match('ple.inria.lab.a.b.c'), 'ple.inria.lab')
+        # components, not strings
+        self.assertEqual(self.table.best_match('plcx.user'), None)
+        self.assertEqual(self.table.best_match('ple.inria.labx'), 'ple')
+        self.assertEqual(self.table.best_match('other'), None)
+
+    def testEmpty(self):
+        self.assertEqual(RoutingTable([]).best_match('plc'), None)
+
+    def testInterfaces(self):
+        (fd, conf_file) = tempfile.mkstemp()
+        os.write(fd, REGISTRIES % 'ple')
+        os.close(fd)
+        try:
+            interfaces = Interfaces(conf_file)
+            self.assertEqual(interfaces.best_match('ple.inria'), 'ple')
+            self.assertEqual(interfaces.best_match('plc.site'), None)
+            interfaces['plc'] = Interface('plc', 'localhost', 12345)
+            self.assertEqual(interfaces.best_match('plc.site'), 'plc')
+            self.assertFalse(interfaces.is_stale())
+            # make sure the mtime changes
+            os.utime(conf_file, (time.time() + 10, time.time() + 10))
+            self.assertTrue(interfaces.is_stale())
+        finally:
+            os.remove(conf_file)
+
+if __name__ == "__main__":
+    unittest.main()
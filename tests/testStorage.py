@@ -1,14 +1,88 @@
 import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 from sfa.trust.gid import *
 from sfa.util.config import *
-from sfa.storage.model import RegRecord
+from sfa.util.faults import SfaInvalidArgument
+from sfa.storage.model import RegRecord, SliverAllocation, EgreKey, init_tables
 
 class TestStorage(unittest.TestCase):
     def setUp(self):
-        pass
+        engine = create_engine('sqlite://')
+        init_tables(engine)
+        self.dbsession = sessionmaker(bind=engine)()
+        EgreKey.populated = False
 
     def testCreate(self):
         r = RegRecord(type='authority',hrn='foo.bar')
 
+    def allocations(self):
+        return dict( (record.sliver_id, (record.client_id, record.allocation_state))
+                     for record in self.dbsession.query(SliverAllocation) )
+
+    def testSyncAllocations(self):
+        SliverAllocation(sliver_id='sliver1', client_id='old',
+                         allocation_state='geni_provisioned').sync(self.dbsession)
+        records = [ SliverAllocation(sliver_id='sliver%d' % i, client_id='client%d' % i,
+                                     allocation_state='geni_allocated') for i in range(3) ]
+        SliverAllocation.sync_allocations(records, self.dbsession)
+        self.assertEqual(self.allocations(),
+                         dict( ('sliver%d' % i, ('client%d' % i, 'geni_allocated')) for i in range(3) ))
+
+    def testSetAndDeleteAllocations(self):
+        SliverAllocation.sync_allocations([SliverAllocation(sliver_id='sliver1', client_id='client1',
+                                                            allocation_state='geni_allocated')],
+                                          self.dbsession)
+        SliverAllocation.set_allocations(['sliver1', 'sliver2'], 'geni_provisioned', self.dbsession)
+        self.assertEqual(self.allocations(), {'sliver1': ('client1', 'geni_provisioned'),
+                                              'sliver2': (None, 'geni_provisioned')})
+        SliverAllocation.delete_allocations(['sliver1'], self.dbsession)
+        self.assertEqual(self.allocations().keys(), ['sliver2'])
+        self.assertRaises(SfaInvalidArgument, SliverAllocation.set_allocations,
+                          ['sliver1'], 'geni_unknown', self.dbsession)
+        self.assertRaises(SfaInvalidArgument, SliverAllocation,
+                          sliver_id='sliver3', allocation_state='geni_unknown')
+
+    def testEgreKeys(self):
+        self.assertFalse(EgreKey.is_populated(self.dbsession))
+        EgreKey.populate(self.dbsession, {1: 'site_old'})
+        self.assertTrue(EgreKey.is_populated(self.dbsession))
+        self.assertEqual(self.dbsession.query(EgreKey).get(1).slice_name, 'site_old')
+        self.assertEqual(EgreKey.allocate('site_old', self.dbsession), 1)
+        self.assertEqual(EgreKey.allocate('site_slice', self.dbsession), 2)
+        # a slice keeps its key
+        self.assertEqual(EgreKey.allocate('site_slice', self.dbsession), 2)
+        EgreKey.release('site_old', self.dbsession)
+        self.assertEqual(EgreKey.allocate('site_other', self.dbsession), 1)
+
+    def testEgreKeysReconcile(self):
+        used = dict( (key, 'slice%d' % key) for key in range(1, 256) )
+        EgreKey.populate(self.dbsession, used)
+        self.assertRaises(KeyError, EgreKey.allocate, 'site_slice', self.dbsession)
+        # slices keep their key as long as it is tagged in PLC
+        slice_names = set([ 'slice%d' % key for key in range(1, 256) ])
+        EgreKey.reconcile(self.dbsession, used, slice_names)
+        self.assertRaises(KeyError, EgreKey.allocate, 'site_slice', self.dbsession)
+        # slice7 was deleted in PLC, slice9 moved to key 8
+        del used[7]
+        del used[9]
+        used[8] = 'slice9'
+        slice_names.remove('slice7')
+        slice_names.remove('slice8')
+        EgreKey.reconcile(self.dbsession, used, slice_names)
+        self.assertEqual(EgreKey.allocate('slice9', self.dbsession), 8)
+        self.assertEqual(EgreKey.allocate('site_slice', self.dbsession), 7)
+        self.assertEqual(EgreKey.allocate('site_other', self.dbsession), 9)
+        self.assertRaises(KeyError, EgreKey.allocate, 'site_last', self.dbsession)
+
+    def testEgreKeysInTheMaking(self):
+        EgreKey.populate(self.dbsession, {})
+        self.assertEqual(EgreKey.allocate('site_slice', self.dbsession), 1)
+        # not tagged in PLC yet, but the slice is there
+        EgreKey.reconcile(self.dbsession, {}, set(['site_slice']))
+        self.assertEqual(EgreKey.allocate('site_other', self.dbsession), 2)
+        EgreKey.reconcile(self.dbsession, {}, set())
+        self.assertEqual(EgreKey.allocate('site_last', self.dbsession), 1)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,229 @@
+import unittest
+import os
+import ssl
+import time
+import shutil
+import httplib
+import tempfile
+import threading
+import xmlrpclib
+from OpenSSL import crypto, SSL
+from sfa.util.genicode import GENICODE
+from sfa.server.threadedserver import ApiPool, ConnectionReader, \
+    SecureXMLRpcRequestHandler, ThreadedServer
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class FakeApi:
+    def __init__(self, release=None):
+        self.release = release
+        self.server_stats = None
+        self.resets = 0
+        self.closed = 0
+    def reset(self, peer_cert, remote_addr):
+        self.resets += 1
+    def close_dbsession(self):
+        self.closed += 1
+    def handle(self, remote_addr, request, method_map):
+        (params, method) = xmlrpclib.loads(request)
+        if method == 'wait':
+            self.release.wait(10)
+        return xmlrpclib.dumps((method,), methodresponse=True)
+    def prepare_response(self, fault):
+        return xmlrpclib.dumps(fault, methodresponse=True)
+
+class FakeGeneric:
+    def make_api(self, **kwargs):
+        return FakeApi()
+
+class FakeServer:
+    interface = 'aggregate'
+    key_file = None
+    cert_file = None
+    def get_pool_stats(self):
+        return {}
+
+# hands out a new api object for each connection
+class FakeApiPool:
+    def __init__(self, release):
+        self.release = release
+        self.gets = 0
+    def get(self, server, cache, peer_cert, remote_addr):
+        self.gets += 1
+        return FakeApi(self.release)
+    def put(self, api):
+        pass
+
+class FakeConnection:
+    def __init__(self, chunks):
+        self.chunks = chunks
+    def recv(self, size):
+        if not self.chunks:
+            raise SSL.ZeroReturnError()
+        return self.chunks.pop(0)
+
+class TestApiPool(unittest.TestCase):
+    def testReuse(self):
+        pool = ApiPool()
+        pool.generic = FakeGeneric()
+        server = FakeServer()
+        api1 = pool.get(server, None, None, None)
+        api2 = pool.get(server, None, None, None)
+        self.assertFalse(api1 is api2)
+        self.assertEqual(api1.server_stats, server.get_pool_stats)
+        pool.put(api1)
+        self.assertEqual(api1.closed, 1)
+        self.assertTrue(pool.get(server, None, None, None) is api1)
+        self.assertEqual(api1.resets, 2)
+        self.assertEqual(pool.created, 2)
+
+class TestConnectionReader(unittest.TestCase):
+    def testRead(self):
+        reader = ConnectionReader(FakeConnection(['POST / HTTP/1.1\r\nHo', 'st: a\r\n\r\nbody', 'POST']))
+        self.assertEqual(reader.readline(65537), 'POST / HTTP/1.1\r\n')
+        self.assertEqual(reader.readline(), 'Host: a\r\n')
+        self.assertEqual(reader.readline(), '\r\n')
+        self.assertEqual(reader.buffered(), 4)
+        self.assertEqual(reader.read(4), 'body')
+        self.assertEqual(reader.buffered(), 0)
+        # a line without an end, then the connection is closed
+        self.assertEqual(reader.readline(2), 'PO')
+        self.assertEqual(reader.readline(), 'ST')
+        self.assertEqual(reader.read(10), '')
+
+class TestThreadedServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # recent openssl versions reject small keys
+        key = crypto.PKey()
+        key.generate_key(crypto.TYPE_RSA, 2048)
+        cert = crypto.X509()
+        cert.get_subject().CN = "server"
+        cert.set_issuer(cert.get_subject())
+        cert.gmtime_adj_notBefore(0)
+        cert.gmtime_adj_notAfter(3600)
+        cert.set_pubkey(key)
+        cert.sign(key, 'sha256')
+        self.key_file = os.path.join(self.directory, "server.pkey")
+        self.cert_file = os.path.join(self.directory, "server.cert")
+        open(self.key_file, 'w').write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+        open(self.cert_file, 'w').write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+        self.server = ThreadedServer(('127.0.0.1', 0), SecureXMLRpcRequestHandler,
+                                     self.key_file, self.cert_file, logRequests=False)
+        self.release = threading.Event()
+        self.server.api_pool = FakeApiPool(self.release)
+        self.server.keepAliveTimeout = 5
+        self.server.keepAliveMaxRequests = 100
+        self.server.idleTimeout = 0.2
+
+    def tearDown(self):
+        self.release.set()
+        # let the workers go, rather than have them around at exit
+        self.server.minThreads = 0
+        wait_until(lambda: getattr(self.server, 'threads', 0) == 0)
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    # start the pool, and accept that many connections
+    def serve(self, connections):
+        self.server.start_pool()
+        def accept():
+            for i in range(connections):
+                self.server.handle_request()
+        thread = threading.Thread(target=accept)
+        thread.setDaemon(True)
+        thread.start()
+
+    def connect(self):
+        context = ssl._create_unverified_context()
+        context.load_cert_chain(self.cert_file, self.key_file)
+        return httplib.HTTPSConnection('127.0.0.1', self.server.server_address[1],
+                                       context=context, timeout=10)
+
+    def call(self, conn, method):
+        conn.request('POST', '/', xmlrpclib.dumps((), method), {'Content-Type': 'text/xml'})
+        response = conn.getresponse()
+        return (response, xmlrpclib.loads(response.read())[0][0])
+
+    # make a call from another thread, the outcome ends up in results
+    def start_call(self, method, results):
+        def call():
+            conn = self.connect()
+            try:
+                results.append(self.call(conn, method)[1])
+            except Exception, e:
+                results.append(e)
+            conn.close()
+        thread = threading.Thread(target=call)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+    def testKeepAlive(self):
+        self.server.minThreads = self.server.maxThreads = 1
+        self.server.keepAliveMaxRequests = 2
+        self.serve(1)
+        conn = self.connect()
+        (response, result) = self.call(conn, 'first')
+        self.assertEqual(result, 'first')
+        self.assertEqual(response.getheader('connection'), None)
+        sock = conn.sock
+        (response, result) = self.call(conn, 'second')
+        self.assertEqual(result, 'second')
+        self.assertTrue(sock is not None)
+        # the server is done with this connection
+        self.assertEqual(response.getheader('connection'), 'close')
+        self.assertEqual(conn.sock, None)
+        self.assertEqual(self.server.api_pool.gets, 1)
+        conn.close()
+
+    def testGrowAndRetire(self):
+        self.server.minThreads = 1
+        self.server.maxThreads = 2
+        self.serve(2)
+        results = []
+        threads = [self.start_call('wait', results)]
+        self.assertTrue(wait_until(lambda: self.server.busy == 1))
+        self.assertEqual(self.server.threads, 1)
+        threads.append(self.start_call('wait', results))
+        self.assertTrue(wait_until(lambda: self.server.busy == 2))
+        self.assertEqual(self.server.threads, 2)
+        self.release.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(results, ['wait', 'wait'])
+        # the extra worker goes away once idle
+        self.assertTrue(wait_until(lambda: self.server.threads == 1))
+        stats = self.server.get_pool_stats(reset=True)
+        self.assertEqual((stats['served'], stats['max_busy']), (2, 2))
+        self.assertEqual(self.server.get_pool_stats()['served'], 0)
+
+    def testServerBusy(self):
+        self.server.minThreads = self.server.maxThreads = 1
+        self.server.queueSize = 1
+        self.serve(3)
+        results = []
+        first = self.start_call('wait', results)
+        self.assertTrue(wait_until(lambda: self.server.busy == 1))
+        queued = self.start_call('queued', results)
+        self.assertTrue(wait_until(lambda: self.server.requests.qsize() == 1))
+        rejected = []
+        self.start_call('rejected', rejected).join(10)
+        self.assertEqual(len(rejected), 1)
+        self.assertTrue(isinstance(rejected[0], xmlrpclib.Fault))
+        self.assertEqual(rejected[0].faultCode, GENICODE.BUSY)
+        # the idle connection gives its thread up to the queued request
+        self.release.set()
+        first.join(10)
+        queued.join(10)
+        self.assertEqual(sorted(results), ['queued', 'wait'])
+        self.assertEqual(self.server.get_pool_stats()['rejected'], 1)
+
+if __name__ == "__main__":
+    unittest.main()
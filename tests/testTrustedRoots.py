@@ -0,0 +1,50 @@
+import unittest
+import shutil
+import tempfile
+from sfa.trust.certificate import Keypair
+from sfa.trust.gid import GID
+from sfa.trust.trustedroots import *
+
+class TestTrustedRoots(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.roots = TrustedRoots(self.dir)
+        self.roots.check_interval = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def createGID(self, hrn):
+        keys = Keypair(create=True)
+        gid = GID(subject=hrn, uuid=1, hrn=hrn)
+        gid.set_pubkey(keys)
+        gid.set_issuer(keys, hrn)
+        gid.encode()
+        gid.sign()
+        return gid
+
+    def testEmpty(self):
+        self.assertEqual(self.roots.get_list(), [])
+
+    def testIndex(self):
+        gid = self.createGID("plc")
+        self.roots.add_gid(gid)
+        self.assertEqual(len(self.roots.get_list()), 1)
+        index = self.roots.get_index()
+        self.assertEqual(len(index.get_by_subject(gid.x509.get_subject())), 1)
+        self.assertEqual(list(index), self.roots.get_list())
+        self.assertEqual(len(index), 1)
+
+    def testReload(self):
+        self.roots.add_gid(self.createGID("plc"))
+        index = self.roots.get_index()
+        self.assertTrue(self.roots.get_index() is index)
+        self.roots.add_gid(self.createGID("ple"))
+        self.assertEqual(len(self.roots.get_file_list()), 2)
+        self.assertNotEqual(self.roots.get_fingerprint(), index.fingerprint)
+
+    def testShared(self):
+        self.assertTrue(shared_trusted_roots(self.dir) is shared_trusted_roots(self.dir + "/"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from sfa.util.faults import CertMissingParent
+from sfa.trust.certificate import *
+from sfa.trust.trustedroots import TrustedRootsIndex
+
+class TestVerifyChain(unittest.TestCase):
+    def createCert(self, subject, issuer=None, issuer_keys=None, isCA=False):
+        keys = Keypair(create=True)
+        cert = Certificate(subject=subject)
+        cert.set_pubkey(keys)
+        cert.set_is_ca(isCA)
+        if issuer:
+            cert.set_issuer(issuer_keys, cert=issuer)
+            cert.set_parent(issuer)
+        else:
+            cert.set_issuer(keys, subject)
+        cert.sign()
+        return cert, keys
+
+    def setUp(self):
+        self.root, self.root_keys = self.createCert("root", isCA=True)
+        self.other, _ = self.createCert("other", isCA=True)
+        self.site, self.site_keys = self.createCert("site", self.root, self.root_keys, isCA=True)
+        self.user, _ = self.createCert("user", self.site, self.site_keys)
+
+    def testVerify(self):
+        self.user.verify_chain([self.other, self.root])
+        self.assertTrue((self.site.get_fingerprint(), self.root.get_fingerprint())
+                        in verified_signatures)
+        # a second time goes through the cache
+        self.user.verify_chain([self.other, self.root])
+
+    def testIssuedBy(self):
+        self.assertTrue(self.site.is_issued_by(self.root))
+        self.assertFalse(self.site.is_issued_by(self.other))
+
+    def testIndex(self):
+        index = TrustedRootsIndex(gid_list=[self.other, self.root])
+        self.assertEqual(index.get_by_subject(self.site.x509.get_issuer()), [self.root])
+        self.assertTrue(self.site.verify_chain(index) is self.root)
+        self.user.verify_chain(index)
+        self.assertRaises(CertMissingParent, self.user.verify_chain,
+                          TrustedRootsIndex(gid_list=[self.other]))
+
+    def testUntrusted(self):
+        self.assertRaises(CertMissingParent, self.user.verify_chain, [self.other])
+
+if __name__ == "__main__":
+    unittest.main()
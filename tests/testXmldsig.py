@@ -0,0 +1,154 @@
+import unittest
+import os
+import tempfile
+import datetime
+from sfa.util.faults import CredentialNotVerifiable
+from sfa.trust.certificate import Keypair
+from sfa.trust.gid import GID
+from sfa.trust.credential import Credential, signature_template
+from sfa.trust import xmldsig
+
+class TestXmldsig(unittest.TestCase):
+    def createGID(self, hrn, urn, issuer=None, issuer_keys=None, isCA=False):
+        keys = Keypair(create=True)
+        gid = GID(subject=hrn, uuid=1, urn=urn)
+        gid.set_pubkey(keys)
+        gid.set_is_ca(isCA)
+        if issuer:
+            gid.set_issuer(issuer_keys, cert=issuer)
+            gid.set_parent(issuer)
+        else:
+            gid.set_issuer(keys, hrn)
+        gid.encode()
+        gid.sign()
+        return gid, keys
+
+    def setUp(self):
+        self.root, self.root_keys = self.createGID("plc", "urn:publicid:IDN+plc+authority+sa", isCA=True)
+        self.site, self.site_keys = self.createGID("plc.site", "urn:publicid:IDN+plc:site+authority+sa",
+                                                   self.root, self.root_keys, isCA=True)
+        self.user, self.user_keys = self.createGID("plc.site.user", "urn:publicid:IDN+plc:site+user+user",
+                                      self.site, self.site_keys)
+        self.slice, _ = self.createGID("plc.site.slice", "urn:publicid:IDN+plc:site+slice+slice",
+                                       self.site, self.site_keys)
+        self.expiration = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(seconds=3600)
+
+    def createCredential(self, signer=None):
+        cred = Credential()
+        cred.set_gid_caller(self.user)
+        cred.set_gid_object(self.slice)
+        cred.set_expiration(self.expiration)
+        cred.set_privileges("embed:1, bind:1")
+        cred.encode()
+        cred.set_issuer_keys(self.site_keys, self.site)
+        cred.sign(signer)
+        return cred
+
+    def testSign(self):
+        cred = self.createCredential()
+        root = xmldsig.parse(cred.save_to_string())
+        signer = xmldsig.verify_signature(root, 'Sig_%s' % cred.get_refid(), [self.root])
+        self.assertEqual(signer.get_subject(), self.site.get_subject())
+        # the whole chain is advertised, signer first
+        x509_data = root.find('.//%s' % xmldsig.ds('X509Data'))
+        self.assertEqual([ x.text for x in x509_data.findall(xmldsig.ds('X509SubjectName')) ],
+                         ['CN=plc.site', 'CN=plc'])
+        self.assertEqual(cred.get_signature().get_issuer_gid().get_subject(), self.site.get_subject())
+
+    def testTampered(self):
+        cred = self.createCredential()
+        xml = cred.save_to_string().replace('<name>bind</name>', '<name>control</name>')
+        root = xmldsig.parse(xml)
+        self.assertRaises(CredentialNotVerifiable, xmldsig.verify_signature,
+                          root, 'Sig_%s' % cred.get_refid(), [self.root])
+
+    def assertNotVerifiable(self, cred, xml, trusted_certs=None):
+        def verify():
+            xmldsig.verify_signature(xmldsig.parse(xml), 'Sig_%s' % cred.get_refid(),
+                                     trusted_certs or [self.root])
+        self.assertRaises(CredentialNotVerifiable, verify)
+
+    def testMalformed(self):
+        cred = self.createCredential()
+        xml = cred.save_to_string()
+        for (old, new) in [ ('<DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>', ''),
+                            ('<DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>', '<DigestMethod/>'),
+                            ('<SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>', ''),
+                            ('<SignatureValue>', '<SignatureValue>A'),
+                            ('<SignatureValue>', '<SignatureValue>AAAA'),
+                            ('<X509Certificate>', '<X509Certificate>garbage'),
+                            ('SignedInfo>', 'Other>') ]:
+            self.assertTrue(old in xml, old)
+            self.assertNotVerifiable(cred, xml.replace(old, new))
+        self.assertNotVerifiable(cred, xml[:-20])
+
+    def testUntrusted(self):
+        cred = self.createCredential()
+        other, _ = self.createGID("other", "urn:publicid:IDN+other+authority+sa", isCA=True)
+        self.assertNotVerifiable(cred, cred.save_to_string(), [other])
+        # signed by the site, so the user cannot be the root
+        self.assertNotVerifiable(cred, cred.save_to_string(), [self.user])
+
+    def testDuplicateId(self):
+        cred = self.createCredential()
+        xml = cred.save_to_string()
+        start = xml.index('<credential ')
+        end = xml.index('</credential>') + len('</credential>')
+        # a second, unsigned credential with the same xml:id
+        forged = xml[start:end].replace('<name>bind</name>', '<name>control</name>')
+        self.assertNotVerifiable(cred, xml[:end] + forged + xml[end:])
+
+    def testDelegated(self):
+        directory = tempfile.mkdtemp()
+        try:
+            files = {}
+            for (name, gid, keys) in [ ('root', self.root, self.root_keys),
+                                       ('user', self.user, self.user_keys) ]:
+                files[name] = os.path.join(directory, name + '.gid')
+                gid.save_to_file(files[name], save_parents=True)
+                keys.save_to_file(os.path.join(directory, name + '.pkey'))
+            delegee, _ = self.createGID("plc.site.delegee", "urn:publicid:IDN+plc:site+user+delegee",
+                                        self.site, self.site_keys)
+            files['delegee'] = os.path.join(directory, 'delegee.gid')
+            delegee.save_to_file(files['delegee'], save_parents=True)
+            cred = self.createCredential()
+            cred.get_privileges().delegate_all_privileges(True)
+            cred.encode()
+            cred.sign()
+            delegated = cred.delegate(files['delegee'], os.path.join(directory, 'user.pkey'), files['user'])
+            xml = delegated.save_to_string(save_parents=True)
+            verifiers = [ 'lxml' ]
+            if delegated.xmlsec_path:
+                verifiers.append('xmlsec1')
+            # both engines agree, on the good chain and on a tampered one
+            for verifier in verifiers:
+                self.assertTrue(Credential(string=xml).verify([files['root']], verifier=verifier))
+                tampered = Credential(string=xml.replace('<name>bind</name>', '<name>control</name>', 1))
+                self.assertRaises(CredentialNotVerifiable, tampered.verify, [files['root']], verifier=verifier)
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def testSameAsXmlsec(self):
+        cred = self.createCredential('lxml')
+        if not cred.xmlsec_path:
+            return
+        other = self.createCredential('xmlsec1')
+        # rsa signatures are deterministic
+        for tag in ['DigestValue', 'SignatureValue', 'X509Certificate']:
+            values = [ [ x.text.strip() for x in xmldsig.parse(c.save_to_string()).iter(xmldsig.ds(tag)) ]
+                       for c in [cred, other] ]
+            self.assertEqual(values[0], values[1])
+
+    def testTemplate(self):
+        # as used by speaksfor_util.create_speaks_for
+        xml = '<?xml version="1.0" encoding="UTF-8"?>\n<signed-credential>\n' + \
+              '<credential xml:id="ref0"><type>abac</type></credential>\n' + \
+              '<signatures>' + signature_template % ('ref0', 'ref0') + '</signatures>\n' + \
+              '</signed-credential>\n'
+        signed = xmldsig.sign(xml, 'Sig_ref0', self.site_keys, [self.site, self.root])
+        xmldsig.verify_signature(xmldsig.parse(signed), 'Sig_ref0', [self.root])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+#
+# measure what geni_compressed costs and saves on an advertisement
+#
+# for each zlib level, reports the bytes on the wire (as sent over
+# XML-RPC, i.e. base64-encoded), and the CPU time to compress, to
+# decompress, and to serve the same rspec again from the compression cache
+#
+# usage: bench_compression.py [-n nodes] [-r repeat] [rspec_file]
+# e.g.   sfi.py resources -o /tmp/ad.rspec; bench_compression.py /tmp/ad.rspec
+
+import time
+from optparse import OptionParser
+
+from sfa.rspecs.rspec import RSpec
+from sfa.rspecs.version_manager import VersionManager
+from sfa.rspecs.elements.node import NodeElement
+from sfa.rspecs.elements.hardware_type import HardwareType
+from sfa.rspecs.elements.location import Location
+from sfa.rspecs.elements.interface import Interface
+from sfa.rspecs.compression import compress, decompress, CompressionCache
+
+# an advertisement that looks like what a PlanetLab aggregate returns
+def make_rspec(count):
+    version = VersionManager()._get_version('ProtoGENI', '2', 'ad')
+    rspec = RSpec(version=version)
+    nodes = []
+    for i in range(count):
+        node = NodeElement()
+        node['component_id'] = 'urn:publicid:IDN+plc:site%d+node+node%d.site%d.org' % (i/4, i, i/4)
+        node['component_manager_id'] = 'urn:publicid:IDN+plc+authority+cm'
+        node['exclusive'] = 'false'
+        node['available'] = 'true'
+        node['hardware_types'] = [HardwareType({'name': 'plab-pc'}), HardwareType({'name': 'pc'})]
+        node['location'] = Location({'longitude': '%.4f' % (i * 0.37 % 180),
+                                     'latitude': '%.4f' % (i * 0.19 % 90), 'country': 'unknown'})
+        node['interfaces'] = [Interface({'component_id': 'urn:publicid:IDN+plc+interface+node%d:eth0' % i,
+                                         'ipv4': '10.%d.%d.%d' % (i/65536, i/256%256, i%256)})]
+        node['tags'] = [{'tagname': 'arch', 'value': 'x86_64'},
+                        {'tagname': 'fcdistro', 'value': 'f22'}]
+        nodes.append(node)
+    rspec.version.add_nodes(nodes)
+    return rspec.toxml()
+
+def timed(repeat, function, *args):
+    start = time.time()
+    for i in range(repeat):
+        result = function(*args)
+    return (result, (time.time() - start) / repeat * 1000)
+
+def main():
+    parser = OptionParser(usage="%prog [options] [rspec_file]")
+    parser.add_option("-n", "--nodes", type="int", default=1000,
+                      help="number of nodes in the generated advertisement [default %default]")
+    parser.add_option("-r", "--repeat", type="int", default=10,
+                      help="number of runs to average [default %default]")
+    (options, args) = parser.parse_args()
+    if args:
+        rspec = open(args[0]).read()
+    else:
+        rspec = make_rspec(options.nodes)
+
+    print "plain rspec: %d bytes" % len(rspec)
+    print "%5s %10s %7s %12s %14s %12s" % \
+        ('level', 'bytes', 'ratio', 'compress ms', 'decompress ms', 'cached ms')
+    for level in [1, 6, 9]:
+        (blob, compress_ms) = timed(options.repeat, compress, rspec, level)
+        (_, decompress_ms) = timed(options.repeat, decompress, blob)
+        cache = CompressionCache()
+        cache.compress(rspec, level)
+        (_, cached_ms) = timed(options.repeat, cache.compress, rspec, level)
+        print "%5d %10d %6.1f%% %12.1f %14.1f %12.1f" % \
+            (level, len(blob), 100.0 * len(blob) / len(rspec), compress_ms, decompress_ms, cached_ms)
+
+if __name__ == '__main__':
+    main()
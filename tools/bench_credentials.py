@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# compare the credential signature verifiers on delegated credential chains
+#
+# a self-signed authority issues a credential to a first user, who
+# delegates it to a second user, and so on; the resulting credential
+# has depth+1 signatures and is verified repeatedly by each engine
+#
+# usage: bench_credentials.py [-d depth] [-r rounds] [-v verifier]...
+
+import os
+import shutil
+import tempfile
+import datetime
+import time
+from optparse import OptionParser
+
+from sfa.trust.certificate import Keypair
+from sfa.trust.gid import GID
+from sfa.trust.credential import Credential, signature_verifiers
+
+def create_gid(tmpdir, name, urn, issuer_keys=None, issuer_gid=None, CA=False):
+    keys = Keypair(create=True)
+    gid = GID(subject=name, uuid=1, urn=urn)
+    gid.set_pubkey(keys)
+    gid.set_intermediate_ca(CA)
+    if issuer_keys:
+        gid.set_issuer(issuer_keys, str(issuer_gid.get_issuer()))
+        gid.set_parent(issuer_gid)
+    else:
+        gid.set_issuer(keys, name)
+    gid.encode()
+    gid.sign()
+    gid_file = os.path.join(tmpdir, name + ".gid")
+    key_file = os.path.join(tmpdir, name + ".pkey")
+    gid.save_to_file(gid_file, save_parents=True)
+    keys.save_to_file(key_file)
+    return gid, keys, gid_file, key_file
+
+def create_chain(tmpdir, depth):
+    auth_gid, auth_keys, auth_gid_file, auth_key_file = \
+        create_gid(tmpdir, "bench", "urn:publicid:IDN+bench+authority+sa", CA=True)
+    slice_gid, _, _, _ = create_gid(tmpdir, "bench.slice", "urn:publicid:IDN+bench+slice+slice",
+                                    auth_keys, auth_gid)
+    issuer_key_file, issuer_gid_file = auth_key_file, auth_gid_file
+    parent = None
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+    for i in range(depth + 1):
+        name = "bench.user%d" % i
+        user_gid, _, user_gid_file, user_key_file = \
+            create_gid(tmpdir, name, "urn:publicid:IDN+bench+user+user%d" % i, auth_keys, auth_gid)
+        cred = Credential()
+        cred.set_gid_caller(user_gid)
+        cred.set_gid_object(slice_gid)
+        cred.set_expiration(expiration)
+        cred.set_privileges("refresh:1,embed:1,bind:1,control:1,info:1")
+        cred.get_privileges().delegate_all_privileges(True)
+        if parent:
+            cred.set_parent(parent)
+        cred.set_issuer_keys(issuer_key_file, issuer_gid_file)
+        cred.encode()
+        cred.sign()
+        parent = cred
+        # the owner of this credential signs the next one
+        issuer_key_file, issuer_gid_file = user_key_file, user_gid_file
+    return parent.save_to_string(save_parents=True), auth_gid_file
+
+def bench(xml, trusted, verifier, rounds):
+    # the first round also checks that this engine accepts the chain
+    Credential(string=xml).verify([trusted], verifier=verifier)
+    start = time.time()
+    for i in range(rounds):
+        Credential(string=xml).verify([trusted], verifier=verifier)
+    return (time.time() - start) / rounds
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-d", "--depth", type="int", default=3,
+                      help="number of delegations [default %default]")
+    parser.add_option("-r", "--rounds", type="int", default=50,
+                      help="verifications per engine [default %default]")
+    parser.add_option("-v", "--verifier", action="append", dest="verifiers",
+                      choices=signature_verifiers,
+                      help="engine to measure, may be repeated [default all]")
+    (options, args) = parser.parse_args()
+    verifiers = options.verifiers or signature_verifiers
+
+    tmpdir = tempfile.mkdtemp(prefix="bench-credentials-")
+    try:
+        xml, trusted = create_chain(tmpdir, options.depth)
+        print "credential with %d signatures, %d bytes" % (options.depth + 1, len(xml))
+        results = {}
+        for verifier in verifiers:
+            results[verifier] = bench(xml, trusted, verifier, options.rounds)
+            print "%-8s %8.2f ms/verify" % (verifier, results[verifier] * 1000)
+        if 'lxml' in results and 'xmlsec1' in results:
+            print "speedup  %8.1fx" % (results['xmlsec1'] / results['lxml'])
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# measure the throughput of a running SFA server
+#
+# several client threads send the same XML-RPC call over and over, and
+# the number of requests per second is reported; run it before and after
+# a server-side change, against the same server and with the same options
+#
+# usage: bench_server.py -k key -c cert [-n requests] [-t threads] url [method [args...]]
+# e.g.   bench_server.py -k ~/.sfi/me.pkey -c ~/.sfi/me.user.gid https://localhost:12346/ GetVersion
+
+import sys
+import time
+import threading
+from optparse import OptionParser
+
+from sfa.client.sfaserverproxy import SfaServerProxy, set_connection_pool_limits
+
+class Worker(threading.Thread):
+
+    def __init__(self, options, url, method, args, count):
+        threading.Thread.__init__(self)
+        self.options = options
+        self.url = url
+        self.method = method
+        self.args = args
+        self.count = count
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        server = SfaServerProxy(self.url, self.options.key_file, self.options.cert_file,
+                                timeout=self.options.timeout)
+        for i in range(self.count):
+            start = time.time()
+            try:
+                getattr(server, self.method)(*self.args)
+                self.latencies.append(time.time() - start)
+            except Exception, e:
+                self.errors += 1
+                if self.options.verbose:
+                    print >> sys.stderr, "%s failed: %s" % (self.method, e)
+
+def percentile(values, ratio):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def main():
+    parser = OptionParser(usage="%prog [options] url [method [args...]]")
+    parser.add_option("-k", "--key", dest="key_file", help="private key of the caller")
+    parser.add_option("-c", "--cert", dest="cert_file", help="certificate or gid of the caller")
+    parser.add_option("-n", "--requests", type="int", default=200,
+                      help="total number of requests [default %default]")
+    parser.add_option("-t", "--threads", type="int", default=10,
+                      help="number of concurrent clients [default %default]")
+    parser.add_option("-T", "--timeout", type="int", default=60,
+                      help="socket timeout in seconds [default %default]")
+    parser.add_option("-N", "--no-keepalive", action="store_true", default=False,
+                      help="open a new connection for each call")
+    parser.add_option("-v", "--verbose", action="store_true", default=False,
+                      help="report failed calls")
+    (options, args) = parser.parse_args()
+    if not args or not options.key_file or not options.cert_file:
+        parser.print_help()
+        sys.exit(1)
+    url = args[0]
+    if options.no_keepalive:
+        set_connection_pool_limits(max_per_host=0)
+    method = 'GetVersion'
+    if len(args) > 1:
+        method = args[1]
+    call_args = args[2:]
+
+    per_thread = max(1, options.requests / options.threads)
+    workers = [ Worker(options, url, method, call_args, per_thread)
+                for i in range(options.threads) ]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    latencies = sum([ worker.latencies for worker in workers ], [])
+    errors = sum([ worker.errors for worker in workers ])
+    print "%d %s calls in %.2f s with %d threads, %d errors" % \
+        (len(latencies) + errors, method, elapsed, options.threads, errors)
+    print "throughput %8.1f req/s" % (len(latencies) / elapsed)
+    print "latency    %8.1f ms median, %.1f ms p95" % \
+        (percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000)
+
+if __name__ == '__main__':
+    main()
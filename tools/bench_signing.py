@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# measure how fast credentials get signed, in-process vs with xmlsec1
+#
+# creates a throwaway root and site authority, then issues the same kind
+# of credential as GetCredential does, with each signer in turn, and
+# reports the credentials signed per second
+#
+# usage: bench_signing.py [-n count]
+
+import os
+import time
+import shutil
+import datetime
+import tempfile
+from optparse import OptionParser
+
+from sfa.trust.certificate import Keypair
+from sfa.trust.gid import GID
+from sfa.trust.credential import Credential, signature_signers
+
+def make_gid(hrn, urn, issuer=None, issuer_keys=None):
+    keys = Keypair(create=True)
+    gid = GID(subject=hrn, uuid=1, urn=urn)
+    gid.set_pubkey(keys)
+    gid.set_is_ca(issuer is None or hrn.count('.') < 2)
+    if issuer:
+        gid.set_issuer(issuer_keys, cert=issuer)
+        gid.set_parent(issuer)
+    else:
+        gid.set_issuer(keys, hrn)
+    gid.encode()
+    gid.sign()
+    return (gid, keys)
+
+def issue(caller, object, privkey, gid, signer):
+    cred = Credential(subject=object.get_subject())
+    cred.set_gid_caller(caller)
+    cred.set_gid_object(object)
+    cred.set_issuer_keys(privkey, gid)
+    cred.set_privileges("refresh,embed,bind,control,info")
+    cred.get_privileges().delegate_all_privileges(True)
+    cred.set_expiration(datetime.datetime.utcnow() + datetime.timedelta(days=28))
+    cred.encode()
+    cred.sign(signer)
+    return cred.save_to_string(save_parents=True)
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--count", type="int", default=100,
+                      help="number of credentials issued by each signer [default %default]")
+    (options, args) = parser.parse_args()
+
+    (root, root_keys) = make_gid("plc", "urn:publicid:IDN+plc+authority+sa")
+    (site, site_keys) = make_gid("plc.site", "urn:publicid:IDN+plc:site+authority+sa", root, root_keys)
+    (user, _) = make_gid("plc.site.user", "urn:publicid:IDN+plc:site+user+user", site, site_keys)
+    (slice, _) = make_gid("plc.site.slice", "urn:publicid:IDN+plc:site+slice+slice", site, site_keys)
+    # the registry hands files to Credential.set_issuer_keys
+    directory = tempfile.mkdtemp()
+    try:
+        privkey = os.path.join(directory, "site.pkey")
+        gid = os.path.join(directory, "site.gid")
+        site_keys.save_to_file(privkey)
+        site.save_to_file(gid, save_parents=True)
+
+        print "%8s %10s %12s" % ('signer', 'ms/cred', 'creds/s')
+        for signer in signature_signers:
+            start = time.time()
+            for i in range(options.count):
+                issue(user, slice, privkey, gid, signer)
+            elapsed = time.time() - start
+            print "%8s %10.1f %12.1f" % (signer, elapsed / options.count * 1000, options.count / elapsed)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()